@@ -0,0 +1,265 @@
+# analytics.py — сводная статистика ответов и потоковая выгрузка архива
+# - Tally — агрегаты одного среза (пара, вопрос, весь бот), обновляются на каждый ответ за O(1):
+#   число ответов, время от вопроса до «Передать ответ» (сумма, минимум, максимум и корзины
+#   по фиксированным границам — медиана оценивается без хранения выборки), сообщения ответа по типам,
+#   случайные и конкретные вопросы.
+# - Analytics — Tally пар, вопросов (банк, номер) и общий, плюс покрытие банков: карта номеров, на которые
+#   пара получила хотя бы один ответ (int-битмап, как в completions.py), и число таких номеров.
+#   Источник — поток записей архива (archive.py): чтение архива при старте собирает агрегаты тем же проходом,
+#   дальше каждая запись добавляется на месте; /stats и «Кто сейчас A/B?» ничего не пересчитывают.
+# - Выгрузка — генераторы: records() читает файл архива построчно, answer_rows / pair_rows / question_rows
+#   дают строки, csv_lines / jsonl_lines — текст по строке. Ответы выгружаются с постоянной памятью
+#   при любом размере истории; сводки по парам и вопросам держат в памяти только агрегаты.
+# Запуск: python analytics.py [answers|pairs|questions] [--format csv|jsonl] [--pair ID] [--out FILE] [ARCHIVE]
+
+import io
+import csv
+import sys
+import json
+import bisect
+import logging
+import argparse
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Any, Iterable, Iterator, Optional, Tuple
+
+# границы корзин времени ответа, секунды: минута, 5 и 15 минут, час, 3/6/12 часов, сутки, 2/3 и 7 дней
+LATENCY_BOUNDS = (60, 300, 900, 3600, 3 * 3600, 6 * 3600, 12 * 3600, 86400, 2 * 86400, 3 * 86400, 7 * 86400)
+ITEM_TYPES = ("text", "voice", "audio", "video_note")
+PICKS = ("random", "specific")
+
+
+class Tally:
+    __slots__ = ("answers", "timed", "seconds", "fastest", "slowest", "buckets", "items", "picks")
+
+    def __init__(self):
+        self.answers = 0
+        self.timed = 0                      # ответы, у которых известно время вопроса
+        self.seconds = 0.0
+        self.fastest: Optional[float] = None
+        self.slowest: Optional[float] = None
+        self.buckets = [0] * (len(LATENCY_BOUNDS) + 1)
+        self.items: Dict[str, int] = {}     # тип сообщения ответа → сколько
+        self.picks: Dict[str, int] = {}     # random | specific → сколько вопросов
+
+    def add(self, record: Dict[str, Any], latency: Optional[float]) -> None:
+        self.count(latency, _kinds(record), record.get("pick"))
+
+    def count(self, latency: Optional[float], kinds: Dict[str, int], pick: Optional[str]) -> None:
+        # запись уже разобрана (observe разбирает её один раз на все срезы)
+        self.answers += 1
+        if latency is not None:
+            self.timed += 1
+            self.seconds += latency
+            if self.fastest is None or latency < self.fastest:
+                self.fastest = latency
+            if self.slowest is None or latency > self.slowest:
+                self.slowest = latency
+            self.buckets[bisect.bisect_left(LATENCY_BOUNDS, latency)] += 1
+        items = self.items
+        for kind, n in kinds.items():
+            items[kind] = items.get(kind, 0) + n
+        if pick:
+            self.picks[pick] = self.picks.get(pick, 0) + 1
+
+    def mean(self) -> Optional[float]:
+        return self.seconds / self.timed if self.timed else None
+
+    def median_bound(self) -> Optional[float]:
+        # верхняя граница корзины, в которую попадает медиана; None — времени нет или медиана дольше недели
+        half, seen = (self.timed + 1) // 2, 0
+        for bound, n in zip(LATENCY_BOUNDS, self.buckets):
+            seen += n
+            if self.timed and seen >= half:
+                return bound
+        return None
+
+    def row(self) -> Dict[str, Any]:
+        mean = self.mean()
+        return {"answers": self.answers, "timed": self.timed,
+                "mean_seconds": round(mean, 1) if mean is not None else "",
+                "median_under_seconds": self.median_bound() or "",
+                "fastest_seconds": round(self.fastest, 1) if self.fastest is not None else "",
+                "slowest_seconds": round(self.slowest, 1) if self.slowest is not None else "",
+                **{f"items_{k}": self.items.get(k, 0) for k in ITEM_TYPES},
+                **{f"picks_{k}": self.picks.get(k, 0) for k in PICKS}}
+
+
+def _kinds(record: Dict[str, Any]) -> Dict[str, int]:
+    kinds: Dict[str, int] = {}
+    for item in record.get("items", ()):
+        kinds[item.get("type")] = kinds.get(item.get("type"), 0) + 1
+    return kinds
+
+
+def latency(record: Dict[str, Any]) -> Optional[float]:
+    # записи до появления времени вопроса («sent») его не знают
+    sent = record.get("sent")
+    return max(0.0, record["t"] - sent) if sent else None
+
+
+class Analytics:
+    def __init__(self):
+        self.total = Tally()
+        self.pairs: Dict[str, Tally] = {}
+        self.questions: Dict[Tuple[str, int], Tally] = {}
+        self.covered: Dict[Tuple[str, str], int] = {}       # (пара, банк) → карта номеров с ответом
+        self.covered_count: Dict[Tuple[str, str], int] = {}
+        self.banks_covered: Dict[str, int] = {}             # банк → номеров с ответом хоть в одной паре
+
+    def observe(self, record: Dict[str, Any]) -> None:
+        pid, bank, q = record["p"], record.get("bank", "default"), record["q"]
+        seconds, kinds, pick = latency(record), _kinds(record), record.get("pick")
+        self.total.count(seconds, kinds, pick)
+        pair = self.pairs.get(pid)
+        if pair is None:
+            pair = self.pairs[pid] = Tally()
+        pair.count(seconds, kinds, pick)
+        question = self.questions.get((bank, q))
+        if question is None:
+            question = self.questions[(bank, q)] = Tally()
+            self.banks_covered[bank] = self.banks_covered.get(bank, 0) + 1
+        question.count(seconds, kinds, pick)
+        key, bit = (pid, bank), 1 << q
+        bits = self.covered.get(key, 0)
+        if not bits & bit:
+            self.covered[key] = bits | bit
+            self.covered_count[key] = self.covered_count.get(key, 0) + 1
+
+    def pair(self, pair_id: str) -> Tally:
+        return self.pairs.get(pair_id) or Tally()
+
+    def question(self, bank: str, qnum: int) -> Tally:
+        return self.questions.get((bank, qnum)) or Tally()
+
+    def coverage(self, pair_id: str, bank: str) -> int:
+        return self.covered_count.get((pair_id, bank), 0)
+
+
+def duration(seconds: float) -> str:
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds} с"
+    minutes = seconds // 60
+    if minutes < 60:
+        return f"{minutes} мин"
+    hours, minutes = divmod(minutes, 60)
+    if hours < 24:
+        return f"{hours} ч {minutes} мин" if minutes else f"{hours} ч"
+    days, hours = divmod(hours, 24)
+    return f"{days} дн {hours} ч" if hours else f"{days} дн"
+
+
+# ---------- ВЫГРУЗКА ----------
+def records(path: Path, pair_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    # построчно, без чтения архива целиком; недописанная последняя строка пропускается
+    with open(path, "rb") as f:
+        for n, line in enumerate(f, 1):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logging.warning("%s:%s: обрезанная запись пропущена", path.name, n)
+                continue
+            if pair_id is None or record["p"] == pair_id:
+                yield record
+
+
+def _iso(ts: Optional[float]) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat(timespec="seconds") if ts else ""
+
+
+ANSWER_FIELDS = ("pair", "bank", "q", "pick", "from", "to", "sent_at", "answered_at", "seconds",
+                 *(f"items_{k}" for k in ITEM_TYPES), "question")
+
+
+def answer_rows(source: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    for record in source:
+        items = _kinds(record)
+        seconds = latency(record)
+        yield {"pair": record["p"], "bank": record.get("bank", "default"), "q": record["q"],
+               "pick": record.get("pick") or "", "from": record.get("from"), "to": record.get("to"),
+               "sent_at": _iso(record.get("sent")), "answered_at": _iso(record["t"]),
+               "seconds": round(seconds, 1) if seconds is not None else "",
+               **{f"items_{k}": items.get(k, 0) for k in ITEM_TYPES}, "question": record.get("qt") or ""}
+
+
+PAIR_FIELDS = ("pair", *Tally().row(), "covered")
+QUESTION_FIELDS = ("bank", "q", *Tally().row())
+
+
+def _fold(source: Iterable[Dict[str, Any]]) -> Analytics:
+    stats = Analytics()
+    for record in source:
+        stats.observe(record)
+    return stats
+
+
+def pair_rows(source: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    stats = _fold(source)
+    covered: Dict[str, int] = {}
+    for (pid, _), n in stats.covered_count.items():
+        covered[pid] = covered.get(pid, 0) + n
+    for pid, tally in stats.pairs.items():
+        yield {"pair": pid, **tally.row(), "covered": covered[pid]}
+
+
+def question_rows(source: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    stats = _fold(source)
+    for (bank, q), tally in sorted(stats.questions.items()):
+        yield {"bank": bank, "q": q, **tally.row()}
+
+
+def csv_lines(rows: Iterable[Dict[str, Any]], fields: Iterable[str]) -> Iterator[str]:
+    # одна строка CSV за шаг: буфер переиспользуется и не растёт
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=list(fields), lineterminator="\n")
+    writer.writeheader()
+    for row in rows:
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+        writer.writerow(row)
+    yield buf.getvalue()
+
+
+def jsonl_lines(rows: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+KINDS = {"answers": (answer_rows, ANSWER_FIELDS), "pairs": (pair_rows, PAIR_FIELDS),
+         "questions": (question_rows, QUESTION_FIELDS)}
+
+
+def export(path: Path, kind: str = "answers", fmt: str = "csv", pair_id: Optional[str] = None) -> Iterator[str]:
+    make_rows, fields = KINDS[kind]
+    rows = make_rows(records(path, pair_id))
+    return csv_lines(rows, fields) if fmt == "csv" else jsonl_lines(rows)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Выгрузка архива ответов")
+    ap.add_argument("kind", nargs="?", choices=tuple(KINDS), default="answers")
+    ap.add_argument("archive", nargs="?", help="файл архива (по умолчанию ARCHIVE_PATH бота)")
+    ap.add_argument("--format", choices=("csv", "jsonl"), default="csv")
+    ap.add_argument("--pair")
+    ap.add_argument("--out", help="файл; по умолчанию stdout")
+    args = ap.parse_args()
+    if args.archive:
+        path = Path(args.archive)
+    else:
+        from bot import ARCHIVE_FILE
+        path = ARCHIVE_FILE
+    if not path.exists():
+        raise SystemExit(f"Нет файла архива: {path}")
+    out = open(args.out, "w", encoding="utf-8", newline="") if args.out else sys.stdout
+    try:
+        for line in export(path, args.kind, args.format, args.pair):
+            out.write(line)
+    finally:
+        if args.out:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
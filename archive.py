@@ -0,0 +1,311 @@
+# archive.py — архив переданных ответов и полнотекстовый поиск по нему
+# - Каждый «Передать ответ» — запись: пара, банк, номер и текст вопроса, время, автор и черновики ответа
+#   (текст, подписи, file_id и message_id медиа). Записи дописываются строкой JSON в файл архива
+#   и читаются один раз: start() при старте бота читает файл в отдельном потоке, обработчики ждут
+#   ready() — цикл событий не стоит, пока разбирается архив. Ответы, переданные во время чтения,
+#   копятся и учитываются после него; недописанная строка в конце файла отрезается до первой записи.
+# - Обратный индекс пары строится по мере добавления: термин → битовая карта номеров записей
+#   (int, как карты закрытых вопросов в completions.py).
+#   Термины — основы слов (stem, упрощённый Snowball для русского, с кэшем: словарь пары невелик)
+#   из ответов, подписей и текста вопроса.
+# - Поиск — AND карт по терминам запроса, без просмотра архива: число найденного — bit_count(),
+#   страница — старшие биты (новые записи первыми). История — срез списка записей пары с конца.
+# - Каждая запись — при чтении и при добавлении — учитывается в сводной статистике (analytics.py).
+
+import gc
+import re
+import json
+import asyncio
+import logging
+import functools
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+
+from analytics import Analytics
+
+# ---------- НОРМАЛИЗАЦИЯ ----------
+_WORD = re.compile(r"[0-9a-zа-я]+")
+_CYRILLIC = re.compile(r"[а-я]")
+_VOWEL = re.compile(r"[аеиоуыэюя]")
+_R = re.compile(r"[аеиоуыэюя][^аеиоуыэюя]")
+
+_PERFECTIVE = re.compile(r"(?:ивши|ившись|ив|ывши|ывшись|ыв|(?<=[ая])(?:вши|вшись|в))$")
+_REFLEXIVE = re.compile(r"(?:ся|сь)$")
+_ADJECTIVE = re.compile(r"(?:ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)$")
+_PARTICIPLE = re.compile(r"(?:ивш|ывш|ующ|(?<=[ая])(?:ем|нн|вш|ющ|щ))$")
+_VERB = re.compile(r"(?:ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|ены|"
+                   r"ить|ыть|ишь|ую|ю|(?<=[ая])(?:ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно))$")
+_NOUN = re.compile(r"(?:а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|ях|"
+                   r"ы|ь|ию|ью|ю|ия|ья|я)$")
+_DERIVATIONAL = re.compile(r"ость?$")
+_SUPERLATIVE = re.compile(r"ейше?$")
+
+STOPWORDS = frozenset(
+    "и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по только ее мне было "
+    "вот от меня еще нет о из ему когда даже ну ли если уже или ни быть был него до вас там потом себя "
+    "ей может они тут где есть надо ней для мы тебя их чем была сам без чего раз тоже себе под будет "
+    "тогда кто этот того потому этого какой ним здесь этом мой тем чтобы нее были всех можно при об "
+    "это эти нас про них эту моя свою этой".split()
+)
+
+
+def _cut(rx: "re.Pattern", rv: str) -> Optional[str]:
+    m = rx.search(rv)
+    return rv[:m.start()] if m else None
+
+
+def stem(word: str) -> str:
+    # Snowball (Porter) для русского: окончания снимаются только в RV — после первой гласной
+    m = _VOWEL.search(word)
+    if m is None:
+        return word
+    pre, rv = word[:m.end()], word[m.end():]
+    cut = _cut(_PERFECTIVE, rv)
+    if cut is None:
+        reflexive = _cut(_REFLEXIVE, rv)
+        if reflexive is not None:
+            rv = reflexive
+        cut = _cut(_ADJECTIVE, rv)
+        if cut is not None:
+            participle = _cut(_PARTICIPLE, cut)
+            cut = cut if participle is None else participle
+        else:
+            cut = _cut(_VERB, rv)
+            if cut is None:
+                cut = _cut(_NOUN, rv)
+    if cut is not None:
+        rv = cut
+    if rv.endswith("и"):
+        rv = rv[:-1]
+    # словообразовательное -ость только в R2
+    word = pre + rv
+    r1 = _R.search(word)
+    r2 = _R.search(word, r1.end()) if r1 else None
+    m = _DERIVATIONAL.search(rv)
+    if m and r2 and len(pre) + m.start() >= r2.end():
+        rv = rv[:m.start()]
+    if rv.endswith("нн"):
+        rv = rv[:-1]
+    else:
+        cut = _cut(_SUPERLATIVE, rv)
+        if cut is not None:
+            rv = cut[:-1] if cut.endswith("нн") else cut
+        elif rv.endswith("ь"):
+            rv = rv[:-1]
+    return pre + rv
+
+
+@functools.lru_cache(maxsize=65536)
+def _term(word: str) -> str:
+    # "" — слово не индексируется
+    if len(word) < 2 or word in STOPWORDS:
+        return ""
+    return stem(word) if _CYRILLIC.search(word) else word
+
+
+def terms(text: str) -> List[str]:
+    return [t for t in map(_term, _WORD.findall(text.lower().replace("ё", "е"))) if t]
+
+
+def record_text(record: Dict[str, Any]) -> str:
+    parts = [record.get("qt") or ""]
+    for item in record.get("items", []):
+        data = item.get("data") or {}
+        parts.append(data.get("text") or data.get("caption") or "")
+    return "\n".join(parts)
+
+
+def _bitmap(ids: List[int]) -> int:
+    buf = bytearray((ids[-1] >> 3) + 1)
+    for i in ids:
+        buf[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(buf, "little")
+
+
+def _top(bits: int, skip: int, count: int) -> List[int]:
+    # номера старших установленных битов: пропустить skip, вернуть count
+    out: List[int] = []
+    while bits and len(out) < count:
+        i = bits.bit_length() - 1
+        bits &= ~(1 << i)
+        if skip:
+            skip -= 1
+        else:
+            out.append(i)
+    return out
+
+
+# ---------- АРХИВ ----------
+class AnswerArchive:
+    def __init__(self, path: Path):
+        self.path = path
+        self.records: Dict[str, List[Dict[str, Any]]] = {}       # pair_id → записи по времени
+        self.index: Dict[str, Dict[str, int]] = {}               # pair_id → термин → карта номеров записей
+        self.analytics = Analytics()
+        self._file = None
+        self._loaded = False
+        self._loading: Optional[asyncio.Task] = None
+        self._pending: List[Dict[str, Any]] = []                # добавлены, пока архив читается
+
+    def _repair(self) -> int:
+        # недописанная последняя строка после падения: отрезаем, иначе следующая запись приклеится к ней;
+        # читается только хвост файла. Возвращает размер файла после этого
+        try:
+            size = self.path.stat().st_size
+        except FileNotFoundError:
+            return 0
+        end = size
+        with open(self.path, "r+b") as f:
+            while end:
+                start = max(0, end - 4096)
+                f.seek(start)
+                chunk = f.read(end - start)
+                cut = chunk.rfind(b"\n")
+                if cut >= 0:
+                    end = start + cut + 1
+                    break
+                end = start
+            if end != size:
+                logging.warning("%s: обрезанная запись в конце отброшена (%s байт)", self.path.name, size - end)
+                f.truncate(end)
+        return end
+
+    def _read(self, size: int) -> Tuple[Dict[str, List[Dict[str, Any]]], Dict[str, Dict[str, int]], Analytics]:
+        # первые size байт архива → записи, индекс и агрегаты; self не трогает, поэтому годится для потока.
+        # Сборщик мусора выключен: он обходил бы растущий архив много раз, держа GIL, — как при чтении состояния.
+        # Прочитанное уходит в постоянное поколение (gc.freeze) до включения сборщика: записи живут до остановки,
+        # а первая же полная сборка после чтения обошла бы их все
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            loaded = self._parse(size)
+            gc.freeze()
+            return loaded
+        finally:
+            if enabled:
+                gc.enable()
+
+    def _parse(self, size: int) -> Tuple[Dict[str, List[Dict[str, Any]]], Dict[str, Dict[str, int]], Analytics]:
+        by_pair: Dict[str, List[Dict[str, Any]]] = {}
+        postings: Dict[str, Dict[str, List[int]]] = {}
+        stats = Analytics()
+        offset = 0
+        with open(self.path, "rb") as f:
+            for n, line in enumerate(f, 1):
+                offset += len(line)
+                if offset > size:
+                    break           # дописано уже после начала чтения: эти записи придут через add()
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logging.warning("%s:%s: испорченная запись пропущена", self.path.name, n)
+                    continue
+                records = by_pair.setdefault(record["p"], [])
+                rid = len(records)
+                records.append(record)
+                stats.observe(record)
+                index = postings.setdefault(record["p"], {})
+                for term in set(terms(record_text(record))):
+                    index.setdefault(term, []).append(rid)
+        # карты собираются один раз из списков: побитовое |= на каждую запись копировало бы карту целиком
+        return by_pair, {pid: {t: _bitmap(ids) for t, ids in index.items()} for pid, index in postings.items()}, stats
+
+    def _install(self, loaded: Tuple[Dict[str, List[Dict[str, Any]]], Dict[str, Dict[str, int]], Analytics],
+                 pending: List[Dict[str, Any]]) -> None:
+        self.records, self.index, self.analytics = loaded
+        self._loaded = True
+        for record in pending:
+            self._index(record)
+        logging.info("Архив ответов: %s записей", sum(len(r) for r in self.records.values()))
+
+    def load(self) -> None:
+        # синхронное чтение — для выгрузок и бенчмарков; бот читает архив через start()/ready()
+        if self._loaded:
+            return
+        size = self._repair()
+        # файл читается целиком, вместе с тем, что накопилось в _pending
+        self._install(self._read(size) if size else ({}, {}, Analytics()), [])
+        self._pending = []
+
+    def start(self) -> "asyncio.Task":
+        # чтение архива в отдельном потоке; хвост чинится здесь, до первого add()
+        if self._loading is None:
+            size = 0 if self._loaded else self._repair()
+            self._loading = asyncio.create_task(self._load_async(size))
+        return self._loading
+
+    async def _load_async(self, size: int) -> None:
+        loaded = await asyncio.to_thread(self._read, size) if size else ({}, {}, Analytics())
+        if not self._loaded:
+            # на цикле событий: add() не может вклиниться между установкой и доучётом
+            pending, self._pending = self._pending, []
+            self._install(loaded, pending)
+
+    async def ready(self) -> None:
+        # обработчики ждут архив здесь, не блокируя цикл; после загрузки — сразу
+        if not self._loaded:
+            await asyncio.shield(self.start())
+
+    def _index(self, record: Dict[str, Any]) -> None:
+        pid = record["p"]
+        records = self.records.setdefault(pid, [])
+        rid = len(records)
+        records.append(record)
+        self.analytics.observe(record)
+        index = self.index.setdefault(pid, {})
+        bit = 1 << rid
+        for term in set(terms(record_text(record))):
+            index[term] = index.get(term, 0) | bit
+
+    def add(self, record: Dict[str, Any]) -> None:
+        # строка уходит в файл сразу (без fsync — его делает ОС или close); индекс обновляется на месте.
+        # Пока архив читается, запись ждёт в _pending; если чтение не начиналось, её подхватит файл —
+        # «Передать ответ» загрузку не ждёт
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self._file.flush()
+        if self._loaded:
+            self._index(record)
+        elif self._loading is not None:
+            self._pending.append(record)
+
+    # ---------- чтение ----------
+    def count(self, pair_id: str) -> int:
+        self.load()
+        return len(self.records.get(pair_id, ()))
+
+    def get(self, pair_id: str, rid: int) -> Optional[Dict[str, Any]]:
+        self.load()
+        records = self.records.get(pair_id, [])
+        return records[rid] if 0 <= rid < len(records) else None
+
+    def stats(self) -> Analytics:
+        self.load()
+        return self.analytics
+
+    def history(self, pair_id: str, page: int, per_page: int) -> Tuple[List[int], int]:
+        # номера записей страницы, новые первыми, и общее число записей
+        total = self.count(pair_id)
+        hi = total - page * per_page
+        return list(range(hi - 1, max(hi - per_page, 0) - 1, -1)), total
+
+    def search(self, pair_id: str, query: str, page: int, per_page: int) -> Tuple[List[int], int]:
+        # записи, где встречаются все термины запроса (в ответе или в тексте вопроса): страница, новые
+        # первыми, и общее число найденного
+        self.load()
+        index = self.index.get(pair_id, {})
+        wanted = set(terms(query))
+        if not wanted:
+            return [], 0
+        hits = -1
+        for term in wanted:
+            hits &= index.get(term, 0)
+            if not hits:
+                return [], 0
+        return _top(hits, page * per_page, per_page), hits.bit_count()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,232 @@
+# bench_analytics.py — сводная статистика ответов и потоковая выгрузка архива
+# 1) Через бота: пары задают случайные и конкретные вопросы и отвечают разными типами сообщений;
+#    /stats показывает число ответов, типы, выбор вопросов, время до ответа и покрытие банка,
+#    агрегаты совпадают с пересчётом по файлу архива и после перезапуска.
+# 2) Стоимость: учёт одной записи и сводка /stats на большом архиве — против пересчёта сводки
+#    проходом по записям пары при каждом вызове.
+# 3) Чтение большого архива при старте идёт в потоке: самая долгая остановка цикла событий — против
+#    синхронного чтения; ответы, переданные во время чтения, учтены ровно один раз.
+# 4) Выгрузка CSV/JSON Lines: пиковая память (tracemalloc) не растёт с размером архива.
+# Запуск: python benchmarks/bench_analytics.py [--records 200000] [--pairs 2000]
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+_tmp = tempfile.mkdtemp(prefix="bench_analytics_")
+os.environ["TELEGRAM_TOKEN"] = "123456:TEST"
+os.environ["STATE_FILE_PATH"] = str(Path(_tmp) / "state.json")
+
+import bot  # noqa: E402
+import analytics  # noqa: E402
+from analytics import Analytics, Tally, latency, records, export  # noqa: E402
+from archive import AnswerArchive  # noqa: E402
+from fake_api import FakeBot, restart, dispatch, text_update, voice_update, video_note_update, callback_update  # noqa: E402
+
+BASE_UID = 95_000_000
+TYPES = ("text", "voice", "audio", "video_note")
+
+
+def rows(stats: Analytics):
+    return {pid: tally.row() for pid, tally in stats.pairs.items()}, \
+           {key: tally.row() for key, tally in stats.questions.items()}, dict(stats.covered_count)
+
+
+async def through_bot() -> None:
+    d = Path(tempfile.mkdtemp(prefix="analytics_bot_", dir=_tmp))
+    bot.ARCHIVE = AnswerArchive(d / "state.archive.jsonl")
+    app = bot.build_app()
+    api = FakeBot()
+    await restart("sqlite", d, api)
+    a, b = BASE_UID, BASE_UID + 1
+    await dispatch(app, api, text_update(api, a, "/start"))
+    await dispatch(app, api, text_update(api, b, f"/join {bot.get_pair(a)['code']}"))
+    # раунды: (как выбран вопрос, через сколько секунд ответ, сообщения ответа)
+    rounds = [("random", 90, ("text", "voice")), ("specific", 2 * 3600, ("video_note",)),
+              ("random", 30, ("voice", "voice", "text")), ("specific", 86400 + 600, ("text",))]
+    for n, (pick, wait, kinds) in enumerate(rounds):
+        asker, answerer = bot.get_pair(a)["roles"]["A"], bot.get_pair(a)["roles"]["B"]
+        if pick == "random":
+            await dispatch(app, api, callback_update(api, asker, "ask_random"))
+        else:
+            await dispatch(app, api, callback_update(api, asker, "ask_specific"))
+            await dispatch(app, api, text_update(api, asker, str(n + 1)))
+        pair = bot.get_pair(a)
+        assert pair["pending"]["pick"] == pick
+        pair["pending"]["sent_at"] -= wait          # вопрос «был задан» wait секунд назад
+        for k, kind in enumerate(kinds):
+            make = {"text": lambda: text_update(api, answerer, f"ответ {n}.{k}"),
+                    "voice": lambda: voice_update(api, answerer, f"v{n}.{k}"),
+                    "video_note": lambda: video_note_update(api, answerer, f"n{n}.{k}")}[kind]
+            await dispatch(app, api, make())
+        await dispatch(app, api, callback_update(api, answerer, "send_answer"))
+    await dispatch(app, api, callback_update(api, bot.get_pair(a)["roles"]["A"], "ask_random"))
+    await bot.get_outbox().idle()
+
+    # пересчёт по файлу архива даёт те же агрегаты; перезапуск (SQLite хранит pick активного вопроса) — тоже
+    live = bot.get_archive().stats()
+    assert rows(live) == rows(analytics._fold(records(bot.get_archive().path)))
+    await restart("sqlite", d, api)
+    assert bot.get_pair(a)["pending"]["pick"] == "random"
+    bot.get_archive().close()
+    bot.ARCHIVE = AnswerArchive(d / "state.archive.jsonl")
+    await bot.get_archive().ready()
+    assert rows(bot.get_archive().stats()) == rows(live)
+
+    await dispatch(app, api, text_update(api, a, "/stats"))
+    text = api.calls[-1]["text"]
+    assert "Ответов получено: 4 (текст — 3, голосовые — 3, кружочки — 1)" in text, text
+    assert "Вопросов: случайных 3, конкретных 2" in text, text      # два отвеченных случайных + активный
+    assert "быстрее всего 30 с" in text and "у половины — до 5 мин" in text, text
+    covered = len({r["q"] for r in bot.get_archive().records[bot.get_pair(a)["id"]]})
+    assert f"Покрытие банка «default»: {covered} из {len(bot.bank_for(bot.get_pair(a)))}" in text, text
+    await dispatch(app, api, callback_update(api, a, "whois"))
+    assert "Ответов в паре: 4, в среднем за 6 ч 33 мин" in api.calls[-1]["text"], api.calls[-1]["text"]
+    await bot.ACKS.stop()
+    await bot.get_outbox().stop()
+    await bot.STORE.stop()
+    bot.get_archive().close()
+    print("through bot: /stats and whois from aggregates, same as recount from archive and after restart: ok")
+
+
+def make_archive(path: Path, n: int, pairs: int) -> None:
+    rng = random.Random(7)
+    now = time.time()
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(n):
+            t = now - (n - i) * 60
+            items = [{"type": rng.choice(TYPES), "data": {"file_id": f"f{i}.{k}", "caption": None}}
+                     for k in range(rng.randint(1, 4))]
+            f.write(json.dumps({"p": str(rng.randrange(pairs) + 1), "bank": "default", "q": rng.randint(1, 500),
+                                "qt": f"Вопрос {i % 500}: что запомнилось больше всего?", "t": t,
+                                "from": BASE_UID, "to": BASE_UID + 1, "sent": t - rng.expovariate(1 / 7200),
+                                "pick": rng.choice(("random", "specific")), "items": items},
+                               ensure_ascii=False, separators=(",", ":")) + "\n")
+
+
+def recount(arch: AnswerArchive, pair_id: str) -> Tally:
+    # как раньше считалась бы сводка: проход по записям пары при каждом вызове
+    tally = Tally()
+    for record in arch.records.get(pair_id, ()):
+        tally.add(record, latency(record))
+    return tally
+
+
+def cost(n: int, pairs: int) -> None:
+    path = Path(_tmp) / "big.archive.jsonl"
+    make_archive(path, n, pairs)
+    arch = AnswerArchive(path)
+    t0 = time.perf_counter()
+    arch.load()
+    loaded = time.perf_counter() - t0
+    stats = arch.stats()
+    assert stats.total.answers == n
+    # пара с записями есть при любом --records; её агрегаты дальше раздуты замером observe
+    record = dict(next(v for v in arch.records.values() if v)[-1])
+    t0 = time.perf_counter()
+    for _ in range(100_000):
+        stats.observe(record)
+    observe = (time.perf_counter() - t0) / 100_000
+    pair_ids = [str(p + 1) for p in range(pairs)]
+    assert all(recount(arch, p).row() == stats.pair(p).row() for p in pair_ids[:50] if p != record["p"])
+    t0 = time.perf_counter()
+    for p in pair_ids:
+        stats.pair(p).row()
+    fast = (time.perf_counter() - t0) / pairs
+    t0 = time.perf_counter()
+    for p in pair_ids:
+        recount(arch, p).row()
+    slow = (time.perf_counter() - t0) / pairs
+    print(f"{n} records / {pairs} pairs: archive load {loaded:.2f}s (aggregates in the same pass), "
+          f"observe {observe * 1e9:.0f}ns/record, pair summary {fast * 1e6:.1f}us vs recount {slow * 1e6:.0f}us")
+    arch.close()
+    return loaded
+
+
+async def background(n: int, pairs: int, loaded: float) -> None:
+    path = Path(_tmp) / "big.archive.jsonl"
+    arch = AnswerArchive(path)
+    stall, stop = 0.0, False
+
+    async def ticker():
+        nonlocal stall
+        last = time.perf_counter()
+        while not stop:
+            await asyncio.sleep(0.001)
+            now = time.perf_counter()
+            stall, last = max(stall, now - last), now
+    tick = asyncio.create_task(ticker())
+    t0 = time.perf_counter()
+    arch.start()
+    on_loop = time.perf_counter() - t0
+    # ответы, переданные, пока архив читается: в файл сразу, в индекс и агрегаты — после чтения
+    extra = [{"p": "1", "bank": "default", "q": 7, "qt": "Вопрос во время загрузки", "t": time.time(),
+              "from": BASE_UID, "to": BASE_UID + 1, "pick": "random",
+              "items": [{"type": "text", "data": {"text": f"пока читается {k}"}}]} for k in range(5)]
+    for record in extra:
+        arch.add(record)
+        await asyncio.sleep(0.01)
+    await arch.ready()
+    stop = True
+    await tick
+    assert arch.stats().total.answers == n + len(extra), arch.stats().total.answers
+    assert arch.search("1", "читается", 0, 10)[1] == len(extra)
+    fresh = AnswerArchive(path)
+    fresh.load()
+    assert rows(fresh.stats()) == rows(arch.stats())
+    print(f"{n} records loaded in a thread: {on_loop * 1e3:.1f}ms on the loop to start, longest loop stall "
+          f"{stall * 1e3:.0f}ms (synchronous load {loaded:.2f}s), {len(extra)} answers during load counted once: ok")
+    arch.close()
+
+
+def export_peak(path: Path, kind: str, fmt: str) -> tuple:
+    tracemalloc.start()
+    size = 0
+    for line in export(path, kind, fmt):
+        size += len(line)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return size, peak
+
+
+def exports(n: int, pairs: int) -> None:
+    small = Path(_tmp) / "small.archive.jsonl"
+    make_archive(small, n // 10, pairs)
+    big = Path(_tmp) / "big.archive.jsonl"
+    for fmt in ("csv", "jsonl"):
+        s_size, s_peak = export_peak(small, "answers", fmt)
+        b_size, b_peak = export_peak(big, "answers", fmt)
+        assert b_peak < 2 * s_peak + (64 << 10), (s_peak, b_peak)
+        print(f"export answers {fmt:>5}: {n // 10} records → {s_size / 1e6:.1f} MB, peak {s_peak / 1024:.0f} KB; "
+              f"{n} records → {b_size / 1e6:.1f} MB, peak {b_peak / 1024:.0f} KB")
+    lines = list(export(big, "pairs", "csv"))
+    assert len(lines) == len({r["p"] for r in records(big)}) + 1 and lines[0].startswith("pair,answers,")
+    first = next(export(big, "questions", "jsonl"))
+    assert json.loads(first)["bank"] == "default"
+    _, peak = export_peak(big, "questions", "csv")
+    print(f"export pairs/questions: summaries only in memory (questions peak {peak / 1024:.0f} KB): ok")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--records", type=int, default=200_000)
+    ap.add_argument("--pairs", type=int, default=2000)
+    args = ap.parse_args()
+    asyncio.run(through_bot())
+    loaded = cost(args.records, args.pairs)
+    asyncio.run(background(args.records, args.pairs, loaded))
+    exports(args.records, args.pairs)
+
+
+if __name__ == "__main__":
+    main()
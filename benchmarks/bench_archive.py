@@ -0,0 +1,160 @@
+# bench_archive.py — архив ответов: индексирование, поиск и история на десятках тысяч записей
+# - Синтетические ответы из русских фраз; поиск по индексу против прохода по всему архиву
+#   (тот же stem, чтобы сравнивались только структуры данных), совпадение результатов проверяется.
+# - Перечитывание архива с диска (холодный старт) и восстановление после обрезанной строки.
+# - Через бота: «Передать ответ» → запись в архиве, /history, /search и повторная отправка по кнопке.
+# Запуск: python benchmarks/bench_archive.py [--records 50000] [--queries 2000]
+
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+_tmp = tempfile.mkdtemp(prefix="bench_archive_")
+os.environ["TELEGRAM_TOKEN"] = "123456:TEST"
+os.environ["STATE_FILE_PATH"] = str(Path(_tmp) / "state.json")
+
+import bot  # noqa: E402
+from archive import AnswerArchive, terms, record_text  # noqa: E402
+from delivery import RateLimiter  # noqa: E402
+from fake_api import FakeBot, dispatch, text_update, voice_update, callback_update  # noqa: E402
+
+WORDS = ("море прогулка набережная путешествие детство мама папа книга фильм музыка осень зима лето весна "
+         "работа друзья дом кухня собака кошка мечта страх радость счастье поездка горы лес река вечер "
+         "утро праздник подарок школа университет город деревня песня танец любовь встреча разговор "
+         "воспоминание бабушка дедушка сестра брат отпуск поезд самолёт театр концерт кофе чай").split()
+FORMS = ("", "и", "ы", "ой", "ами", "ах", "е", "у")
+
+
+def phrase(rng: random.Random, n: int) -> str:
+    return " ".join(rng.choice(WORDS) + (rng.choice(FORMS) if rng.random() < 0.3 else "") for _ in range(n))
+
+
+def make_records(n: int, pair_id: str = "1"):
+    rng = random.Random(1)
+    for i in range(n):
+        items = [{"type": "text", "data": {"text": phrase(rng, rng.randint(5, 40))}} for _ in range(rng.randint(1, 3))]
+        if rng.random() < 0.3:
+            items.append({"type": "voice", "data": {"file_id": f"v{i}", "caption": phrase(rng, 3)}})
+        yield {"p": pair_id, "bank": "default", "q": rng.randint(1, 127), "qt": f"Вопрос: {phrase(rng, 8)}?",
+               "t": 1.7e9 + i * 60, "from": 1 + i % 2, "to": 2 - i % 2, "items": items}
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def scan(arch: AnswerArchive, pair_id: str, query: str):
+    # без индекса: каждое слово каждой записи на каждый запрос
+    wanted = set(terms(query))
+    return [rid for rid in range(len(arch.records[pair_id]) - 1, -1, -1)
+            if wanted and wanted <= set(terms(record_text(arch.records[pair_id][rid])))]
+
+
+def bench_index(n: int, queries: int) -> None:
+    path = Path(_tmp) / "archive.jsonl"
+    arch = AnswerArchive(path)
+    arch.load()
+    t0 = time.perf_counter()
+    for rec in make_records(n):
+        arch.add(rec)
+    t_add = (time.perf_counter() - t0) / n
+    size = path.stat().st_size
+    arch.close()
+
+    rng = random.Random(2)
+    qs = [" ".join(rng.choice(WORDS) + rng.choice(FORMS) for _ in range(rng.randint(1, 3))) for _ in range(queries)]
+    lat, hits = [], 0
+    for q in qs:
+        t0 = time.perf_counter()
+        arch.search("1", q, 0, bot.HISTORY_PER_PAGE)
+        lat.append(time.perf_counter() - t0)
+        hits += arch.search("1", q, 0, 0)[1]
+    t0 = time.perf_counter()
+    for q in qs[:5]:
+        assert arch.search("1", q, 0, n)[0] == scan(arch, "1", q), q
+    t_scan = (time.perf_counter() - t0) / 5
+    t0 = time.perf_counter()
+    for page in range(200):
+        arch.history("1", page, bot.HISTORY_PER_PAGE)
+    t_hist = (time.perf_counter() - t0) / 200
+    print(f"{n} answers ({size / 1e6:.1f} MB): add {t_add * 1e6:.0f}us/record | search page p50 "
+          f"{pct(lat, 0.5) * 1e6:.0f}us p99 {pct(lat, 0.99) * 1e6:.0f}us ({hits / queries:.0f} hits/query) "
+          f"vs full scan {t_scan * 1e3:.0f}ms | history page {t_hist * 1e6:.1f}us")
+
+    t0 = time.perf_counter()
+    cold = AnswerArchive(path)
+    cold.load()
+    t_load = time.perf_counter() - t0
+    assert cold.count("1") == n and cold.index == arch.index
+    with open(path, "ab") as f:
+        f.write(b'{"p":"1","q":')          # оборванная запись, как после падения
+    torn = AnswerArchive(path)
+    torn.load()
+    assert torn.count("1") == n and path.stat().st_size == size
+    torn.add(next(make_records(1)))
+    assert AnswerArchive(path).count("1") == n + 1
+    torn.close()
+    print(f"cold load {t_load:.2f}s ({n / t_load:.0f} records/s), torn tail recovered: ok")
+
+
+async def through_bot() -> None:
+    api = FakeBot()
+    app = bot.build_app()
+    bot.STORE.start()
+    bot.get_outbox().limiter = RateLimiter(1e9, 1e9, 1e9)
+    bot.get_outbox().start(api)
+    a, b = 50_000_000, 50_000_001
+    await dispatch(app, api, text_update(api, a, "/start"))
+    await dispatch(app, api, text_update(api, b, f"/join {bot.get_pair(a)['code']}"))
+    for i in range(12):
+        asker, answerer = (a, b) if i % 2 == 0 else (b, a)
+        await dispatch(app, api, callback_update(api, asker, "ask_random"))
+        await dispatch(app, api, text_update(api, answerer, f"Ответ {i}: вспоминаю морские прогулки" if i == 7
+                                             else f"Ответ {i}: про книги и фильмы"))
+        await dispatch(app, api, voice_update(api, answerer, f"voice{i}"))
+        await dispatch(app, api, callback_update(api, answerer, "send_answer"))
+    await bot.get_outbox().idle()
+    pid = bot.get_pair(a)["id"]
+    assert bot.get_archive().count(pid) == 12
+
+    api.calls.clear()
+    await dispatch(app, api, text_update(api, a, "/history"))
+    page = api.calls[-1]
+    assert "стр. 1/3" in page["text"] and "Ответ 11" in page["text"] and "голосовых: 1" in page["text"]
+    await dispatch(app, api, callback_update(api, a, "hist_2"))
+    assert "Ответ 0" in api.calls[-1]["text"] and "стр. 3/3" in api.calls[-1]["text"]
+
+    await dispatch(app, api, text_update(api, b, "/search морская прогулка"))
+    found = api.calls[-1]
+    assert "найдено 1" in found["text"] and "Ответ 7" in found["text"], found["text"]
+    rid = found["reply_markup"].inline_keyboard[0][0].callback_data
+    api.calls.clear()
+    await dispatch(app, api, callback_update(api, b, rid))
+    await bot.get_outbox().idle()
+    assert any(c["method"] == "copy_messages" for c in api.calls)
+    await bot.get_outbox().stop()
+    await bot.STORE.stop()
+    bot.get_archive().close()
+    print("through bot: 12 answers archived, /history pages, /search, resend: ok")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--records", type=int, default=50_000)
+    ap.add_argument("--queries", type=int, default=2000)
+    args = ap.parse_args()
+    bench_index(args.records, args.queries)
+    asyncio.run(through_bot())
+
+
+if __name__ == "__main__":
+    main()
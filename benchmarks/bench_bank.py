@@ -0,0 +1,99 @@
+# bench_bank.py — банк вопросов: чтение списка целиком против индекса смещений с чтением по запросу
+# Отдельно: файл банка переписывают на месте (короче и длиннее) между проверками перечитывания —
+# чтение не падает и сразу отдаёт новые вопросы.
+# Запуск: python benchmarks/bench_bank.py [--sizes 127,10000,100000,1000000]
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from question_bank import QuestionBank  # noqa: E402
+
+
+def legacy_load(path: Path):
+    # прежний load_questions: весь файл → список строк в памяти
+    return [l.strip() for l in path.read_text(encoding="utf-8").splitlines() if l.strip()]
+
+
+def measure(fn):
+    # время — без трассировки (она замедляет аллокации в разы), память — отдельным прогоном
+    t0 = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - t0
+    tracemalloc.start()
+    result = fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def timeit(fn, budget=0.2):
+    n, t0 = 0, time.perf_counter()
+    while True:
+        fn()
+        n += 1
+        elapsed = time.perf_counter() - t0
+        if elapsed > budget:
+            return elapsed / n
+
+
+def rewrite_in_place(tmp: str) -> None:
+    path = Path(tmp) / "inplace.txt"
+    path.write_text("".join(f"Старый вопрос {i}\n" for i in range(1, 10_001)), encoding="utf-8")
+    bank = QuestionBank("inplace", path, reload_interval=3600)   # maybe_reload изменений не заметит
+    assert bank.get(10_000) == "Старый вопрос 10000"
+    with open(path, "r+b") as f:                                  # тот же inode: усечь и записать короче
+        f.truncate(0)
+        f.write("".join(f"Новый вопрос {i}\n" for i in range(1, 11)).encode())
+    assert not bank.maybe_reload()
+    assert bank.get(10_000) == "Вопрос №10000" and len(bank) == 10, (bank.get(10_000), len(bank))
+    assert bank.get(3) == "Новый вопрос 3"
+    with open(path, "ab") as f:
+        f.write("Дописанный вопрос\n".encode())
+    assert bank.get(11) == "Дописанный вопрос" and len(bank) == 11
+    with open(path, "r+b") as f:
+        f.truncate(0)
+    assert bank.get(1) == "Вопрос №1"
+    print("bank rewritten in place (shrunk, grown, emptied) between reload checks: reads stay valid: ok")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="127,10000,100000,1000000")
+    args = ap.parse_args()
+    print(f"{'N':>8} {'legacy load':>12} {'legacy mem':>11} {'bank open':>10} {'bank mem':>9} "
+          f"{'get':>8} {'page':>8} {'reload':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for total in [int(x) for x in args.sizes.split(",")]:
+            path = Path(tmp) / f"bank{total}.txt"
+            path.write_text("".join(f"Вопрос номер {i}: о чём ты думаешь сегодня?\n" for i in range(1, total + 1)),
+                            encoding="utf-8")
+            _, legacy_t, legacy_mem = measure(lambda: legacy_load(path))
+            bank, open_t, bank_mem = measure(lambda: QuestionBank("bench", path, reload_interval=0))
+            assert len(bank) == total and bank.get(total).startswith(f"Вопрос номер {total}:")
+
+            get_t = timeit(lambda: bank.get(random.randint(1, total)))
+            page_t = timeit(lambda: bank.page(total // 2, total // 2 + 20))
+
+            with open(path, "a", encoding="utf-8") as f:
+                f.write("Новый вопрос\n")
+            st = os.stat(path)
+            os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+            t0 = time.perf_counter()
+            assert bank.maybe_reload() and len(bank) == total + 1
+            reload_t = time.perf_counter() - t0
+
+            print(f"{total:>8} {legacy_t * 1e3:>10.1f}ms {legacy_mem / 2**20:>9.1f}MB {open_t * 1e3:>8.1f}ms "
+                  f"{bank_mem / 2**20:>7.1f}MB {get_t * 1e6:>6.2f}us {page_t * 1e6:>6.1f}us {reload_t * 1e3:>7.1f}ms")
+        rewrite_in_place(tmp)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# bench_completions.py — выбор случайного номера и /stats: перебор списков против битового индекса
+# Почти исчерпанный банк: свободных номеров единицы — выбор не должен замедляться вместе с их числом.
+# Запуск: python benchmarks/bench_completions.py [--sizes 127,1000,10000,100000]
+
+import sys
+import time
+import random
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from completions import CompletionIndex  # noqa: E402
+
+A, B = 1, 2
+
+
+def legacy_remaining(completed, total, user_id):
+    # прежний remaining_numbers_for_user: множества пересобираются для каждого номера
+    def get(uid):
+        return set(completed.get(str(uid), []))
+    result = []
+    for i in range(1, total + 1):
+        if i in get(user_id):
+            continue
+        if i in get(A) and i in get(B):
+            continue
+        result.append(i)
+    return result
+
+
+def legacy_stats(completed, total):
+    def get(uid):
+        return set(completed.get(str(uid), []))
+    return len(get(A)), len(get(B)), [i for i in range(1, total + 1) if i in get(A) and i in get(B)]
+
+
+def timeit(fn, budget=0.3):
+    n, t0 = 0, time.perf_counter()
+    while True:
+        fn()
+        n += 1
+        elapsed = time.perf_counter() - t0
+        if elapsed > budget:
+            return elapsed / n
+
+
+def near_exhaustion(total, left):
+    # у A открыты только left номеров, один из них — активный вопрос (exclude)
+    free = random.sample(range(1, total + 1), left)
+    closed = set(range(1, total + 1)) - set(free)
+    idx = CompletionIndex(total, {str(A): sorted(closed)}, {"A": A, "B": B})
+    exclude = free[0] if left > 1 else None
+    times, seen = [], set()
+    for _ in range(500):
+        t0 = time.perf_counter()
+        q = idx.sample(A, exclude=exclude)
+        times.append(time.perf_counter() - t0)
+        assert q in free and q != exclude, q
+        seen.add(q)
+    assert len(seen) == left - (exclude is not None)
+    mean, worst = sum(times) / len(times), max(times)
+    assert worst < 0.01, worst
+    print(f"{total:>7} with {left:>2} free: mean {mean * 1e6:.0f}us, max {worst * 1e6:.0f}us, "
+          f"all {len(seen)} candidates drawn")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="127,1000,10000,100000")
+    ap.add_argument("--closed", type=float, default=0.5, help="доля уже закрытых номеров")
+    args = ap.parse_args()
+    print(f"{'N':>7} {'legacy random':>14} {'index random':>13} {'legacy stats':>13} {'index stats':>12} {'build':>10}")
+    for total in [int(x) for x in args.sizes.split(",")]:
+        done = random.sample(range(1, total + 1), int(total * args.closed))
+        completed = {str(A): sorted(done), str(B): sorted(done[: len(done) // 2])}
+        roles = {"A": A, "B": B}
+        t0 = time.perf_counter()
+        idx = CompletionIndex(total, completed, roles)
+        build = time.perf_counter() - t0
+
+        legacy_rand = timeit(lambda: random.choice(legacy_remaining(completed, total, A)), 0.2) if total <= 10000 else float("nan")
+        index_rand = timeit(lambda: idx.sample(A))
+        legacy_st = timeit(lambda: legacy_stats(completed, total), 0.2) if total <= 10000 else float("nan")
+        index_st = timeit(lambda: (idx.count(A), idx.count(B), idx.both_count))
+        print(f"{total:>7} {legacy_rand * 1e6:>12.0f}us {index_rand * 1e6:>11.2f}us "
+              f"{legacy_st * 1e6:>11.0f}us {index_st * 1e6:>10.2f}us {build * 1e3:>8.2f}ms")
+    for left in (1, 2, 10):
+        near_exhaustion(max(int(x) for x in args.sizes.split(",")), left)
+
+
+if __name__ == "__main__":
+    main()
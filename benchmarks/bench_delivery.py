@@ -0,0 +1,115 @@
+# bench_delivery.py — «Передать ответ» с N черновиками: время нажатия и полной доставки
+# Затем: часть исходных сообщений удалена — copy_messages их пропускает, а ответ всё равно доходит целиком.
+# Запуск: python benchmarks/bench_delivery.py [--drafts 30] [--latency 0.05]
+
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import bot  # noqa: E402
+from storage import StateStore, JsonBackend  # noqa: E402
+from archive import AnswerArchive  # noqa: E402
+from fake_api import FakeBot, FakeContext, text_update, voice_update, callback_update  # noqa: E402
+
+A, B = 501, 502
+
+
+async def legacy_send(api: FakeBot, a_chat: int, drafts):
+    # прежний цикл: каждый черновик — отдельный последовательный запрос
+    await api.send_message(chat_id=a_chat, text="Привет, тебе пришли ответы!")
+    for item in drafts:
+        await api.send_voice(chat_id=a_chat, voice=item["data"]["file_id"])
+    await api.send_message(chat_id=B, text="Теперь ты A — задай следующий вопрос.")
+    await api.send_message(chat_id=a_chat, text="Теперь ты B — жди вопрос.")
+
+
+async def run(n_drafts: int, latency: float):
+    with tempfile.TemporaryDirectory() as d:
+        bot.STORE = StateStore(JsonBackend(Path(d) / "state.json"), bot.default_state, upgrade=bot.upgrade_state)
+        bot.ARCHIVE = AnswerArchive(Path(d) / "state.archive.jsonl")
+        bot.STORE.start()
+        api = FakeBot(latency=latency)
+        bot.OUTBOX = None
+        bot.get_outbox().start(api)
+
+        async def call(handler, update, args=None):
+            await handler(update, FakeContext(api, update, args))
+
+        await call(bot.start, text_update(api, A, "/start"))
+        code = bot.get_pair(A)["code"]
+        await call(bot.join_cmd, text_update(api, B, f"/join {code}"), [code])
+        await call(bot.on_button, callback_update(api, A, "ask_random"))
+        for k in range(n_drafts):
+            await call(bot.on_voice, voice_update(api, B, f"v{k}"))
+        drafts = list(bot.get_pair(A)["draft_answers"])
+
+        t0 = time.perf_counter()
+        await legacy_send(api, A, drafts)
+        legacy = time.perf_counter() - t0
+
+        api.calls.clear()
+        t0 = time.perf_counter()
+        await call(bot.on_button, callback_update(api, B, "send_answer"))
+        click = time.perf_counter() - t0
+        await bot.get_outbox().idle()
+        total = time.perf_counter() - t0
+        calls = len([c for c in api.calls if c["method"] not in ("answer_callback_query", "edit_message_text")])
+        await bot.get_outbox().stop()
+        await bot.STORE.stop()
+    print(f"drafts={n_drafts} latency={latency * 1000:.0f}ms")
+    print(f"  legacy sequential:   click={legacy:6.2f}s  api_calls={n_drafts + 3}")
+    print(f"  outbox:              click={click:6.2f}s  delivered_in={total:6.2f}s  api_calls={calls}")
+
+
+async def deleted_sources(n_drafts: int) -> None:
+    with tempfile.TemporaryDirectory() as d:
+        bot.STORE = StateStore(JsonBackend(Path(d) / "state.json"), bot.default_state, upgrade=bot.upgrade_state)
+        bot.ARCHIVE = AnswerArchive(Path(d) / "state.archive.jsonl")
+        bot.STORE.start()
+        api = FakeBot()
+        bot.OUTBOX = None
+        bot.get_outbox().start(api)
+
+        async def call(handler, update, args=None):
+            await handler(update, FakeContext(api, update, args))
+
+        a, b = A + 10, B + 10
+        await call(bot.start, text_update(api, a, "/start"))
+        code = bot.get_pair(a)["code"]
+        await call(bot.join_cmd, text_update(api, b, f"/join {code}"), [code])
+        await call(bot.on_button, callback_update(api, a, "ask_random"))
+        for k in range(n_drafts):
+            await call(bot.on_voice, voice_update(api, b, f"gone{k}"))
+        drafts = list(bot.get_pair(a)["draft_answers"])
+        api.deleted |= {(b, it["message_id"]) for it in drafts[1::3]}   # B удалил каждое третье
+        api.calls.clear()
+        await call(bot.on_button, callback_update(api, b, "send_answer"))
+        await bot.get_outbox().idle()
+        to_a = api.sent_to(a)
+        copied = sum(len(c["message_ids"]) for c in to_a if c["method"] == "copy_messages")
+        deleted = sum(len(c["message_ids"]) for c in to_a if c["method"] == "delete_messages")
+        voices = [c["voice"] for c in to_a if c["method"] == "send_voice"]
+        assert voices == [it["data"]["file_id"] for it in drafts], voices
+        assert deleted == copied - len(api.deleted), (copied, deleted)
+        await bot.get_outbox().stop()
+        await bot.STORE.stop()
+    print(f"deleted sources: {len(api.deleted)} of {n_drafts} skipped by copy_messages → partial copies removed, "
+          f"all {n_drafts} resent by file_id in order: ok")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--drafts", type=int, default=30)
+    ap.add_argument("--latency", type=float, default=0.05)
+    args = ap.parse_args()
+    asyncio.run(run(args.drafts, args.latency))
+    asyncio.run(deleted_sources(min(args.drafts, 30)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+# bench_inbound.py — поток входящих от отвечающего B: лимиты, буфер черновиков, сводка «Принято N»
+# 1) B пересылает пачку из --burst голосовых: принимается столько, сколько позволяет ведро токенов,
+#    остальное отбрасывается до обработчиков. B получает одно сообщение-сводку и несколько его правок
+#    вместо ответа на каждое; записей состояния — по числу принятых.
+# 2) Буфер черновиков: не больше DRAFT_MAX_ITEMS и байтового предела, в том числе после перезапуска.
+# 3) Не отвечающий пользователь, засыпающий бота сообщениями, получает одно предупреждение.
+# 4) Противодавление: запись состояния не успевает — черновик ждёт её и не принимается по таймауту.
+# Запуск: python benchmarks/bench_inbound.py [--burst 200] [--spread 0.4]
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+_tmp = tempfile.mkdtemp(prefix="bench_inbound_")
+os.environ["TELEGRAM_TOKEN"] = "123456:TEST"
+os.environ["STATE_FILE_PATH"] = str(Path(_tmp) / "state.json")
+os.environ["DRAFT_ACK_DELAY"] = "0.1"
+
+import bot  # noqa: E402
+from inbound import InboundLimiter, DraftBudget, item_size  # noqa: E402
+from archive import AnswerArchive  # noqa: E402
+from fake_api import FakeBot, restart, dispatch, text_update, voice_update, callback_update  # noqa: E402
+
+BASE_UID = 90_000_000
+NO_LIMIT = (1e9, 1e9, 1e9, 1e9)
+
+
+async def new_pair(app, api: FakeBot, a: int, b: int) -> None:
+    await dispatch(app, api, text_update(api, a, "/start"))
+    await dispatch(app, api, text_update(api, b, f"/join {bot.get_pair(a)['code']}"))
+    await dispatch(app, api, callback_update(api, a, "ask_random"))
+
+
+def rejected(reason: str) -> float:
+    return bot.metrics.INBOUND_REJECTED.get(reason)
+
+
+async def burst(app, api: FakeBot, n: int, spread: float) -> None:
+    a, b = BASE_UID, BASE_UID + 1
+    await new_pair(app, api, a, b)
+    api.calls.clear()
+    saves = bot.metrics.STATE_CALLS.get("save")
+    before = rejected("rate_user") + rejected("rate_pair")
+    t0 = time.perf_counter()
+    for k in range(n):
+        await dispatch(app, api, voice_update(api, b, f"fwd{k}"))
+        await asyncio.sleep(spread / n)
+    elapsed = time.perf_counter() - t0
+    await bot.ACKS.idle()
+
+    drafts = len(bot.get_pair(b)["draft_answers"])
+    refused = rejected("rate_user") + rejected("rate_pair") - before
+    sent = [c for c in api.sent_to(b) if c["method"] == "send_message"]
+    edits = [c for c in api.sent_to(b) if c["method"] == "edit_message_text"]
+    assert drafts + refused == n and bot.INBOUND.user_burst <= drafts <= bot.INBOUND.user_burst + 2 * elapsed + 1
+    assert len(sent) == 1 and len(edits) <= elapsed / bot.ACKS.delay + 2, (len(sent), len(edits))
+    last = (edits or sent)[-1]["text"]
+    assert f"Принято сообщений: {drafts}" in last and f"Не принято {int(refused)} — слишком быстро" in last, last
+    # кроме черновиков — отметка окна повторов на каждый апдейт (запись в кольцо, а не состояние пары)
+    writes = bot.metrics.STATE_CALLS.get("save") - saves - n
+    assert writes == drafts, (writes, drafts)
+    print(f"burst of {n} voices in {elapsed:.2f}s: per-message replies would be {n} replies + {n} draft writes;"
+          f" now {drafts} accepted, {int(refused)} refused before handlers, {len(sent)} ack + {len(edits)} edits,"
+          f" {int(writes)} draft writes")
+    await dispatch(app, api, callback_update(api, b, "send_answer"))
+    await bot.get_outbox().idle()
+
+
+async def buffers(app, api: FakeBot, d: Path) -> None:
+    a, b = BASE_UID + 10, BASE_UID + 11
+    bot.INBOUND = InboundLimiter(*NO_LIMIT)
+    await new_pair(app, api, a, b)
+    for k in range(bot.DRAFT_MAX_ITEMS + 50):
+        await dispatch(app, api, text_update(api, b, f"ответ {k}"))
+    await bot.ACKS.idle()
+    assert len(bot.get_pair(b)["draft_answers"]) == bot.DRAFT_MAX_ITEMS
+    assert "Не принято 50 — ответ уже максимального размера" in api.sent_to(b)[-1]["text"]
+
+    # байтовый предел: новый вопрос — новый буфер; после перезапуска размер считается заново
+    limit = 16 << 10
+    bot.DRAFT_BUDGET = DraftBudget(1000, limit)
+    await dispatch(app, api, callback_update(api, b, "send_answer"))
+    await dispatch(app, api, callback_update(api, b, "ask_random"))
+    await bot.get_outbox().idle()
+    long = "я" * 1000
+    for _ in range(5):
+        await dispatch(app, api, text_update(api, a, long))
+    await restart("journal", d, api)
+    bot.DRAFT_BUDGET = DraftBudget(1000, limit)
+    full = rejected("draft_bytes")
+    for _ in range(10):
+        await dispatch(app, api, text_update(api, a, long))
+    drafts = bot.get_pair(a)["draft_answers"]
+    size = sum(item_size(it) for it in drafts)
+    assert size <= limit and len(drafts) + rejected("draft_bytes") - full == 15 and len(drafts) < 15, (size, len(drafts))
+    print(f"buffers: {bot.DRAFT_MAX_ITEMS} items cap, {limit >> 10} KB cap ({len(drafts)} drafts, {size} B) "
+          f"also after restart: ok")
+    bot.DRAFT_BUDGET = DraftBudget(bot.DRAFT_MAX_ITEMS, bot.DRAFT_MAX_BYTES)
+    await bot.ACKS.stop()
+
+
+async def flood(app, api: FakeBot) -> None:
+    a, b = BASE_UID + 20, BASE_UID + 21
+    bot.INBOUND = InboundLimiter(*NO_LIMIT)
+    await new_pair(app, api, a, b)
+    bot.INBOUND = InboundLimiter(bot.INBOUND_RATE_USER, bot.INBOUND_BURST_USER,
+                                 bot.INBOUND_RATE_PAIR, bot.INBOUND_BURST_PAIR)
+    api.calls.clear()
+    for k in range(100):
+        await dispatch(app, api, text_update(api, a, f"привет {k}"))
+    warnings = [c for c in api.sent_to(a) if c["text"].startswith("Слишком много сообщений")]
+    menus = [c for c in api.sent_to(a) if c["text"] == "Выбери действие:"]
+    assert len(warnings) == 1 and len(menus) == bot.INBOUND_BURST_USER, (len(warnings), len(menus))
+    print(f"flood from A: 100 texts → {len(menus)} handled, 1 warning, rest dropped silently: ok")
+
+
+async def backpressure(app, api: FakeBot) -> None:
+    a, b = BASE_UID + 30, BASE_UID + 31
+    bot.INBOUND = InboundLimiter(*NO_LIMIT)
+    await new_pair(app, api, a, b)
+    await bot.STORE.flush_async()
+    write = bot.STORE.backend.write
+
+    def slow(payload):
+        time.sleep(0.3)
+        write(payload)
+    bot.STORE.backend.write = slow
+    bot.STATE_BACKPRESSURE, bot.STATE_BACKPRESSURE_WAIT = 3, 0.05
+    busy = rejected("busy")
+    try:
+        for k in range(20):
+            await dispatch(app, api, text_update(api, b, f"ответ {k}"))
+    finally:
+        bot.STATE_BACKPRESSURE, bot.STATE_BACKPRESSURE_WAIT = 10_000, 5.0
+        bot.STORE.backend.write = write
+    await bot.ACKS.idle()
+    refused = rejected("busy") - busy
+    drafts = len(bot.get_pair(b)["draft_answers"])
+    assert refused and drafts + refused == 20 and "бот перегружен" in api.sent_to(b)[-1]["text"]
+    print(f"backpressure: slow state writes → {drafts} accepted, {int(refused)} refused as busy: ok")
+
+
+async def main_async(args) -> None:
+    d = Path(tempfile.mkdtemp(prefix="inbound_", dir=_tmp))
+    bot.ARCHIVE = AnswerArchive(d / "state.archive.jsonl")
+    app = bot.build_app()
+    api = FakeBot()
+    await restart("journal", d, api)
+    await burst(app, api, args.burst, args.spread)
+    await buffers(app, api, d)
+    await flood(app, api)
+    await backpressure(app, api)
+    await bot.ACKS.stop()
+    await bot.get_outbox().stop()
+    await bot.STORE.stop()
+    bot.get_archive().close()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--burst", type=int, default=200)
+    ap.add_argument("--spread", type=float, default=0.4)
+    asyncio.run(main_async(ap.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
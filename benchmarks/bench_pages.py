@@ -0,0 +1,136 @@
+# bench_pages.py — «Посмотреть список вопросов» и ◀️/▶️: сборка страницы заново против кэша
+# Считает время и выделенную память на один on_button для list_questions и qpage_N,
+# отдельно — только отрисовку страницы (прежняя сборка против pages.QuestionPages).
+# /stats на том же банке, где закрыта треть номеров: сообщение укладывается в предел Telegram.
+# Запуск: python benchmarks/bench_pages.py [--bank 10000] [--callbacks 2000]
+
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+_tmp = tempfile.mkdtemp(prefix="bench_pages_")
+os.environ.setdefault("STATE_FILE_PATH", str(Path(_tmp) / "state.json"))
+
+import bot  # noqa: E402
+from pages import QuestionPages  # noqa: E402
+from question_bank import QuestionBank  # noqa: E402
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup  # noqa: E402
+from fake_api import FakeBot, FakeContext, callback_update, text_update  # noqa: E402
+
+PER_PAGE = bot.QUESTIONS_PER_PAGE
+
+
+def legacy_render(bank: QuestionBank, page: int):
+    # прежние get_questions_page + questions_nav_kb: всё собирается на каждое нажатие
+    start = page * PER_PAGE
+    end = min(start + PER_PAGE, len(bank))
+    text = "📋 Список вопросов:\n\n" + "\n".join(f"{i}. {t}" for i, t in enumerate(bank.page(start, end), start + 1))
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("◀️", callback_data=f"qpage_{page-1}"))
+    if end < len(bank):
+        buttons.append(InlineKeyboardButton("▶️", callback_data=f"qpage_{page+1}"))
+    return text, InlineKeyboardMarkup([buttons, [InlineKeyboardButton("⬅️ В меню", callback_data="back_to_menu")]])
+
+
+def per_call(fn, n):
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fn()
+    elapsed = (time.perf_counter() - t0) / n
+    # память на вызов — пик сверх уровня перед вызовом, усреднённый по вызовам
+    tracemalloc.start()
+    total = 0
+    for _ in range(n):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        fn()
+        total += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return elapsed, total / n
+
+
+async def run_callbacks(fb, updates):
+    for u in updates:
+        await bot.on_button(u, FakeContext(fb, u))
+
+
+async def callback_memory(fb, updates):
+    tracemalloc.start()
+    total = 0
+    for u in updates:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        await bot.on_button(u, FakeContext(fb, u))
+        total += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return total / len(updates)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--bank", type=int, default=10000, help="число вопросов в банке")
+    ap.add_argument("--callbacks", type=int, default=2000)
+    args = ap.parse_args()
+
+    path = Path(_tmp) / "bank.txt"
+    path.write_text("".join(f"Вопрос номер {i}: что для тебя важно?\n" for i in range(1, args.bank + 1)),
+                    encoding="utf-8")
+    bank = QuestionBank("default", path, reload_interval=3600)
+    pages_n = (len(bank) + PER_PAGE - 1) // PER_PAGE
+    cache = QuestionPages(PER_PAGE)
+    idx_pages = [random.randrange(pages_n) for _ in range(args.callbacks)]
+    it = iter(idx_pages * 2)
+
+    t_legacy, m_legacy = per_call(lambda: legacy_render(bank, next(it)), args.callbacks)
+    it = iter(idx_pages * 3)
+    for p in idx_pages:          # прогрев: каждая страница уже собрана один раз
+        cache.render(bank, p)
+    t_cache, m_cache = per_call(lambda: cache.render(bank, next(it)), args.callbacks)
+    mine = sum(1 << q for q in random.sample(range(1, len(bank) + 1), len(bank) // 3))
+    both = mine & sum(1 << q for q in random.sample(range(1, len(bank) + 1), len(bank) // 2))
+    it = iter(idx_pages * 3)
+    t_marks, m_marks = per_call(lambda: cache.render(bank, next(it), mine, both), args.callbacks)
+    print(f"render  legacy {t_legacy * 1e6:8.1f}us {m_legacy:8.0f}B | cached {t_cache * 1e6:6.2f}us {m_cache:6.0f}B"
+          f" | cached+marks {t_marks * 1e6:6.2f}us {m_marks:6.0f}B")
+
+    # полный on_button на заглушке Bot API (банк — тот же файл)
+    bot.BANKS._banks["default"] = bank
+    fb = FakeBot()
+    a = bot.create_pair(1)
+    bot.join_pair(2, a["code"])
+    for flow, data in (("list_questions", lambda p: "list_questions"), ("qpage_", lambda p: f"qpage_{p}")):
+        updates = [callback_update(fb, 1, data(p)) for p in idx_pages]
+        asyncio.run(run_callbacks(fb, updates))      # прогрев кэша страниц
+        fb.calls.clear()
+        t0 = time.perf_counter()
+        asyncio.run(run_callbacks(fb, updates))
+        elapsed = (time.perf_counter() - t0) / len(updates)
+        fb.calls.clear()
+        mem = asyncio.run(callback_memory(fb, updates))
+        fb.calls.clear()
+        print(f"on_button {flow:<15} {elapsed * 1e6:8.1f}us/callback {mem:8.0f}B/callback")
+
+    closed = random.sample(range(1, len(bank) + 1), len(bank) // 3)
+    for q in closed:
+        bot.mark_completed_for_user(a, 1, q)
+        bot.mark_completed_for_user(a, 2, q)
+    u = text_update(fb, 1, "/stats")
+    asyncio.run(bot.stats_cmd(u, FakeContext(fb, u)))     # FakeBot отклонил бы текст длиннее 4096
+    text = fb.calls[-1]["text"]
+    assert f"Полностью закрытые номера ({len(closed)}): {min(closed)}, " in text, text
+    assert f"и ещё {len(closed) - bot.STATS_CLOSED_SHOWN}" in text, text
+    print(f"/stats with {len(closed)} fully closed: {len(text)} chars: ok")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+# bench_reminders.py — планировщик напоминаний: куча сроков против опроса всех pending
+# 1) 100k ожидающих вопросов: сборка кучи при старте и стоимость одного «тика» опроса всех пар.
+# 2) Живой прогон: 100k сроков в течение секунды — сколько пробуждений и насколько поздно срабатывают.
+# 3) Лимит: пачка просроченных напоминаний растягивается ведром токенов.
+# 4) Через бота: пары на заглушке Bot API, лесенка из двух шагов — B получает оба напоминания,
+#    A — уведомление на последнем шаге, reminded сохраняется, тихие часы сдвигают срок.
+#    У половины вопросов нет sent_at (состояние до напоминаний): срок отсчитывается от старта и сохраняется.
+# Запуск: python benchmarks/bench_reminders.py [--pending 100000] [--pairs 200]
+
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from zoneinfo import ZoneInfo
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+_tmp = tempfile.mkdtemp(prefix="bench_reminders_")
+os.environ["TELEGRAM_TOKEN"] = "123456:TEST"
+os.environ["STATE_FILE_PATH"] = str(Path(_tmp) / "state.json")
+os.environ["REMINDER_HOURS"] = "0.0002,0.0004"     # ~0.7 и ~1.4 секунды после вопроса
+os.environ["REMINDER_QUIET"] = "off"
+
+import bot  # noqa: E402
+from storage import JournalBackend  # noqa: E402
+from delivery import RateLimiter, TokenBucket  # noqa: E402
+from reminders import ReminderScheduler, next_due, after_quiet  # noqa: E402
+from fake_api import FakeBot, dispatch, text_update, callback_update  # noqa: E402
+
+BASE_UID = 40_000_000
+HOURS = [4.0, 24.0, 72.0]
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def scale(n: int) -> None:
+    now = time.time()
+    pairs = [{"id": str(i), "pending": {"qnum": 1, "sent_at": now - random.random() * 72 * 3600,
+                                        "reminded": random.randrange(3)}} for i in range(n)]
+    t0 = time.perf_counter()
+    due = [(p["id"], next_due(p["pending"], HOURS, "Europe/Moscow", [23, 9], now)) for p in pairs]
+    sched = ReminderScheduler(None)
+    sched.load((k, w) for k, w in due if w is not None)
+    t_load = time.perf_counter() - t0
+
+    # опрос: каждый тик проходит по всем парам и проверяет срок
+    t0 = time.perf_counter()
+    hits = sum(1 for p in pairs if p["pending"]["sent_at"] + HOURS[p["pending"]["reminded"]] * 3600 <= now)
+    t_tick = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for i in range(n):
+        sched.schedule(str(i), now + random.random() * 3600)
+    t_resched = (time.perf_counter() - t0) / n
+    print(f"{n} pending: heap build {t_load * 1e3:.0f}ms, reschedule {t_resched * 1e6:.2f}us, "
+          f"heap {len(sched.heap)} entries | polling tick {t_tick * 1e3:.1f}ms ({hits} due), "
+          f"{t_tick * 1440 * 1e3:.0f}ms CPU/day at 1 tick/min")
+
+
+async def live(n: int) -> None:
+    lateness = []
+    sched = ReminderScheduler(None, rate=1e9, burst=1e9)
+
+    async def fire(key):
+        lateness.append(time.time() - due[key])
+    sched.fire = fire
+    start = time.time() + 0.2
+    due = {str(i): start + random.random() for i in range(n)}
+    sched.load(due.items())
+    t0 = time.perf_counter()
+    sched.start()
+    while sched.fired < n:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - t0
+    await sched.stop()
+    print(f"live: {n} reminders in {elapsed:.2f}s, {sched.wakeups} wakeups, "
+          f"lateness p50 {pct(lateness, 0.5) * 1e3:.1f}ms p99 {pct(lateness, 0.99) * 1e3:.1f}ms")
+    assert sched.fired == n and sched.wakeups <= n
+
+
+async def limited(n: int, rate: float) -> None:
+    fired = []
+    sched = ReminderScheduler(None, rate=rate, burst=20)
+
+    async def fire(key):
+        fired.append(time.perf_counter())
+    sched.fire = fire
+    sched.load((str(i), time.time() - 60) for i in range(n))   # все просрочены, как после простоя
+    sched.start()
+    while len(fired) < n:
+        await asyncio.sleep(0.05)
+    await sched.stop()
+    achieved = (n - 20) / (fired[-1] - fired[0])
+    print(f"limited: {n} overdue at {rate:g}/s → achieved {achieved:.0f}/s")
+    assert achieved <= rate * 1.1
+
+
+def quiet_hours() -> None:
+    tz = ZoneInfo("Europe/Moscow")
+    at = lambda h, m=0, d=10: datetime(2026, 10, d, h, m, tzinfo=tz).timestamp()  # noqa: E731
+    assert after_quiet(at(2), "Europe/Moscow", [23, 9]) == at(9)
+    assert after_quiet(at(23, 30), "Europe/Moscow", [23, 9]) == at(9, d=11)
+    assert after_quiet(at(12), "Europe/Moscow", [23, 9]) == at(12)
+    assert after_quiet(at(3), "Europe/Moscow", [1, 7]) == at(7)
+    assert after_quiet(at(8), "Europe/Moscow", [1, 7]) == at(8)
+    # та же минута в другом поясе — уже не тихие часы
+    assert after_quiet(at(8, 30), "Asia/Vladivostok", [23, 9]) == at(8, 30)
+    print("quiet hours: ok")
+
+
+async def through_bot(pairs: int) -> None:
+    api = FakeBot()
+    app = bot.build_app()
+    bot.STORE.start()
+    bot.get_outbox().limiter = RateLimiter(1e9, 1e9, 1e9)
+    bot.get_outbox().start(api)
+    bot.REMINDERS.bucket = TokenBucket(1e9, 1e9)
+    for i in range(pairs):
+        a, b = BASE_UID + 2 * i, BASE_UID + 2 * i + 1
+        await dispatch(app, api, text_update(api, a, "/start"))
+        await dispatch(app, api, text_update(api, b, f"/join {bot.get_pair(a)['code']}"))
+        await dispatch(app, api, callback_update(api, a, "ask_random"))
+        if i % 2:
+            bot.get_pair(a)["pending"].pop("sent_at")
+    # перезапуск: планировщик забывает всё и собирается из состояния
+    bot.REMINDERS.load([])
+    bot.load_reminders()
+    assert len(bot.REMINDERS) == pairs
+    api.calls.clear()
+    bot.REMINDERS.start()
+    deadline = time.time() + 10
+    while bot.REMINDERS.fired < 2 * pairs and time.time() < deadline:
+        await asyncio.sleep(0.05)
+    await bot.get_outbox().idle()
+    await bot.REMINDERS.stop()
+    await bot.STORE.flush_async()
+    sent = [c for c in api.calls if c["method"] == "send_message"]
+    to_b = [c for c in sent if "ждёт ответа" in c["text"]]
+    to_a = [c for c in sent if "не ответил" in c["text"]]
+    assert len(to_b) == 2 * pairs and len(to_a) == pairs, (len(to_b), len(to_a))
+    assert all(c["reply_markup"] is not None for c in to_b)
+    assert len(bot.REMINDERS) == 0
+    persisted = JournalBackend(bot.STATE_FILE, bot.STATE_JOURNAL).read()
+    assert all(p["pending"]["reminded"] == 2 and p["pending"]["sent_at"] for p in persisted["pairs"].values())
+
+    # /remind: своё расписание пересчитывает срок текущего вопроса
+    a = BASE_UID
+    await dispatch(app, api, text_update(api, a, "/remind 1 5"))
+    pair = bot.get_pair(a)
+    assert pair["reminders"] == {"hours": [1.0, 5.0]} and bot.REMINDERS.due.get(pair["id"]) is None  # уже 2 из 2
+    await dispatch(app, api, text_update(api, a, "/remind 1 5 48"))
+    assert bot.REMINDERS.due[pair["id"]] == pair["pending"]["sent_at"] + 48 * 3600
+    await dispatch(app, api, text_update(api, a, "/remind tz Mars/Olympus"))
+    assert "Не понял" in api.calls[-1]["text"]
+    await bot.STORE.stop()
+    print(f"through bot: {pairs} pairs, {len(to_b)} reminders to B, {len(to_a)} final notices to A, "
+          "reminded persisted: ok")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--pending", type=int, default=100_000)
+    ap.add_argument("--pairs", type=int, default=200)
+    args = ap.parse_args()
+    scale(args.pending)
+    asyncio.run(live(args.pending))
+    asyncio.run(limited(1000, 500))
+    quiet_hours()
+    asyncio.run(through_bot(args.pairs))
+
+
+if __name__ == "__main__":
+    main()
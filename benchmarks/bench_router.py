@@ -0,0 +1,208 @@
+# bench_router.py — маршрутизация нажатий и фазы пары
+# 1) Разбор callback_data: новый формат и старые строки кнопок, стоимость разбора+поиска маршрута
+#    против прежней цепочки сравнений == и startswith (чем дальше действие в цепочке, тем дольше).
+# 2) Фаза переживает перезапуск (journal, json, sqlite): «Запросить конкретный вопрос» → перезапуск →
+#    номер текстом принимается как номер вопроса; «Передать ответ» → delivering, пока задание с
+#    ответами в outbox (в том числе после перезапуска), затем idle; доставка задания прошлого
+#    раунда не закрывает delivering следующего.
+# 3) Кнопки: старый формат работает, неизвестная версия — «устарела», запись архива чужой пары
+#    не показывается, ◀️/▶️ списка несут банк.
+# Запуск: python benchmarks/bench_router.py [--presses 200000]
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+_tmp = tempfile.mkdtemp(prefix="bench_router_")
+os.environ["TELEGRAM_TOKEN"] = "123456:TEST"
+os.environ["STATE_FILE_PATH"] = str(Path(_tmp) / "state.json")
+
+import bot  # noqa: E402
+import callbacks  # noqa: E402
+from phases import IDLE, AWAITING_QNUM, PENDING, DELIVERING  # noqa: E402
+from archive import AnswerArchive  # noqa: E402
+from fake_api import FakeBot, restart, dispatch, text_update, voice_update, callback_update  # noqa: E402
+
+BASE_UID = 80_000_000
+CHAIN = ("back_to_menu", "list_questions", "qpage_", "whois", "hist_", "hshow_", "reset_history", "repeat_q",
+         "ask_specific", "ask_random", "send_answer")
+
+
+def legacy_chain(data: str) -> str:
+    # как выбирал действие прежний on_button: == и startswith по очереди
+    for name in CHAIN:
+        if name.endswith("_") and name != "back_to_menu":
+            if data.startswith(name):
+                return name
+        elif data == name:
+            return name
+    return ""
+
+
+def bench_decode(presses: int) -> None:
+    for name, args in (("send_answer", ()), ("qpage", (12, "travel")), ("hshow", (1234, 17))):
+        data = callbacks.encode(name, *args)
+        action, values = callbacks.decode(data)
+        assert action.name == name and values == args, (data, values)
+    for old, name, values in (("ask_random", "ask_random", ()), ("qpage_3", "qpage", (3, None)),
+                              ("hist_2", "hist", (2,)), ("srch_0", "srch", (0,)), ("hshow_12", "hshow", (12, None))):
+        action, got = callbacks.decode(old)
+        assert action.name == name and got == values, (old, got)
+    assert callbacks.decode("9a") is None and callbacks.decode("qpage_x") is None and callbacks.decode("") is None
+    assert len(callbacks.encode("qpage", 10 ** 6, "б" * 20).encode()) <= callbacks.MAX_BYTES
+    for data in (callbacks.encode("send_answer"), "send_answer", "1p:c:travel", "qpage_12"):
+        t0 = time.perf_counter()
+        for _ in range(presses):
+            bot.ROUTER.resolve(data)
+        routed = (time.perf_counter() - t0) / presses
+        t0 = time.perf_counter()
+        for _ in range(presses):
+            legacy_chain(data)
+        chain = (time.perf_counter() - t0) / presses
+        print(f"{data!r:>16} ({len(data)} B): decode+route {routed * 1e9:4.0f}ns | if-chain match {chain * 1e9:4.0f}ns")
+
+
+async def phases(kind: str) -> None:
+    d = Path(tempfile.mkdtemp(prefix=f"router_{kind}_", dir=_tmp))
+    bot.ARCHIVE = AnswerArchive(d / "state.archive.jsonl")
+    app = bot.build_app()
+    api = FakeBot()
+    await restart(kind, d, api)
+    a, b = BASE_UID, BASE_UID + 1
+    await dispatch(app, api, text_update(api, a, "/start"))
+    await dispatch(app, api, text_update(api, b, f"/join {bot.get_pair(a)['code']}"))
+    # B не спрашивает: отказ по условию маршрута, фаза не меняется
+    await dispatch(app, api, callback_update(api, b, "ask_specific"))
+    assert api.calls[-1]["text"] == "Сейчас задаёт вопросы только A." and bot.get_pair(a)["phase"] == IDLE
+    await dispatch(app, api, callback_update(api, a, callbacks.encode("ask_specific")))
+    assert bot.get_pair(a)["phase"] == AWAITING_QNUM
+
+    # перезапуск между кнопкой и номером: ожидание номера хранится в паре, а не в user_data
+    await restart(kind, d, api)
+    await dispatch(app, api, text_update(api, a, "7"))
+    pair = bot.get_pair(a)
+    assert pair["phase"] == PENDING and pair["pending"]["qnum"] == 7, pair
+    assert any("№7" in (c.get("text") or "") for c in api.sent_to(b))
+    # ещё один вопрос, пока есть активный, не задать ни кнопкой, ни текстом
+    await dispatch(app, api, callback_update(api, a, "ask_random"))
+    assert api.calls[-1]["text"] == "Уже есть активный вопрос. Дождись ответа."
+    await dispatch(app, api, text_update(api, a, "8"))
+    assert bot.get_pair(a)["pending"]["qnum"] == 7
+
+    # «Передать ответ» → delivering, пока задание с ответами не доставлено
+    await dispatch(app, api, voice_update(api, b, "v1"))
+    await restart(kind, d, api, deliver=False)
+    await dispatch(app, api, callback_update(api, b, "send_answer"))
+    pair = bot.get_pair(a)
+    assert pair["phase"] == DELIVERING and pair["roles"] == {"A": b, "B": a}
+    # перезапуск до доставки: фаза и задание на диске, доставка после старта закрывает фазу
+    await restart(kind, d, api, deliver=False)
+    assert bot.get_pair(a)["phase"] == DELIVERING and bot.load_state()["outbox"]
+    bot.get_outbox().start(api)
+    await bot.get_outbox().idle()
+    assert bot.get_pair(a)["phase"] == IDLE
+    assert sum(1 for c in api.sent_to(a) if c["method"] == "copy_messages") == 1
+
+    # неверный номер выводит из ожидания; новый A может спросить, пока ответы ещё доставляются
+    await dispatch(app, api, callback_update(api, b, "ask_specific"))
+    await dispatch(app, api, text_update(api, b, "0"))
+    assert api.calls[-1]["text"].startswith("Номер вне диапазона") and bot.get_pair(a)["phase"] == IDLE
+    await dispatch(app, api, callback_update(api, b, "ask_random"))
+    await dispatch(app, api, text_update(api, a, "ответ"))
+    await restart(kind, d, api, deliver=False)
+    await dispatch(app, api, callback_update(api, a, "send_answer"))
+    await dispatch(app, api, callback_update(api, a, "ask_random"))
+    pair = bot.get_pair(a)
+    assert pair["phase"] == PENDING and pair["roles"]["A"] == a
+    bot.get_outbox().start(api)
+    await bot.get_outbox().idle()
+    assert bot.get_pair(a)["phase"] == PENDING       # доставка не сбивает фазу нового вопроса
+
+    # задание прошлого раунда, снятое с очереди уже после ответа на следующий вопрос,
+    # не закрывает delivering нового раунда
+    await dispatch(app, api, text_update(api, b, "ответ 2"))
+    await restart(kind, d, api, deliver=False)
+    await dispatch(app, api, callback_update(api, b, "send_answer"))
+    earlier = dict(bot.load_state()["outbox"])
+    await dispatch(app, api, callback_update(api, b, "ask_random"))
+    await dispatch(app, api, text_update(api, a, "ответ 3"))
+    await dispatch(app, api, callback_update(api, a, "send_answer"))
+    assert bot.get_pair(a)["phase"] == DELIVERING and len(bot.load_state()["outbox"]) > len(earlier)
+    for job in earlier.values():
+        bot.answers_delivered(job)
+    assert bot.get_pair(a)["phase"] == DELIVERING
+    await restart(kind, d, api, deliver=False)
+    assert bot.get_pair(a)["phase"] == DELIVERING and bot.get_pair(a)["delivery"] not in earlier
+    bot.get_outbox().start(api)
+    await bot.get_outbox().idle()
+    assert bot.get_pair(a)["phase"] == IDLE
+
+    await restart(kind, d, api)
+    assert bot.get_pair(a)["phase"] == IDLE
+    await bot.get_outbox().stop()
+    await bot.STORE.stop()
+    bot.get_archive().close()
+    print(f"{kind:>7}: awaiting_qnum survives restart, delivering until answers delivered "
+          f"(also across restart), stale round ignored, guards refuse out-of-phase presses: ok")
+
+
+async def buttons() -> None:
+    d = Path(tempfile.mkdtemp(prefix="router_buttons_", dir=_tmp))
+    bot.ARCHIVE = AnswerArchive(d / "state.archive.jsonl")
+    app = bot.build_app()
+    api = FakeBot()
+    await restart("journal", d, api)
+    a, b, c, e = (BASE_UID + 10 + i for i in range(4))
+    for x, y in ((a, b), (c, e)):
+        await dispatch(app, api, text_update(api, x, "/start"))
+        await dispatch(app, api, text_update(api, y, f"/join {bot.get_pair(x)['code']}"))
+        await dispatch(app, api, callback_update(api, x, "ask_random"))
+        await dispatch(app, api, text_update(api, y, f"ответ в паре {bot.get_pair(x)['id']}"))
+        await dispatch(app, api, callback_update(api, y, "send_answer"))
+    await bot.get_outbox().idle()
+
+    await dispatch(app, api, text_update(api, a, "/history"))
+    own = api.calls[-1]["reply_markup"].inline_keyboard[0][0].callback_data
+    assert callbacks.decode(own)[1] == (0, int(bot.get_pair(a)["id"]))
+    # та же кнопка у участника другой пары (переслали сообщение) — чужой архив не показывается
+    await dispatch(app, api, callback_update(api, c, own))
+    assert api.calls[-1]["text"] == "Эта запись из архива другой пары."
+    api.calls.clear()
+    await dispatch(app, api, callback_update(api, a, own))
+    await bot.get_outbox().idle()
+    assert any(c_["method"] == "copy_messages" for c_ in api.calls)
+
+    await dispatch(app, api, callback_update(api, a, "9zz"))
+    assert api.calls[-1]["text"].startswith("Эта кнопка устарела")
+    await dispatch(app, api, callback_update(api, a, "srch_1"))
+    assert api.calls[-1]["text"].startswith("Результаты поиска устарели")
+    await dispatch(app, api, callback_update(api, a, "list_questions"))
+    page = api.calls[-1]["reply_markup"].inline_keyboard[0][0].callback_data
+    assert callbacks.decode(page)[1] == (1, "default"), page
+    await dispatch(app, api, callback_update(api, a, "qpage_1"))
+    assert api.calls[-1]["text"].startswith("📋") and "21." in api.calls[-1]["text"]
+    await bot.get_outbox().stop()
+    await bot.STORE.stop()
+    bot.get_archive().close()
+    print("buttons: legacy payloads, stale version, foreign archive record, bank in page buttons: ok")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--presses", type=int, default=200_000)
+    args = ap.parse_args()
+    bench_decode(args.presses)
+    for kind in ("journal", "json", "sqlite"):
+        asyncio.run(phases(kind))
+    asyncio.run(buttons())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+# bench_startup.py — холодный старт: импорт, чтение состояния и первый ответ
+# 1) Разбивка `python -X importtime -c "import bot"` по пакетам (собственное время модулей).
+# 2) Время до первого ответа в свежем процессе на заглушке Bot API: импорт, build_app и первый
+#    «Случайный вопрос» пары — при большом состоянии (журнал) и большом банке вопросов,
+#    без образа быстрого старта и с ним (startup.py).
+# 3) Образ даёт то же состояние, что и хранилище, и отбрасывается, если хранилище изменилось.
+# Запуск: python benchmarks/bench_startup.py [--pairs 50000] [--questions 1000000] [--runs 3]
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import hashlib
+import itertools
+import argparse
+import subprocess
+import statistics
+import tempfile
+from collections import defaultdict
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+ROOT = HERE.parent
+BASE_UID = 60_000_000
+OWN = {"bot", "storage", "completions", "delivery", "locks", "question_bank", "pages", "reminders", "metrics",
+       "startup", "archive", "dedupe", "inbound", "analytics"}
+HTTP = {"httpx", "httpcore", "h11", "h2", "anyio", "sniffio", "certifi", "idna", "hpack", "hyperframe"}
+
+
+# ---------- дочерний процесс ----------
+async def child(args) -> None:
+    t0 = time.perf_counter()
+    import bot
+    import fake_api
+    from fake_api import FakeBot, dispatch, callback_update
+    t_import = time.perf_counter() - t0
+    # у каждого запуска свои update_id: иначе повтор отбросило бы окно повторов из прошлого запуска
+    fake_api._update_ids = itertools.count(args.uid)
+
+    from_image = []
+    if bot.STORE.preload is not None:
+        preload = bot.STORE.preload
+
+        def traced():
+            state = preload()
+            from_image.append(state is not None)
+            return state
+        bot.STORE.preload = traced
+    if args.digest:
+        state = bot.load_state()
+        print(json.dumps({"image": any(from_image),
+                          "digest": hashlib.sha256(json.dumps(state, sort_keys=True).encode()).hexdigest()}))
+        return
+    api = FakeBot()
+    app = bot.build_app()
+    t_build = time.perf_counter() - t0
+    await dispatch(app, api, callback_update(api, args.uid, "ask_random"))
+    t_first = time.perf_counter() - t0
+    at = time.time()
+    assert any("№" in (c.get("text") or "") for c in api.calls), api.calls
+    if args.save:
+        await bot.STORE.stop()
+        bot.save_startup_image()
+    print(json.dumps({"import": t_import, "build": t_build, "first": t_first, "at": at,
+                      "image": any(from_image)}))
+
+
+# ---------- родитель ----------
+def make_state(n: int, questions: int):
+    from storage import empty_pair
+    rng = random.Random(1)
+    root = {"pairs": {}, "user_pair": {}, "invites": {}, "outbox": {}, "next_pair_id": n + 1, "journal_seq": 0}
+    for i in range(n):
+        pid, a, b = str(i + 1), BASE_UID + 2 * i, BASE_UID + 2 * i + 1
+        pair = empty_pair(pid)
+        code = f"c{i:07d}"
+        pair.update(code=code, roles={"A": a, "B": b}, participants=[a, b],
+                    completed_by_user={str(a): rng.sample(range(1, questions), 20),
+                                       str(b): rng.sample(range(1, questions), 20)})
+        root["pairs"][pid] = pair
+        root["user_pair"][str(a)] = root["user_pair"][str(b)] = pid
+        root["invites"][code] = pid
+    return root
+
+
+def spawn(tmp: Path, env: dict, *extra: str) -> dict:
+    started = time.time()
+    out = subprocess.run([sys.executable, __file__, "--child", *extra], cwd=tmp, env=env,
+                         capture_output=True, text=True)
+    if out.returncode:
+        raise SystemExit(out.stderr)
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    if "at" in result:
+        result["wall"] = result["at"] - started
+    return result
+
+
+def importtime(tmp: Path, env: dict) -> None:
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import bot"], cwd=tmp, env=env,
+                         capture_output=True, text=True, check=True)
+    # строки вида «import time: self [us] | cumulative | имя», вложенность — отступом имени
+    modules = []
+    for line in out.stderr.splitlines():
+        if line.startswith("import time:") and "self [us]" not in line:
+            self_us, _, name = (x.strip() for x in line[len("import time:"):].split("|"))
+            modules.append((int(self_us), name))
+    groups = defaultdict(int)
+    for self_us, name in modules:
+        top = name.split(".")[0]
+        groups["бот" if top in OWN else "telegram" if top == "telegram" else
+               "httpx и зависимости" if top in HTTP else "stdlib и прочее"] += self_us
+    print(f"import bot: {sum(groups.values()) / 1e3:.0f}ms (self time by group)")
+    for group, us in sorted(groups.items(), key=lambda kv: -kv[1]):
+        print(f"  {group:<22} {us / 1e3:6.1f}ms")
+    own = sorted(((us, name) for us, name in modules if name in OWN), reverse=True)
+    print("  модули бота: " + ", ".join(f"{name} {us / 1e3:.1f}ms" for us, name in own))
+
+
+def report(name: str, runs) -> None:
+    med = lambda key: statistics.median(r[key] for r in runs)  # noqa: E731
+    print(f"{name:<26} import {med('import') * 1e3:5.0f}ms | build_app {(med('build') - med('import')) * 1e3:4.0f}ms"
+          f" | first response {med('first') * 1e3:5.0f}ms in-process, {med('wall') * 1e3:5.0f}ms from spawn")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--pairs", type=int, default=50_000)
+    ap.add_argument("--questions", type=int, default=1_000_000)
+    ap.add_argument("--runs", type=int, default=3)
+    ap.add_argument("--child", action="store_true")
+    ap.add_argument("--uid", type=int, default=BASE_UID)
+    ap.add_argument("--save", action="store_true")
+    ap.add_argument("--digest", action="store_true")
+    args = ap.parse_args()
+    sys.path.insert(0, str(ROOT))
+    sys.path.insert(0, str(HERE))
+    if args.child:
+        asyncio.run(child(args))
+        return
+
+    tmp = Path(tempfile.mkdtemp(prefix="bench_startup_"))
+    with open(tmp / "questions.txt", "w", encoding="utf-8") as f:
+        for i in range(args.questions):
+            f.write(f"Вопрос {i + 1}: что тебе запомнилось из поездки номер {i}?\n")
+    state = make_state(args.pairs, min(args.questions, 127))
+    (tmp / "state.json").write_text(json.dumps(state, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+    env = {**os.environ, "TELEGRAM_TOKEN": "123456:TEST", "STATE_FILE_PATH": str(tmp / "state.json"),
+           "PYTHONPATH": os.pathsep.join([str(ROOT), str(HERE)])}
+    print(f"{args.pairs} pairs (state.json {(tmp / 'state.json').stat().st_size / 1e6:.1f} MB), "
+          f"{args.questions} questions ({(tmp / 'questions.txt').stat().st_size / 1e6:.1f} MB)")
+    importtime(tmp, env)
+
+    uid = iter(range(BASE_UID, BASE_UID + 2 * args.pairs, 2))
+    plain = {**env, "STARTUP_IMAGE_PATH": ""}
+    cold = [spawn(tmp, plain, "--uid", str(next(uid))) for _ in range(args.runs)]
+    assert not any(r["image"] for r in cold)
+    report("без образа", cold)
+
+    # первый запуск с образом: образа ещё нет, он пишется при остановке
+    first = spawn(tmp, env, "--uid", str(next(uid)), "--save")
+    assert not first["image"] and (tmp / "state.image").exists()
+    warm = [spawn(tmp, env, "--uid", str(next(uid)), "--save") for _ in range(args.runs)]
+    assert all(r["image"] for r in warm)
+    report("с образом", warm)
+    print(f"state.image {(tmp / 'state.image').stat().st_size / 1e6:.1f} MB; "
+          f"first response {statistics.median(r['first'] for r in cold) / statistics.median(r['first'] for r in warm):.1f}x faster")
+
+    # то же состояние, что и из хранилища
+    from_image = spawn(tmp, env, "--digest")
+    from_store = spawn(tmp, plain, "--digest")
+    assert from_image["image"] and not from_store["image"]
+    assert from_image["digest"] == from_store["digest"]
+    # хранилище изменилось без записи образа (например, бот упал) — образ отбрасывается
+    with open(tmp / "state.journal", "a", encoding="utf-8") as f:
+        f.write(json.dumps({"e": "meta", "t": time.time(), "k": "next_pair_id", "v": args.pairs + 7}) + "\n")
+    stale = spawn(tmp, env, "--digest")
+    assert not stale["image"] and stale["digest"] != from_image["digest"]
+    print("image state == storage state: ok; stale image rejected: ok")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# bench_state.py — обновлений в секунду: старый load_state()/save_state() на каждый апдейт против StateStore
+# Запуск: python benchmarks/bench_state.py [--updates 2000] [--history 127]
+
+import sys
+import json
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import bot  # noqa: E402
+from storage import StateStore, JsonBackend  # noqa: E402
+
+A, B = 1001, 1002
+
+
+def seed_state(history: int):
+    s = bot.default_state()
+    pair = bot.new_pair_state("1")
+    pair["roles"] = {"A": A, "B": B}
+    pair["participants"] = [A, B]
+    pair["completed_by_user"] = {str(A): list(range(1, history + 1)), str(B): list(range(1, history + 1))}
+    s["pairs"]["1"] = pair
+    s["user_pair"] = {str(A): "1", str(B): "1"}
+    return s
+
+
+def scenario(n_updates: int):
+    # типичный поток: B шлёт черновики, затем «Передать ответ» (4 сохранения подряд)
+    for i in range(n_updates):
+        state = bot.get_pair(B)
+        if i % 5 == 4:
+            if not state.get("pending"):
+                state["pending"] = {"to_user": state["roles"]["B"], "from_user": state["roles"]["A"], "qnum": 1}
+            a = state["pending"]["from_user"]
+            before = bot.completed_count(state, a)
+            bot.mark_completed_for_user(state, a, (i % bot.TOTAL_QUESTIONS) + 1)
+            # размер истории постоянный: убираем только то, что отметка действительно добавила
+            if bot.completed_count(state, a) > before:
+                state["completed_by_user"][str(a)].pop()
+            bot.clear_pending(state)
+            bot.auto_swap_roles(state)
+        else:
+            bot._append_draft(state, {"from_user": B, "type": "voice", "data": {"file_id": f"f{i}", "caption": None}})
+
+
+def run_legacy(path: Path, n_updates: int, history: int) -> float:
+    path.write_text(json.dumps(seed_state(history), ensure_ascii=False, indent=2), encoding="utf-8")
+
+    loaded = {}
+
+    def load_state():
+        loaded["root"] = json.loads(path.read_text(encoding="utf-8"))
+        return loaded["root"]
+
+    def save_state(op, *args):
+        # как раньше: каждое сохранение переписывает весь документ
+        path.write_text(json.dumps(loaded["root"], ensure_ascii=False, indent=2), encoding="utf-8")
+
+    bot.load_state, bot.save_state = load_state, save_state
+    t0 = time.perf_counter()
+    scenario(n_updates)
+    return time.perf_counter() - t0
+
+
+def run_store(path: Path, n_updates: int, history: int) -> float:
+    path.write_text(json.dumps(seed_state(history), ensure_ascii=False), encoding="utf-8")
+    store = StateStore(JsonBackend(path), bot.default_state, upgrade=bot.upgrade_state, max_dirty=bot.STATE_FLUSH_MAX_DIRTY)
+    bot.load_state, bot.save_state = store.load, store.record
+    t0 = time.perf_counter()
+    scenario(n_updates)
+    store.flush()
+    elapsed = time.perf_counter() - t0
+    print(f"  store: flushes={store.flushes}")
+    return elapsed
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--updates", type=int, default=2000)
+    ap.add_argument("--history", type=int, default=bot.TOTAL_QUESTIONS)
+    args = ap.parse_args()
+    orig = bot.load_state, bot.save_state
+    with tempfile.TemporaryDirectory() as d:
+        legacy = run_legacy(Path(d) / "legacy.json", args.updates, args.history)
+        store = run_store(Path(d) / "store.json", args.updates, args.history)
+    bot.load_state, bot.save_state = orig
+    print(f"updates={args.updates} history={args.history}")
+    print(f"  legacy load/save: {args.updates / legacy:10.0f} upd/s")
+    print(f"  StateStore:       {args.updates / store:10.0f} upd/s  (x{legacy / store:.1f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+# fake_api.py — заглушка Telegram Bot API и фабрика апдейтов для офлайн-замеров
+# Объекты Update создаются настоящими классами PTB, но все вызовы API уходят в FakeBot.
+# FakeBot умеет имитировать задержку сети и ответы 429 (RetryAfter), как Telegram отклоняет
+# текст длиннее 4096 символов (BadRequest) и как copy_messages молча пропускает удалённые сообщения, dispatch() раздаёт апдейты
+# обработчикам собранного build_app() приложения так же, как PTB: первый подходящий в группе.
+# restart() — перезапуск бота на заглушке поверх того же каталога состояния (общий для замеров).
+
+import random
+import asyncio
+import itertools
+from types import SimpleNamespace
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+from telegram import Update
+from telegram.error import BadRequest, RetryAfter
+from telegram.ext import ApplicationHandlerStop
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+MAX_TEXT = 4096
+
+
+class FakeBot:
+    def __init__(self, username: str = "lwut_test_bot", latency: float = 0.0, jitter: float = 0.0,
+                 flood: float = 0.0, retry_after: float = 0.05):
+        self.username = username
+        self.defaults = None
+        self.latency = latency      # имитация сетевой задержки на каждый вызов
+        self.jitter = jitter        # случайная добавка к задержке — перемешивает порядок завершения
+        self.flood = flood          # доля вызовов, на которые «Telegram» отвечает 429
+        self.retry_after = retry_after
+        self.calls: List[Dict[str, Any]] = []
+        self.throttled = 0
+        self.deleted: set = set()   # (чат, message_id) удалённых исходников: copy_messages их пропускает
+
+    async def _call(self, method: str, kwargs: Dict[str, Any]):
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + random.random() * self.jitter)
+        if self.flood and random.random() < self.flood:
+            self.throttled += 1
+            raise RetryAfter(self.retry_after)
+        if len(kwargs.get("text") or "") > MAX_TEXT:
+            raise BadRequest("Message is too long")
+        return self._record(method, kwargs)
+
+    def _record(self, method: str, kwargs: Dict[str, Any]):
+        self.calls.append({"method": method, **kwargs})
+        return SimpleNamespace(message_id=next(_message_ids), chat_id=kwargs.get("chat_id"))
+
+    async def send_message(self, chat_id=None, text=None, **kwargs):
+        return await self._call("send_message", {"chat_id": chat_id, "text": text, **kwargs})
+
+    async def send_voice(self, chat_id=None, voice=None, **kwargs):
+        return await self._call("send_voice", {"chat_id": chat_id, "voice": voice, **kwargs})
+
+    async def send_audio(self, chat_id=None, audio=None, **kwargs):
+        return await self._call("send_audio", {"chat_id": chat_id, "audio": audio, **kwargs})
+
+    async def send_video_note(self, chat_id=None, video_note=None, **kwargs):
+        return await self._call("send_video_note", {"chat_id": chat_id, "video_note": video_note, **kwargs})
+
+    async def copy_messages(self, chat_id=None, from_chat_id=None, message_ids=None, **kwargs):
+        await self._call("copy_messages", {"chat_id": chat_id, "from_chat_id": from_chat_id,
+                                           "message_ids": list(message_ids), **kwargs})
+        return tuple(SimpleNamespace(message_id=next(_message_ids)) for m in message_ids
+                     if (from_chat_id, m) not in self.deleted)
+
+    async def delete_messages(self, chat_id=None, message_ids=None, **kwargs):
+        return await self._call("delete_messages", {"chat_id": chat_id, "message_ids": list(message_ids), **kwargs})
+
+    async def send_media_group(self, chat_id=None, media=None, **kwargs):
+        return await self._call("send_media_group", {"chat_id": chat_id, "media": list(media), **kwargs})
+
+    async def edit_message_text(self, text=None, chat_id=None, message_id=None, **kwargs):
+        return await self._call("edit_message_text", {"chat_id": chat_id, "message_id": message_id, "text": text, **kwargs})
+
+    async def answer_callback_query(self, callback_query_id=None, **kwargs):
+        return await self._call("answer_callback_query", {"callback_query_id": callback_query_id, **kwargs})
+
+    def sent_to(self, chat_id: int) -> List[Dict[str, Any]]:
+        return [c for c in self.calls if c.get("chat_id") == chat_id]
+
+
+# ---------- UPDATES ----------
+def _user(uid: int) -> Dict[str, Any]:
+    return {"id": uid, "is_bot": False, "first_name": f"u{uid}"}
+
+def _message(uid: int, **fields) -> Dict[str, Any]:
+    return {"message_id": next(_message_ids), "date": 0,
+            "chat": {"id": uid, "type": "private"}, "from": _user(uid), **fields}
+
+def make_update(bot: FakeBot, payload: Dict[str, Any]) -> Update:
+    return Update.de_json({"update_id": next(_update_ids), **payload}, bot)
+
+def text_update(bot: FakeBot, uid: int, text: str) -> Update:
+    fields: Dict[str, Any] = {"text": text}
+    if text.startswith("/"):
+        fields["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return make_update(bot, {"message": _message(uid, **fields)})
+
+def voice_update(bot: FakeBot, uid: int, file_id: str) -> Update:
+    return make_update(bot, {"message": _message(uid, voice={"file_id": file_id, "file_unique_id": file_id, "duration": 1})})
+
+def audio_update(bot: FakeBot, uid: int, file_id: str) -> Update:
+    return make_update(bot, {"message": _message(uid, audio={"file_id": file_id, "file_unique_id": file_id, "duration": 1})})
+
+def video_note_update(bot: FakeBot, uid: int, file_id: str) -> Update:
+    return make_update(bot, {"message": _message(uid, video_note={"file_id": file_id, "file_unique_id": file_id,
+                                                                  "length": 240, "duration": 1})})
+
+def callback_update(bot: FakeBot, uid: int, data: str) -> Update:
+    return make_update(bot, {"callback_query": {
+        "id": str(next(_update_ids)), "from": _user(uid), "chat_instance": str(uid), "data": data,
+        "message": _message(uid, text="menu"),
+    }})
+
+
+class FakeContext:
+    # минимальная замена CallbackContext: bot, args и user_data на пользователя
+    _user_data: Dict[int, Dict[str, Any]] = {}
+
+    def __init__(self, bot: FakeBot, update: Update, args: Optional[List[str]] = None):
+        self.bot = bot
+        self.args = args if args is not None else []
+        uid = update.effective_user.id if update.effective_user else 0
+        self.user_data = self._user_data.setdefault(uid, {})
+
+
+async def dispatch(app, bot: FakeBot, update: Update) -> bool:
+    # как Application.process_update: группы по порядку, в каждой — первый подходящий обработчик,
+    # ApplicationHandlerStop прекращает обработку. False — обработчик группы 0 не вызван
+    # (никто не взял апдейт или он отброшен раньше, например как повтор)
+    handled = False
+    for group in sorted(app.handlers):
+        for handler in app.handlers[group]:
+            check = handler.check_update(update)
+            if check is None or check is False:
+                continue
+            text = update.message.text if update.message else None
+            args = text.split()[1:] if text and text.startswith("/") else None
+            try:
+                await handler.callback(update, FakeContext(bot, update, args))
+            except ApplicationHandlerStop:
+                return handled
+            handled = handled or group == 0
+            break
+    return handled
+
+
+# ---------- ПЕРЕЗАПУСК ----------
+def make_store(kind: str, d: Path, **journal):
+    # journal — параметры JournalBackend (например, compact_bytes)
+    import bot
+    from storage import StateStore, JsonBackend, SqliteBackend, JournalBackend
+    backend = {"journal": lambda: JournalBackend(d / "state.json", d / "state.journal", **journal),
+               "json": lambda: JsonBackend(d / "state.json"),
+               "sqlite": lambda: SqliteBackend(d / "state.db")}[kind]()
+    return StateStore(backend, bot.default_state, upgrade=bot.upgrade_state)
+
+
+async def restart(kind: str, d: Path, api: FakeBot, deliver: bool = True, **journal) -> None:
+    # прежние outbox, сводки и хранилище останавливаются (последняя пачка записана, файлы закрыты)
+    # до того, как новое хранилище откроет те же файлы: у журнала не бывает двух писателей
+    import bot
+    from delivery import RateLimiter
+    if bot.OUTBOX is not None:
+        await bot.get_outbox().stop()
+    await bot.ACKS.stop()
+    if bot.STORE.state is not None:
+        await bot.STORE.stop()
+    bot.STORE.backend.close()
+    bot.STORE = make_store(kind, d, **journal)
+    bot.STORE.start()
+    bot.OUTBOX = None
+    bot.get_outbox().limiter = RateLimiter(1e9, 1e9, 1e9)   # заглушка API не ограничивает частоту
+    if deliver:
+        bot.get_outbox().start(api)
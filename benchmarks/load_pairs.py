@@ -0,0 +1,137 @@
+# load_pairs.py — нагрузочный тест: N одновременных пар A↔B против заглушки Bot API
+# Перед прогоном — переход со старого state.json (одна пара на бот): в паре "1" остаются держатели ролей,
+# участник без роли свободен создать свою пару, пара только с A получает код приглашения.
+# Запуск: python benchmarks/load_pairs.py [--pairs 10000] [--drafts 3] [--backend journal|json|sqlite] [--tracemalloc]
+
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import bot  # noqa: E402
+from storage import StateStore, JsonBackend, SqliteBackend, JournalBackend  # noqa: E402
+from delivery import RateLimiter  # noqa: E402
+from archive import AnswerArchive  # noqa: E402
+from dedupe import ordered  # noqa: E402
+from fake_api import FakeBot, FakeContext, text_update, voice_update, callback_update  # noqa: E402
+
+BASE_UID = 10_000_000
+
+
+async def run_pair(api: FakeBot, i: int, latencies: list):
+    a, b = BASE_UID + 2 * i, BASE_UID + 2 * i + 1
+
+    async def call(handler, update, args=None):
+        t0 = time.perf_counter()
+        await handler(update, FakeContext(api, update, args))
+        latencies.append(time.perf_counter() - t0)
+        await asyncio.sleep(0)  # даём поработать другим парам
+
+    await call(bot.start, text_update(api, a, "/start"))
+    code = bot.get_pair(a)["code"]
+    await call(bot.join_cmd, text_update(api, b, f"/join {code}"), [code])
+    await call(bot.on_button, callback_update(api, a, "ask_random"))
+    for k in range(DRAFTS):
+        await call(bot.on_voice, voice_update(api, b, f"v{i}_{k}"))
+    await call(bot.on_button, callback_update(api, b, "send_answer"))
+    pair = bot.get_pair(a)
+    assert pair["roles"] == {"A": b, "B": a}, pair["roles"]
+    assert pair["pending"] is None and not pair["draft_answers"]
+
+
+async def legacy() -> None:
+    a, b, extra = BASE_UID - 1, BASE_UID - 2, BASE_UID - 3
+    with tempfile.TemporaryDirectory() as d:
+        for roles in ({"A": a, "B": b}, {"A": a, "B": None}):
+            path = Path(d) / "state.json"
+            path.write_text(json.dumps({"roles": roles, "pending": None, "draft_answers": [],
+                                        "completed_by_user": {}, "participants": [a, b, extra]}))
+            bot.STORE = StateStore(JsonBackend(path), bot.default_state, upgrade=bot.upgrade_state)
+            api = FakeBot()
+            root = bot.load_state()
+            assert set(root["user_pair"]) == {str(uid) for uid in roles.values() if uid}, root["user_pair"]
+            await bot.start(text_update(api, extra, "/start"), FakeContext(api, text_update(api, extra, "/start")))
+            assert bot.get_pair(extra)["roles"]["A"] == extra and bot.get_pair(extra)["id"] != "1"
+            if roles["B"] is None:
+                await bot.start(text_update(api, a, "/start"), FakeContext(api, text_update(api, a, "/start")))
+                code = bot.get_pair(a)["code"]
+                assert code and root["invites"][code] == "1" and code in api.sent_to(a)[-1]["text"]
+                pair, status = bot.join_pair(b, code)
+                assert status == "joined" and pair["id"] == "1", status
+    print("legacy state: role-less participant free, invite code for a pair without B: ok")
+
+
+async def run(pairs: int):
+    with tempfile.TemporaryDirectory() as d:
+        make = {
+            "sqlite": lambda: SqliteBackend(Path(d) / "state.db"),
+            "json": lambda: JsonBackend(Path(d) / "state.json"),
+            # небольшой порог, чтобы прогон проходил и через снимки со сменой сегментов
+            "journal": lambda: JournalBackend(Path(d) / "state.json", Path(d) / "state.journal", compact_bytes=256 << 10),
+        }[BACKEND]
+        bot.STORE = StateStore(make(), bot.default_state, upgrade=bot.upgrade_state,
+                               max_dirty=bot.STATE_FLUSH_MAX_DIRTY)
+        bot.STORE.start()
+        bot.ARCHIVE = AnswerArchive(Path(d) / "state.archive.jsonl")
+        api = FakeBot()
+        bot.OUTBOX = None
+        bot.get_outbox().limiter = RateLimiter(1e9, 1e9, 1e9)  # заглушка API не ограничивает частоту
+        bot.get_outbox().start(api)
+        latencies: list = []
+        if TRACE:
+            tracemalloc.start()
+        t0 = time.perf_counter()
+        await asyncio.gather(*(run_pair(api, i, latencies) for i in range(pairs)))
+        await bot.get_outbox().idle()
+        elapsed = time.perf_counter() - t0
+        assert not bot.load_state()["outbox"], "undelivered answers left in outbox"
+        peak = 0
+        if TRACE:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        await bot.STORE.stop()
+        root = bot.load_state()
+        # после перезапуска хранилище должно отдать ровно то же состояние
+        backend = make()
+        persisted = backend.read()
+        # окно повторов сравнивается по порядку ключей: SQLite хранит только его (см. dedupe.py)
+        assert ordered(persisted["dedupe"]) == ordered(root["dedupe"]), "dedupe window differs from memory"
+        assert {**persisted, "dedupe": None} == {**root, "dedupe": None}, "persisted state differs from memory"
+        backend.close()
+        bot.STORE.backend.close()
+        state_bytes = len(json.dumps(root, ensure_ascii=False, separators=(",", ":")))
+    latencies.sort()
+    n = len(latencies)
+    print(f"{BACKEND:>6} pairs={pairs:>6} updates={n:>7} time={elapsed:6.2f}s  {n / elapsed:8.0f} upd/s  "
+          f"p50={latencies[n // 2] * 1e6:6.0f}us p99={latencies[int(n * 0.99)] * 1e6:6.0f}us  "
+          f"state={state_bytes / pairs:5.0f} B/pair  api_calls={len(api.calls)}"
+          + (f"  peak_mem={peak / pairs / 1024:5.1f} KiB/pair" if TRACE else ""))
+
+
+def main():
+    global DRAFTS, TRACE, BACKEND
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--pairs", type=int, default=10_000)
+    ap.add_argument("--drafts", type=int, default=3)
+    ap.add_argument("--backend", choices=["journal", "json", "sqlite"], default="journal")
+    ap.add_argument("--tracemalloc", action="store_true", help="замерить пик памяти (сильно замедляет прогон)")
+    args = ap.parse_args()
+    DRAFTS, TRACE, BACKEND = args.drafts, args.tracemalloc, args.backend
+    asyncio.run(legacy())
+    # стоимость апдейта и память на пару не должны расти с числом пар
+    for n in sorted({max(1, args.pairs // 10), args.pairs}):
+        asyncio.run(run(n))
+
+
+DRAFTS = 3
+TRACE = False
+BACKEND = "journal"
+
+if __name__ == "__main__":
+    main()
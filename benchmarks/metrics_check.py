@@ -0,0 +1,152 @@
+# metrics_check.py — проверка метрик на синтетических апдейтах, без токена и сети
+# - Приложение собирается настоящим build_app(), апдейты раздаются зарегистрированным
+#   (уже обёрнутым метриками) обработчикам так же, как это делает PTB: первый подходящий.
+# - Сверяются счётчики апдейтов по типам, число замеров обработчиков, вызовы load/save/flush,
+#   размер файла состояния, черновики, метрики Bot API (через подменённый HTTP-транспорт)
+#   и выгрузка GET /metrics. В конце — накладные расходы обёртки на вызов.
+# Запуск: python benchmarks/metrics_check.py [--pairs 50] [--drafts 5]
+
+import os
+import re
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+from pathlib import Path
+from collections import Counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+_tmp = tempfile.mkdtemp(prefix="metrics_check_")
+os.environ["TELEGRAM_TOKEN"] = "123456:TEST"
+os.environ["STATE_FILE_PATH"] = str(Path(_tmp) / "state.json")
+
+import httpx  # noqa: E402
+from aiohttp import ClientSession  # noqa: E402
+
+import bot  # noqa: E402
+import metrics  # noqa: E402
+from delivery import RateLimiter  # noqa: E402
+from fake_api import (FakeBot, dispatch, text_update, voice_update, audio_update,  # noqa: E402
+                      video_note_update, callback_update)
+
+BASE_UID = 30_000_000
+METRICS_PORT = 18090
+
+
+async def run_pairs(app, api, pairs, drafts, expected):
+    def send(update, kind):
+        expected[kind] += 1
+        return dispatch(app, api, update)
+
+    for i in range(pairs):
+        a, b = BASE_UID + 2 * i, BASE_UID + 2 * i + 1
+        await send(text_update(api, a, "/start"), "command:start")
+        code = bot.get_pair(a)["code"]
+        await send(text_update(api, b, f"/join {code}"), "command:join")
+        await send(callback_update(api, a, "ask_random"), "callback:ask_random")
+        for k in range(drafts):
+            await send(text_update(api, b, f"t{i}_{k}"), "text")
+        await send(voice_update(api, b, f"v{i}"), "voice")
+        await send(audio_update(api, b, f"a{i}"), "audio")
+        await send(video_note_update(api, b, f"n{i}"), "video_note")
+        await send(callback_update(api, a, "list_questions"), "callback:list_questions")
+        await send(callback_update(api, a, "qpage_1"), "callback:qpage")
+        if i % 2 == 0:
+            await send(callback_update(api, b, "send_answer"), "callback:send_answer")
+
+
+async def check_api():
+    # настоящий HTTPXRequest с подменённым транспортом: 200 на sendMessage, 429 на copyMessages
+    def respond(request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/copyMessages"):
+            return httpx.Response(429, json={"ok": False, "error_code": 429, "description": "Too Many Requests",
+                                             "parameters": {"retry_after": 1}})
+        return httpx.Response(200, json={"ok": True, "result": True})
+
+    req = metrics.InstrumentedRequest()
+    req._client = httpx.AsyncClient(transport=httpx.MockTransport(respond))
+    base = "https://api.telegram.org/bot123456:TEST"
+    for _ in range(3):
+        await req.do_request(f"{base}/sendMessage", "POST")
+    await req.do_request(f"{base}/copyMessages", "POST")
+    await req.shutdown()
+    assert metrics.API_SECONDS.count("sendMessage") == 3, "bot_api_seconds{sendMessage}"
+    assert metrics.API_SECONDS.count("copyMessages") == 1, "bot_api_seconds{copyMessages}"
+    assert metrics.API_ERRORS.get("copyMessages", "429") == 1, "bot_api_errors_total{429}"
+    assert metrics.API_ERRORS.get("sendMessage", "200") == 0
+
+
+def overhead(n: int = 200_000) -> float:
+    async def noop(update, context):
+        return None
+
+    timed = metrics.timed(noop)
+
+    async def loop(fn):
+        t0 = time.perf_counter()
+        for _ in range(n):
+            await fn(None, None)
+        return time.perf_counter() - t0
+
+    raw = asyncio.run(loop(noop))
+    wrapped = asyncio.run(loop(timed))
+    return (wrapped - raw) / n
+
+
+async def run(pairs: int, drafts: int) -> None:
+    app = bot.build_app()
+    api = FakeBot()
+    bot.STORE.start()
+    bot.get_outbox().limiter = RateLimiter(1e9, 1e9, 1e9)
+    bot.get_outbox().start(api)
+    expected: Counter = Counter()
+    await run_pairs(app, api, pairs, drafts, expected)
+    await bot.get_outbox().idle()
+    await bot.STORE.flush_async()
+
+    for kind, n in expected.items():
+        got = metrics.UPDATES.get(kind)
+        assert got == n, f"bot_updates_total{{type={kind}}}: {got} != {n}"
+    handled = sum(metrics.HANDLER_SECONDS.count(*key) for key in metrics.HANDLER_SECONDS.series)
+    assert handled == sum(expected.values()), f"handler observations {handled} != {sum(expected.values())}"
+    assert metrics.STATE_CALLS.get("load") > 0 and metrics.STATE_CALLS.get("save") > 0
+    assert metrics.STATE_CALLS.get("flush") >= 1 and metrics.STATE_SECONDS.count("flush") >= 1
+    waiting = sum(len(p["draft_answers"]) for p in bot.load_state()["pairs"].values())
+    assert waiting == (pairs // 2) * (drafts + 3), f"drafts pending {waiting}"
+    await check_api()
+
+    runner = await metrics.serve("127.0.0.1", METRICS_PORT)
+    try:
+        async with ClientSession() as session:
+            async with session.get(f"http://127.0.0.1:{METRICS_PORT}/metrics") as resp:
+                assert resp.status == 200
+                assert resp.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+                body = await resp.text()
+    finally:
+        await runner.cleanup()
+    scraped = {m.group(1): float(m.group(2)) for m in re.finditer(r"^(\S+) (\S+)$", body, re.M)}
+    assert scraped['bot_updates_total{type="voice"}'] == pairs
+    assert scraped["bot_drafts_pending"] == waiting
+    assert scraped["bot_state_file_bytes"] == bot._state_file_bytes() > 0
+    assert scraped['bot_handler_seconds_count{handler="on_text"}'] == pairs * drafts
+    assert scraped['bot_handler_seconds_bucket{handler="on_text",le="+Inf"}'] == pairs * drafts
+    await bot.get_outbox().stop()
+    await bot.STORE.stop()
+    print(f"ok: {sum(expected.values())} updates, {len(scraped)} series, "
+          f"{len(body.encode())} bytes at /metrics")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--pairs", type=int, default=50)
+    ap.add_argument("--drafts", type=int, default=5)
+    args = ap.parse_args()
+    asyncio.run(run(args.pairs, args.drafts))
+    print(f"overhead of metrics.timed: {overhead() * 1e9:.0f} ns per handler call")
+
+
+if __name__ == "__main__":
+    main()
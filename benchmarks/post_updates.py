@@ -0,0 +1,37 @@
+# post_updates.py — отправляет записанные апдейты (JSON Lines, по одному Update на строку) на вебхук
+# Запуск: python benchmarks/post_updates.py updates.jsonl [http://127.0.0.1:8080/webhook] [--secret S]
+
+import sys
+import json
+import asyncio
+import argparse
+
+from aiohttp import ClientSession
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+async def post_all(path: str, url: str, secret: str, concurrency: int) -> None:
+    headers = {SECRET_HEADER: secret} if secret else {}
+    sem = asyncio.Semaphore(concurrency)
+    with open(path, encoding="utf-8") as f:
+        updates = [json.loads(line) for line in f if line.strip()]
+    async with ClientSession() as session:
+        async def post(update):
+            async with sem, session.post(url, json=update, headers=headers) as resp:
+                print(update.get("update_id"), resp.status)
+        await asyncio.gather(*(post(u) for u in updates))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("file")
+    ap.add_argument("url", nargs="?", default="http://127.0.0.1:8080/webhook")
+    ap.add_argument("--secret", default="")
+    ap.add_argument("--concurrency", type=int, default=1, help="1 — строго по порядку записи")
+    args = ap.parse_args()
+    asyncio.run(post_all(args.file, args.url, args.secret, args.concurrency))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
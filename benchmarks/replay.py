@@ -0,0 +1,294 @@
+# replay.py — офлайн-прогон сценариев и записанных апдейтов через обработчики build_app()
+# - Приложение собирается настоящим build_app() (фиктивный токен, сеть не нужна), апдейты
+#   раздаются его обработчикам через fake_api.dispatch, вызовы Bot API уходят в FakeBot
+#   с имитацией задержки (--latency/--jitter) и ответов 429 (--flood).
+# - Сценарии: pairing (/start + /join), ask_random, burst (пачка голосовых и кружочков
+#   + «Передать ответ»), full (несколько раундов с обменом ролями). Пары идут параллельно,
+#   одновременно активных не больше --concurrency.
+# - --record сохраняет апдейты прогона в JSON Lines (формат post_updates.py) и рядом
+#   <файл>.invites.json: код приглашения → создатель пары. --replay воспроизводит такой файл:
+#   коды подменяются на выданные в этом прогоне, апдейты одной пары идут по порядку.
+# - Итог: пропускная способность обработчиков (до последнего обработанного апдейта) и отдельно
+#   полное время вместе с досылкой outbox, p50/p99 по типам апдейтов, вызовы API и 429, ввод-вывод состояния.
+# Запуск:
+#   python benchmarks/replay.py --scenario full --pairs 1000 --concurrency 200 --latency 0.02 --flood 0.01
+#   python benchmarks/replay.py --scenario burst --pairs 100 --record run.jsonl
+#   python benchmarks/replay.py --replay run.jsonl --concurrency 50
+
+import os
+import sys
+import json
+import time
+import logging
+import random
+import asyncio
+import argparse
+import tempfile
+from pathlib import Path
+from collections import Counter, defaultdict
+from typing import Dict, Any, List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+_tmp = tempfile.mkdtemp(prefix="replay_")
+os.environ["TELEGRAM_TOKEN"] = "123456:REPLAY"
+os.environ["STATE_FILE_PATH"] = str(Path(_tmp) / "state.json")
+os.environ["STATE_DB_PATH"] = str(Path(_tmp) / "state.db")
+
+from telegram import Update  # noqa: E402
+
+import bot  # noqa: E402
+import metrics  # noqa: E402
+from storage import StateStore  # noqa: E402
+from delivery import RateLimiter  # noqa: E402
+from fake_api import (FakeBot, dispatch, text_update, voice_update, video_note_update,  # noqa: E402
+                      callback_update)
+
+BASE_UID = 40_000_000
+
+
+class Harness:
+    def __init__(self, app, api, record: bool):
+        self.app = app
+        self.api = api
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Counter = Counter()
+        self.unhandled = 0
+        self.recorded: Optional[List[Dict[str, Any]]] = [] if record else None
+        self.invites: Dict[str, int] = {}     # код приглашения → создатель пары
+        self.role_swaps = Counter()           # ok / missed
+
+    async def send(self, update) -> None:
+        if self.recorded is not None:
+            self.recorded.append(update.to_dict())
+        kind = metrics.update_type(update)
+        t0 = time.perf_counter()
+        try:
+            if not await dispatch(self.app, self.api, update):
+                self.unhandled += 1
+        except Exception as e:
+            # как error handler PTB: апдейт потерян, бот работает дальше
+            self.errors[type(e).__name__] += 1
+        self.latencies[kind].append(time.perf_counter() - t0)
+
+
+# ---------- СЦЕНАРИИ ----------
+def uids(i: int):
+    return BASE_UID + 2 * i, BASE_UID + 2 * i + 1
+
+
+async def pairing(h: Harness, i: int, args) -> tuple:
+    a, b = uids(i)
+    await h.send(text_update(h.api, a, "/start"))
+    pair = bot.get_pair(a)
+    if pair is None or not pair.get("code"):
+        return a, b
+    h.invites[pair["code"]] = a
+    await h.send(text_update(h.api, b, f"/join {pair['code']}"))
+    return a, b
+
+
+async def ask_random(h: Harness, i: int, args) -> tuple:
+    a, b = await pairing(h, i, args)
+    await h.send(callback_update(h.api, a, "ask_random"))
+    await h.send(callback_update(h.api, b, "repeat_q"))
+    return a, b
+
+
+def draft_burst(h: Harness, uid: int, tag: str, n: int, kinds) -> list:
+    makers = {
+        "voice": lambda k: voice_update(h.api, uid, f"v{tag}_{k}"),
+        "video_note": lambda k: video_note_update(h.api, uid, f"n{tag}_{k}"),
+        "text": lambda k: text_update(h.api, uid, f"t{tag}_{k}"),
+    }
+    return [h.send(makers[random.choice(kinds)](k)) for k in range(n)]
+
+
+async def answer_round(h: Harness, asker: int, answerer: int, tag: str, args, kinds) -> None:
+    await h.send(callback_update(h.api, asker, "ask_random"))
+    # черновики одной пары приходят почти одновременно, как при быстрой записи голосовых
+    await asyncio.gather(*draft_burst(h, answerer, tag, args.drafts, kinds))
+    await h.send(callback_update(h.api, answerer, "send_answer"))
+    pair = bot.get_pair(asker)
+    h.role_swaps["ok" if pair and pair["roles"]["A"] == answerer else "missed"] += 1
+
+
+async def burst(h: Harness, i: int, args) -> None:
+    a, b = await pairing(h, i, args)
+    await answer_round(h, a, b, str(i), args, ("voice", "video_note"))
+
+
+async def full(h: Harness, i: int, args) -> None:
+    a, b = await pairing(h, i, args)
+    for r in range(args.rounds):
+        pair = bot.get_pair(a)
+        if pair is None:
+            return
+        asker = pair["roles"]["A"]
+        answerer = b if asker == a else a
+        await answer_round(h, asker, answerer, f"{i}_{r}", args, ("voice", "video_note", "text"))
+
+
+SCENARIOS = {"pairing": pairing, "ask_random": ask_random, "burst": burst, "full": full}
+
+
+# ---------- ВОСПРОИЗВЕДЕНИЕ ----------
+def load_recording(path: Path):
+    with open(path, encoding="utf-8") as f:
+        updates = [json.loads(line) for line in f if line.strip()]
+    sidecar = Path(f"{path}.invites.json")
+    invites = {k: int(v) for k, v in json.loads(sidecar.read_text(encoding="utf-8")).items()} if sidecar.exists() else {}
+    return updates, invites
+
+
+def _sender(data: Dict[str, Any]) -> Optional[int]:
+    for key in ("message", "callback_query", "edited_message"):
+        if key in data:
+            return data[key]["from"]["id"]
+    return None
+
+
+async def replay(h: Harness, updates: List[Dict[str, Any]], invites: Dict[str, int], concurrency: int) -> None:
+    # апдейты одной пары — по порядку, разные пары — параллельно
+    group_of: Dict[int, int] = {}
+    groups: Dict[int, List[Dict[str, Any]]] = defaultdict(list)
+    for data in updates:
+        uid = _sender(data)
+        text = (data.get("message") or {}).get("text") or ""
+        parts = text.split()
+        if len(parts) == 2 and parts[0] in ("/join", "/start") and parts[1] in invites:
+            group_of[uid] = group_of.setdefault(invites[parts[1]], invites[parts[1]])
+        groups[group_of.setdefault(uid, uid)].append(data)
+
+    def live(data: Dict[str, Any]) -> Dict[str, Any]:
+        msg = data.get("message")
+        parts = (msg or {}).get("text", "").split()
+        if len(parts) == 2 and parts[1] in invites:
+            pair = bot.get_pair(invites[parts[1]])
+            if pair and pair.get("code"):
+                data = {**data, "message": {**msg, "text": f"{parts[0]} {pair['code']}"}}
+        return data
+
+    sem = asyncio.Semaphore(concurrency)
+
+    async def run_group(items):
+        async with sem:
+            for data in items:
+                await h.send(Update.de_json(live(data), h.api))
+
+    await asyncio.gather(*(run_group(items) for items in groups.values()))
+
+
+# ---------- ОТЧЁТ ----------
+def pct(values: List[float], q: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+def report(h: Harness, handled: float, elapsed: float, io: Dict[str, Any]) -> None:
+    # handled — до последнего обработанного апдейта; elapsed — вместе с досылкой ответов из outbox
+    total = sum(len(v) for v in h.latencies.values())
+    everything = sorted(x for v in h.latencies.values() for x in v)
+    print(f"updates={total} handlers={handled:.2f}s throughput={total / handled:.0f} upd/s "
+          f"p50={pct(everything, 0.5) * 1e3:.2f}ms p99={pct(everything, 0.99) * 1e3:.2f}ms")
+    print(f"total={elapsed:.2f}s incl. outbox drain {elapsed - handled:.2f}s")
+    print(f"{'type':<26} {'n':>7} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for kind in sorted(h.latencies):
+        v = sorted(h.latencies[kind])
+        print(f"{kind:<26} {len(v):>7} {pct(v, 0.5) * 1e3:>8.2f} {pct(v, 0.99) * 1e3:>8.2f} {v[-1] * 1e3:>8.2f}")
+    methods = Counter(c["method"] for c in h.api.calls)
+    print("api:", ", ".join(f"{m}={n}" for m, n in methods.most_common()), f"| 429={h.api.throttled}")
+    if h.errors or h.unhandled:
+        print("handler errors:", dict(h.errors), f"unhandled={h.unhandled}")
+    if h.role_swaps:
+        print("role swaps:", dict(h.role_swaps))
+    print(f"state I/O: backend={io['backend']} flushes={io['writes']} written={io['written']} "
+          f"write_time={io['seconds'] * 1e3:.1f}ms file={io['file_bytes']} B")
+
+
+def instrument_backend(store, io: Dict[str, Any]) -> None:
+    backend = store.backend
+    original = backend.write
+
+    def write(payload):
+        t0 = time.perf_counter()
+        original(payload)
+        io["seconds"] += time.perf_counter() - t0
+        io["writes"] += 1
+        # JSON — байты снимка, SQLite — число выполненных операторов
+        io["written"] += len(payload.encode("utf-8")) if isinstance(payload, str) else len(payload)
+    backend.write = write
+
+
+async def run(args) -> None:
+    if args.backend != bot.STORAGE_BACKEND:
+        bot.STORAGE_BACKEND = args.backend
+        bot.STORE = StateStore(bot.make_backend(), bot.default_state, upgrade=bot.upgrade_state,
+                               flush_interval=bot.STATE_FLUSH_INTERVAL, max_dirty=bot.STATE_FLUSH_MAX_DIRTY)
+        bot.STORE.on_write = bot._state_write_observed
+    app = bot.build_app()
+    api = FakeBot(latency=args.latency, jitter=args.jitter, flood=args.flood, retry_after=args.retry_after)
+    io = {"backend": bot.STORAGE_BACKEND, "writes": 0, "written": 0, "seconds": 0.0, "file_bytes": 0}
+    instrument_backend(bot.STORE, io)
+    bot.STORE.start()
+    outbox = bot.get_outbox()
+    if args.unlimited:
+        outbox.limiter = RateLimiter(1e9, 1e9, 1e9)
+    outbox.start(api)
+    h = Harness(app, api, record=bool(args.record))
+
+    t0 = time.perf_counter()
+    if args.replay:
+        updates, invites = load_recording(Path(args.replay))
+        await replay(h, updates, invites, args.concurrency)
+    else:
+        scenario = SCENARIOS[args.scenario]
+        sem = asyncio.Semaphore(args.concurrency)
+
+        async def guarded(i):
+            async with sem:
+                await scenario(h, i, args)
+        await asyncio.gather(*(guarded(i) for i in range(args.pairs)))
+    handled = time.perf_counter() - t0
+    await outbox.idle()
+    elapsed = time.perf_counter() - t0
+
+    await outbox.stop()
+    await bot.STORE.stop()
+    io["file_bytes"] = bot._state_file_bytes()
+    report(h, handled, elapsed, io)
+
+    if args.record:
+        with open(args.record, "w", encoding="utf-8") as f:
+            for data in h.recorded:
+                f.write(json.dumps(data, ensure_ascii=False) + "\n")
+        Path(f"{args.record}.invites.json").write_text(json.dumps(h.invites), encoding="utf-8")
+        print(f"recorded {len(h.recorded)} updates → {args.record}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--scenario", choices=sorted(SCENARIOS), default="full")
+    ap.add_argument("--replay", help="JSON Lines с апдейтами (см. --record)")
+    ap.add_argument("--record", help="сохранить апдейты прогона для --replay")
+    ap.add_argument("--pairs", type=int, default=500)
+    ap.add_argument("--concurrency", type=int, default=100, help="одновременно активных пар")
+    ap.add_argument("--rounds", type=int, default=3, help="раундов вопрос-ответ в сценарии full")
+    ap.add_argument("--drafts", type=int, default=5, help="черновиков в одной пачке")
+    ap.add_argument("--latency", type=float, default=0.0, help="задержка Bot API, с")
+    ap.add_argument("--jitter", type=float, default=0.0, help="случайная добавка к задержке, с")
+    ap.add_argument("--flood", type=float, default=0.0, help="доля вызовов API с ответом 429")
+    ap.add_argument("--retry-after", type=float, default=0.05)
+    ap.add_argument("--backend", choices=["journal", "json", "sqlite"], default="journal")
+    ap.add_argument("--unlimited", action="store_true", help="снять лимиты частоты outbox")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--verbose", action="store_true", help="не глушить логи бота (ошибки 429 и т. п.)")
+    args = ap.parse_args()
+    random.seed(args.seed)
+    if not args.verbose:
+        logging.disable(logging.ERROR)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# stress_concurrency.py — перемешанные голосовые, текст, аудио, кружочки и «Передать ответ» одной пары
+# одновременно (как при concurrent_updates) и проверка, что ни один принятый черновик не потерян
+# и не доставлен дважды.
+# Запуск: python benchmarks/stress_concurrency.py [--pairs 200] [--drafts 20] [--no-locks]
+
+import sys
+import random
+import asyncio
+import argparse
+import tempfile
+from pathlib import Path
+from collections import Counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import bot  # noqa: E402
+from storage import StateStore, JsonBackend  # noqa: E402
+from delivery import RateLimiter  # noqa: E402
+from archive import AnswerArchive  # noqa: E402
+from fake_api import (FakeBot, FakeContext, text_update, voice_update, audio_update,  # noqa: E402
+                      video_note_update, callback_update)
+
+BASE_UID = 20_000_000
+
+
+async def run_pair(api: FakeBot, i: int, n_drafts: int, wrap):
+    a, b = BASE_UID + 2 * i, BASE_UID + 2 * i + 1
+
+    async def call(handler, update, args=None):
+        await wrap(handler)(update, FakeContext(api, update, args))
+
+    await call(bot.start, text_update(api, a, "/start"))
+    code = bot.get_pair(a)["code"]
+    await call(bot.join_cmd, text_update(api, b, f"/join {code}"), [code])
+    await call(bot.on_button, callback_update(api, a, "ask_random"))
+
+    makers = [
+        (bot.on_voice, lambda k: voice_update(api, b, f"v{i}_{k}")),
+        (bot.on_text, lambda k: text_update(api, b, f"t{i}_{k}")),
+        (bot.on_audio, lambda k: audio_update(api, b, f"a{i}_{k}")),
+        (bot.on_video_note, lambda k: video_note_update(api, b, f"n{i}_{k}")),
+    ]
+    burst = []
+    for k in range(n_drafts):
+        handler, make = random.choice(makers)
+        burst.append(call(handler, make(k)))
+    # «Передать ответ» где-то в середине пачки; A тем временем тоже жмёт кнопки
+    burst.insert(random.randrange(1, len(burst)), call(bot.on_button, callback_update(api, b, "send_answer")))
+    burst.append(call(bot.on_button, callback_update(api, a, "repeat_q")))
+    burst.append(call(bot.on_button, callback_update(api, a, "whois")))
+    await asyncio.gather(*burst)
+    # всё, что пришло после «Передать ответ» в следующий раунд не попадает — B отвечает ещё раз
+    pair = bot.get_pair(a)
+    if pair.get("pending"):
+        await call(bot.on_button, callback_update(api, pair["pending"]["to_user"], "send_answer"))
+    return a, b
+
+
+async def run(pairs: int, n_drafts: int, use_locks: bool) -> bool:
+    accepted = []
+    original_append = bot._append_draft
+
+    def spy(state, item):
+        accepted.append(item)
+        original_append(state, item)
+
+    bot._append_draft = spy
+    wrap = bot.serialized if use_locks else (lambda h: h)
+    with tempfile.TemporaryDirectory() as d:
+        bot.STORE = StateStore(JsonBackend(Path(d) / "state.json"), bot.default_state, upgrade=bot.upgrade_state)
+        bot.ARCHIVE = AnswerArchive(Path(d) / "state.archive.jsonl")
+        bot.STORE.start()
+        api = FakeBot(latency=0.001, jitter=0.01)
+        bot.OUTBOX = None
+        bot.get_outbox().limiter = RateLimiter(1e9, 1e9, 1e9)
+        bot.get_outbox().start(api)
+        await asyncio.gather(*(run_pair(api, i, n_drafts, wrap) for i in range(pairs)))
+        await bot.get_outbox().idle()
+        await bot.STORE.stop()
+    bot._append_draft = original_append
+
+    delivered = Counter()
+    for c in api.calls:
+        if c["method"] == "copy_messages":
+            delivered.update((c["from_chat_id"], m) for m in c["message_ids"])
+        elif c["method"] in ("send_voice", "send_audio", "send_video_note"):
+            delivered[c.get("voice") or c.get("audio") or c.get("video_note")] += 1
+    pending_left = Counter()
+    for pair in bot.load_state()["pairs"].values():
+        pending_left.update((it["from_user"], it["message_id"]) for it in pair["draft_answers"])
+
+    lost = [it for it in accepted if not delivered[(it["from_user"], it["message_id"])]
+            and not pending_left[(it["from_user"], it["message_id"])]]
+    dupes = [k for k, n in delivered.items() if n > 1]
+    print(f"locks={'on' if use_locks else 'off'} pairs={pairs} accepted={len(accepted)} "
+          f"delivered={sum(delivered.values())} lost={len(lost)} duplicated={len(dupes)}")
+    return not lost and not dupes
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--pairs", type=int, default=200)
+    ap.add_argument("--drafts", type=int, default=20)
+    ap.add_argument("--no-locks", action="store_true")
+    args = ap.parse_args()
+    ok = asyncio.run(run(args.pairs, args.drafts, not args.no_locks))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
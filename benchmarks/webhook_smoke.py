@@ -0,0 +1,112 @@
+# webhook_smoke.py — офлайн-проверка вебхука: два воркера за маршрутизатором, заглушка Bot API
+# Пара создаётся на одном воркере, B входит по коду — все апдейты пары должны попасть туда же.
+# Опечатка в коде и код чужого воркера у пользователя из полной пары не переносят его с воркера пары.
+# Запуск: python benchmarks/webhook_smoke.py
+
+import sys
+import asyncio
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from aiohttp import web, ClientSession  # noqa: E402
+
+import bot  # noqa: E402
+import webhook  # noqa: E402
+from storage import StateStore, JsonBackend  # noqa: E402
+from fake_api import FakeBot, FakeContext  # noqa: E402
+from telegram import Update  # noqa: E402
+
+SECRET = "s3cret"
+HANDLERS = {"/start": bot.start, "/join": bot.join_cmd}
+
+
+async def start_site(web_app: web.Application, port: int) -> web.AppRunner:
+    runner = web.AppRunner(web_app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+def make_worker(shard: int, seen: list):
+    api = FakeBot()
+
+    async def process(data):
+        # воркер с собственным состоянием: подменяем STORE на время обработки
+        bot.STORE, bot.WORKER_SHARD = stores[shard], str(shard)
+        update = Update.de_json(data, api)
+        seen.append((shard, update.effective_user.id))
+        text = update.message.text
+        cmd, *args = text.split()
+        await HANDLERS[cmd](update, FakeContext(api, update, args))
+        # как run_worker: вход по коду обработан сразу, маршрутизатору — итог
+        return member(update.effective_user.id) if webhook.join_text(data) else None
+
+    def member(uid):
+        bot.STORE, bot.WORKER_SHARD = stores[shard], str(shard)
+        return bot.membership(uid)
+
+    return webhook.make_web_app(process, lambda: {"status": "ok", "shard": shard}, SECRET, "/webhook", member)
+
+
+def message(update_id: int, uid: int, text: str):
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": 0, "chat": {"id": uid, "type": "private"},
+        "from": {"id": uid, "is_bot": False, "first_name": "u"}, "text": text,
+        "entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]}}
+
+
+async def main():
+    global stores
+    seen: list = []
+    with tempfile.TemporaryDirectory() as d:
+        stores = [StateStore(JsonBackend(Path(d) / f"state.{i}.json"), bot.default_state, upgrade=bot.upgrade_state)
+                  for i in range(2)]
+        runners = [await start_site(make_worker(i, seen), 18081 + i) for i in range(2)]
+        router = webhook.Router(["http://127.0.0.1:18081", "http://127.0.0.1:18082"],
+                                StateStore(JsonBackend(Path(d) / "router.json"), dict))
+
+        async with ClientSession() as session:
+            async def process(data):
+                await router.forward(session, data, {webhook.SECRET_HEADER: SECRET}, "/webhook")
+            runners.append(await start_site(webhook.make_web_app(process, lambda: {"status": "ok"}, SECRET, "/webhook"), 18080))
+
+            async def post(data, secret=SECRET):
+                async with session.post("http://127.0.0.1:18080/webhook", json=data,
+                                        headers={webhook.SECRET_HEADER: secret}) as resp:
+                    return resp.status
+
+            a, b = 1001, 2000   # 1001 % 2 == 1, 2000 % 2 == 0 — по умолчанию разные воркеры
+            assert await post(message(1, a, "/start")) == 200
+            code = stores[1].load()["pairs"]["1"]["code"]
+            assert code.startswith("1-"), code
+            assert await post(message(2, b, f"/join {code}")) == 200
+            assert await post(message(3, b, "/start")) == 200
+            assert await post(message(4, b, "/start"), secret="wrong") == 403
+            # c (по умолчанию воркер 1) ошибся в коде: воркер 0 его не принял — карта не меняется
+            c = 3001
+            assert await post(message(5, c, "/join 0-bogus")) == 200
+            assert str(c) not in router.store.load()["user_worker"]
+            # e создаёт пару на воркере 0; b из полной пары на воркере 1 пробует войти по её коду
+            e = 4000
+            assert await post(message(6, e, "/start")) == 200
+            code0 = stores[0].load()["pairs"]["1"]["code"]
+            assert await post(message(7, b, f"/join {code0}")) == 200
+            assert router.store.load()["user_worker"][str(b)] == 1
+            assert stores[0].load()["pairs"]["1"]["roles"]["B"] is None
+            async with session.get("http://127.0.0.1:18081/healthz") as resp:
+                assert (await resp.json())["status"] == "ok"
+
+        for r in runners:
+            await r.cleanup()
+    assert seen == [(1, a), (1, b), (1, b), (0, c), (0, e), (1, b)], seen
+    pair = stores[1].load()["pairs"]["1"]
+    assert pair["roles"] == {"A": a, "B": b}, pair["roles"]
+    print("webhook smoke: ok", seen)
+
+
+stores: list = []
+
+if __name__ == "__main__":
+    asyncio.run(main())
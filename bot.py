@@ -4,159 +4,365 @@
 # - Полностью закрыт: когда оба получили ответы по номеру.
 
 import os
-import json
-import random
+import time
+import asyncio
 import logging
+import secrets
+import functools
+import threading
+from datetime import datetime
 from pathlib import Path
-from typing import Dict, Any, List, Set
+from zoneinfo import ZoneInfo
+from typing import Dict, Any, List, Optional, Tuple
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application, CommandHandler, MessageHandler,
-    CallbackQueryHandler, ContextTypes, filters
+    CallbackQueryHandler, TypeHandler, ApplicationHandlerStop, ContextTypes, filters
 )
 
+from storage import StateStore, JsonBackend, SqliteBackend, JournalBackend
+import completions
+from callbacks import Router, encode
+from phases import AWAITING_QNUM, PENDING, phase_of, allows, advance, deliver, delivered, repair
+from delivery import Outbox, RateLimiter
+from locks import KeyedLocks
+from dedupe import DedupeWindow, new_window, resize
+from inbound import InboundLimiter, DraftBudget, AckBoard
+from question_bank import BankRegistry, QuestionBank
+from pages import QuestionPages
+from reminders import ReminderScheduler, next_due, parse_hours, parse_quiet, parse_tz
+import metrics
+import startup
+
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
 
 TOKEN = os.getenv("TELEGRAM_TOKEN")
 STATE_FILE = Path(os.getenv("STATE_FILE_PATH", "state.json"))
+STATE_DB = Path(os.getenv("STATE_DB_PATH", "state.db"))
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "journal")   # journal | json | sqlite
+STATE_JOURNAL = Path(os.getenv("STATE_JOURNAL_PATH", str(STATE_FILE.with_suffix(".journal"))))
+STATE_JOURNAL_COMPACT = int(os.getenv("STATE_JOURNAL_COMPACT_BYTES", str(4 << 20)))  # снимок после стольких байт журнала
+STATE_JOURNAL_KEEP = int(os.getenv("STATE_JOURNAL_KEEP", "-1"))   # старых сегментов журнала хранить; -1 — все
+STARTUP_IMAGE = os.getenv("STARTUP_IMAGE_PATH", str(STATE_FILE.with_suffix(".image")))  # образ быстрого старта; "" — нет
 QUESTIONS_FILE = Path("questions.txt")
-TOTAL_QUESTIONS = 127
+QUESTIONS_DIR = Path(os.getenv("QUESTIONS_DIR", "banks"))  # дополнительные банки: <имя>.txt
+TOTAL_QUESTIONS = 127     # размер банка-заглушки, если questions.txt нет
+BANK_RELOAD_INTERVAL = float(os.getenv("BANK_RELOAD_INTERVAL", "5"))  # как часто проверять изменения файлов банков
 QUESTIONS_PER_PAGE = 20   # количество вопросов на странице
+STATS_CLOSED_SHOWN = 50   # полностью закрытых номеров в /stats; остальные — числом (сообщение ≤ 4096 символов)
+ARCHIVE_FILE = Path(os.getenv("ARCHIVE_PATH", str(STATE_FILE.with_suffix(".archive.jsonl"))))  # архив ответов
+HISTORY_PER_PAGE = 5      # записей архива на странице /history и /search
+STATE_FLUSH_INTERVAL = float(os.getenv("STATE_FLUSH_INTERVAL", "2.0"))  # секунды между сбросами на диск
+STATE_FLUSH_MAX_DIRTY = int(os.getenv("STATE_FLUSH_MAX_DIRTY", "50"))    # сброс раньше таймера после N изменений
+SEND_RATE_GLOBAL = float(os.getenv("SEND_RATE_GLOBAL", "30"))   # запросов в секунду на весь бот
+SEND_RATE_CHAT = float(os.getenv("SEND_RATE_CHAT", "1"))        # запросов в секунду в один чат
+SEND_BURST_CHAT = float(os.getenv("SEND_BURST_CHAT", "3"))      # допустимый всплеск в один чат
+BOT_MODE = os.getenv("BOT_MODE", "polling")                     # polling | webhook
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")                          # публичный адрес; без него вебхук не регистрируется
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")                    # проверяется в заголовке X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8080"))
+WORKER_SHARD = os.getenv("WORKER_SHARD")                        # номер воркера за маршрутизатором (webhook.py)
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "64"))  # параллельных апдейтов; 0/1 — по одному
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))              # GET /metrics (Prometheus); 0 — выключено
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+REMINDER_HOURS = parse_hours([os.getenv("REMINDER_HOURS", "4,24,72")])  # напоминания B: часы после вопроса
+REMINDER_TZ = os.getenv("REMINDER_TZ", "Europe/Moscow")           # часовой пояс пары по умолчанию
+REMINDER_QUIET = parse_quiet(os.getenv("REMINDER_QUIET", "23-9"))  # тихие часы (местное время); off — без них
+REMINDER_RATE = float(os.getenv("REMINDER_RATE", "5"))            # напоминаний в секунду на весь бот
+DEDUPE_WINDOW = int(os.getenv("DEDUPE_WINDOW", "10000"))          # сколько последних update_id/нажатий/заданий помнить
+INBOUND_RATE_USER = float(os.getenv("INBOUND_RATE_USER", "2"))    # входящих сообщений в секунду от одного пользователя
+INBOUND_BURST_USER = float(os.getenv("INBOUND_BURST_USER", "30"))  # допустимый всплеск (пачка пересланных сообщений)
+INBOUND_RATE_PAIR = float(os.getenv("INBOUND_RATE_PAIR", "4"))    # то же на пару целиком
+INBOUND_BURST_PAIR = float(os.getenv("INBOUND_BURST_PAIR", "60"))
+DRAFT_MAX_ITEMS = int(os.getenv("DRAFT_MAX_ITEMS", "100"))         # черновиков в одном ответе B
+DRAFT_MAX_BYTES = int(os.getenv("DRAFT_MAX_BYTES", str(256 << 10)))  # их размер в состоянии
+DRAFT_ACK_DELAY = float(os.getenv("DRAFT_ACK_DELAY", "1.0"))       # сводка «Принято N» правится не чаще
+STATE_BACKPRESSURE = int(os.getenv("STATE_BACKPRESSURE", "10000"))  # несохранённых изменений, после которых черновик ждёт записи
+STATE_BACKPRESSURE_WAIT = float(os.getenv("STATE_BACKPRESSURE_WAIT", "5"))  # не дождались — черновик не принят
 
 # ---------- STORAGE ----------
-def load_state() -> Dict[str, Any]:
-    if STATE_FILE.exists():
-        try:
-            return json.loads(STATE_FILE.read_text(encoding="utf-8"))
-        except Exception:
-            logging.exception("state.json read error")
+# Корневое состояние хранит много пар A↔B:
+#   pairs      — pair_id → состояние пары (roles, pending, draft_answers, completed_by_user, participants,
+#                bank — имя текущего банка вопросов, other_banks — закрытия по остальным банкам,
+#                reminders — свои настройки напоминаний пары или None; pending хранит sent_at и reminded;
+#                phase — фаза пары: idle | awaiting_qnum | pending | delivering, см. phases.py;
+#                delivery — id задания с ответами, доставки которого ждёт фаза delivering)
+#   user_pair  — str(user_id) → pair_id (поиск пары за O(1) в каждом обработчике)
+#   invites    — код приглашения → pair_id
+#   outbox     — job_id → недоставленное задание (см. delivery.py)
+#   dedupe     — окно недавних update_id, нажатий кнопок и выполненных заданий (см. dedupe.py)
+def default_state() -> Dict[str, Any]:
+    return {"pairs": {}, "user_pair": {}, "invites": {}, "outbox": {}, "next_pair_id": 1,
+            "dedupe": new_window(DEDUPE_WINDOW)}
+
+def new_pair_state(pair_id: str) -> Dict[str, Any]:
     return {
+        "id": pair_id,
+        "code": None,
         "roles": {"A": None, "B": None},
         "pending": None,
         "draft_answers": [],
         "completed_by_user": {},
-        "participants": []
+        "participants": [],
+        "bank": "default",
+        "other_banks": {},
+        "reminders": None,
+        "phase": "idle",
+        "delivery": None
     }
 
-def save_state(s: Dict[str, Any]) -> None:
-    try:
-        STATE_FILE.write_text(json.dumps(s, ensure_ascii=False, indent=2), encoding="utf-8")
-    except Exception:
-        logging.exception("state.json write error")
-
-def load_questions() -> List[str]:
-    if QUESTIONS_FILE.exists():
-        lines = [l.strip() for l in QUESTIONS_FILE.read_text(encoding="utf-8").splitlines() if l.strip()]
-        if len(lines) < TOTAL_QUESTIONS:
-            lines += [f"Вопрос №{i}" for i in range(len(lines)+1, TOTAL_QUESTIONS+1)]
-        else:
-            lines = lines[:TOTAL_QUESTIONS]
-        return lines
-    return [f"Вопрос №{i}" for i in range(1, TOTAL_QUESTIONS+1)]
+def upgrade_state(s: Dict[str, Any]) -> Dict[str, Any]:
+    # старый формат state.json (одна пара на весь бот) превращается в пару "1"
+    if "pairs" in s:
+        s.setdefault("outbox", {})
+        s.setdefault("next_pair_id", 1)
+        s["dedupe"] = resize(s.get("dedupe"), DEDUPE_WINDOW)
+        for pair in s["pairs"].values():
+            pair.setdefault("bank", "default")
+            pair.setdefault("other_banks", {})
+            pair.setdefault("reminders", None)
+            pair.setdefault("delivery", None)
+            repair(pair)
+        return s
+    root = default_state()
+    pair = new_pair_state("1")
+    for key in ("roles", "pending", "draft_answers", "completed_by_user"):
+        if key in s:
+            pair[key] = s[key]
+    # в паре остаются только держатели ролей: участник без роли иначе был бы навсегда привязан
+    # к уже полной паре и не смог бы ни создать свою (/start), ни войти в чужую (/join)
+    holders = [uid for uid in (pair["roles"].get("A"), pair["roles"].get("B")) if uid]
+    if not holders:
+        return root
+    pair["roles"] = {"A": holders[0], "B": holders[1] if len(holders) > 1 else None}
+    pair["participants"] = holders
+    for uid in holders:
+        root["user_pair"][str(uid)] = "1"
+    if pair["roles"]["B"] is None:
+        # второго участника ещё нет: нужен код приглашения, как у пары из create_pair
+        pair["code"] = invite_code(root)
+        root["invites"][pair["code"]] = "1"
+    repair(pair)
+    root["pairs"]["1"] = pair
+    root["next_pair_id"] = 2
+    return root
+
+def make_backend():
+    if STORAGE_BACKEND == "sqlite":
+        return SqliteBackend(STATE_DB)
+    if STORAGE_BACKEND == "json":
+        return JsonBackend(STATE_FILE)
+    if STORAGE_BACKEND == "journal":
+        # снимок — тот же state.json, поэтому переход с json не требует миграции
+        return JournalBackend(STATE_FILE, STATE_JOURNAL, compact_bytes=STATE_JOURNAL_COMPACT, keep=STATE_JOURNAL_KEEP)
+    raise RuntimeError(f"Неизвестный STORAGE_BACKEND: {STORAGE_BACKEND}")
+
+STORE = StateStore(make_backend(), default_state, upgrade=upgrade_state,
+                   flush_interval=STATE_FLUSH_INTERVAL, max_dirty=STATE_FLUSH_MAX_DIRTY)
 
-QUESTIONS = load_questions()
+def load_state() -> Dict[str, Any]:
+    # состояние живёт в памяти; хранилище читается только при первом обращении
+    t0 = time.perf_counter()
+    state = STORE.load()
+    metrics.STATE_CALLS.inc("load")
+    metrics.STATE_SECONDS.observe(time.perf_counter() - t0, "load")
+    return state
+
+def save_state(op: str, *args) -> None:
+    # запись отложенная: изменение описывается операцией (см. storage.py),
+    # фоновый сброс запишет накопленные операции пачкой
+    t0 = time.perf_counter()
+    STORE.record(op, *args)
+    metrics.STATE_CALLS.inc("save")
+    metrics.STATE_SECONDS.observe(time.perf_counter() - t0, "save")
+
+# ---------- METRICS ----------
+def _state_write_observed(seconds: float, ok: bool) -> None:
+    metrics.STATE_CALLS.inc("flush" if ok else "flush_error")
+    metrics.STATE_SECONDS.observe(seconds, "flush")
+
+def _state_file_bytes() -> int:
+    backend = STORE.backend
+    extra = Path(f"{backend.path}-wal") if STORAGE_BACKEND == "sqlite" else getattr(backend, "snapshot_path", None)
+    return sum(p.stat().st_size for p in (backend.path, extra) if p is not None and p.exists())
+
+def _drafts_pending() -> int:
+    return sum(len(p["draft_answers"]) for p in STORE.load()["pairs"].values())
+
+STORE.on_write = _state_write_observed
+metrics.STATE_BYTES.set_function(_state_file_bytes)
+metrics.DRAFTS.set_function(_drafts_pending)
+metrics.OUTBOX.set_function(lambda: len(STORE.load()["outbox"]))
+
+# ---------- QUESTIONS ----------
+# Вопросы не загружаются целиком: банк держит дескриптор файла и индекс смещений строк,
+# текст вопроса достаётся по номеру (см. question_bank.py). У каждой пары свой банк.
+BANKS = BankRegistry(QUESTIONS_FILE, QUESTIONS_DIR, TOTAL_QUESTIONS, reload_interval=BANK_RELOAD_INTERVAL)
+PAGES = QuestionPages(QUESTIONS_PER_PAGE)
+if STARTUP_IMAGE:
+    STORE.preload = functools.partial(startup.load_image, Path(STARTUP_IMAGE), STORE.backend, BANKS)
+
+def bank_for(state: Optional[Dict[str, Any]]) -> QuestionBank:
+    return BANKS.get(state.get("bank", "default") if state else "default")
 
 # ---------- HELPERS ----------
+# Клавиатуры неизменяемы, поэтому каждая собирается один раз и дальше переиспользуется.
+@functools.lru_cache(maxsize=None)
 def main_menu_kb() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([
-        [InlineKeyboardButton("Запросить конкретный вопрос", callback_data="ask_specific")],
-        [InlineKeyboardButton("Запросить случайный вопрос (без повторов)", callback_data="ask_random")],
-        [InlineKeyboardButton("Посмотреть список вопросов", callback_data="list_questions")],
-        [InlineKeyboardButton("Напомнить вопрос", callback_data="repeat_q")],
-        [InlineKeyboardButton("Кто сейчас A/B?", callback_data="whois")],
-        [InlineKeyboardButton("Сбросить историю (частично/полностью)", callback_data="reset_history")],
+        [InlineKeyboardButton("Запросить конкретный вопрос", callback_data=encode("ask_specific"))],
+        [InlineKeyboardButton("Запросить случайный вопрос (без повторов)", callback_data=encode("ask_random"))],
+        [InlineKeyboardButton("Посмотреть список вопросов", callback_data=encode("list_questions"))],
+        [InlineKeyboardButton("Напомнить вопрос", callback_data=encode("repeat_q"))],
+        [InlineKeyboardButton("Кто сейчас A/B?", callback_data=encode("whois"))],
+        [InlineKeyboardButton("Сбросить историю (частично/полностью)", callback_data=encode("reset_history"))],
     ])
 
+@functools.lru_cache(maxsize=None)
 def specific_menu_kb() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([
-        [InlineKeyboardButton("Посмотреть список вопросов", callback_data="list_questions")],
-        [InlineKeyboardButton("⬅️ В меню", callback_data="back_to_menu")],
+        [InlineKeyboardButton("Посмотреть список вопросов", callback_data=encode("list_questions"))],
+        [InlineKeyboardButton("⬅️ В меню", callback_data=encode("back_to_menu"))],
     ])
 
+@functools.lru_cache(maxsize=None)
 def send_answer_kb() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([
-        [InlineKeyboardButton("Передать ответ", callback_data="send_answer")],
-        [InlineKeyboardButton("Напомнить вопрос", callback_data="repeat_q")]
+        [InlineKeyboardButton("Передать ответ", callback_data=encode("send_answer"))],
+        [InlineKeyboardButton("Напомнить вопрос", callback_data=encode("repeat_q"))]
     ])
 
+@functools.lru_cache(maxsize=None)
 def back_menu_kb() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ В меню", callback_data="back_to_menu")]])
-
-def questions_nav_kb(page: int) -> InlineKeyboardMarkup:
-    buttons = []
-    if page > 0:
-        buttons.append(InlineKeyboardButton("◀️", callback_data=f"qpage_{page-1}"))
-    if (page+1) * QUESTIONS_PER_PAGE < TOTAL_QUESTIONS:
-        buttons.append(InlineKeyboardButton("▶️", callback_data=f"qpage_{page+1}"))
-    return InlineKeyboardMarkup([
-        buttons,
-        [InlineKeyboardButton("⬅️ В меню", callback_data="back_to_menu")]
-    ])
-
-def get_questions_page(page: int) -> str:
-    start = page * QUESTIONS_PER_PAGE
-    end = min(start + QUESTIONS_PER_PAGE, TOTAL_QUESTIONS)
-    lines = [f"{i+1}. {QUESTIONS[i]}" for i in range(start, end)]
-    return "📋 Список вопросов:\n\n" + "\n".join(lines)
+    return InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ В меню", callback_data=encode("back_to_menu"))]])
 
 def is_user_A(state, chat_id): return state["roles"]["A"] == chat_id
 def is_user_B(state, chat_id): return state["roles"]["B"] == chat_id
 def roles_assigned(state): return bool(state["roles"]["A"]) and bool(state["roles"]["B"])
 
-def get_completed_for_user(state: Dict[str, Any], user_id: int) -> Set[int]:
-    return set(state.get("completed_by_user", {}).get(str(user_id), []))
+# Закрытия хранятся в completed_by_user (для сохранения), а все проверки идут через
+# битовый индекс из completions.py: O(1) на проверку, подсчёт и случайный выбор.
+def completion_index(state: Dict[str, Any]) -> completions.CompletionIndex:
+    return completions.index_for(state, len(bank_for(state)))
 
-def mark_completed_for_user(state: Dict[str, Any], user_id: int, qnum: int) -> None:
-    key = str(user_id)
-    lst = state.get("completed_by_user", {}).get(key, [])
-    if qnum not in lst:
-        lst.append(qnum)
-        state["completed_by_user"][key] = sorted(lst)
-        save_state(state)
+def is_completed_for_user(state: Dict[str, Any], user_id: int, qnum: int) -> bool:
+    return completion_index(state).is_completed(user_id, qnum)
+
+def completed_count(state: Dict[str, Any], user_id: int) -> int:
+    return completion_index(state).count(user_id) if user_id else 0
 
 def both_participants_ids(state: Dict[str, Any]):
     return state["roles"].get("A"), state["roles"].get("B")
 
-def is_fully_closed(state: Dict[str, Any], qnum: int) -> bool:
+def mark_completed_for_user(state: Dict[str, Any], user_id: int, qnum: int) -> None:
     a_id, b_id = both_participants_ids(state)
-    if not a_id or not b_id:
-        return False
-    return qnum in get_completed_for_user(state, a_id) and qnum in get_completed_for_user(state, b_id)
-
-def remaining_numbers_for_user(state: Dict[str, Any], user_id: int) -> List[int]:
-    completed_me = get_completed_for_user(state, user_id)
-    pending_exclude = set([state["pending"]["qnum"]]) if state.get("pending") else set()
-    result = []
-    for i in range(1, TOTAL_QUESTIONS+1):
-        if i in completed_me:
-            continue
-        if i in pending_exclude:
-            continue
-        if is_fully_closed(state, i):
-            continue
-        result.append(i)
-    return result
-
-def clear_pending(state): state["pending"] = None; state["draft_answers"] = []; save_state(state)
-
-def auto_assign_role_on_start(state, chat_id: int) -> str:
-    if chat_id not in state["participants"]:
-        state["participants"].append(chat_id); save_state(state)
-    if state["roles"]["A"] is None:
-        state["roles"]["A"] = chat_id; save_state(state); return "A"
-    if state["roles"]["B"] is None and chat_id != state["roles"]["A"]:
-        state["roles"]["B"] = chat_id; save_state(state); return "B"
-    if chat_id in (state["roles"]["A"], state["roles"]["B"]): return "none"
-    return "none"
-
-def maybe_assign_B(state, chat_id: int):
-    if state["roles"]["A"] and state["roles"]["B"] is None and chat_id != state["roles"]["A"]:
-        state["roles"]["B"] = chat_id; save_state(state)
+    other = b_id if user_id == a_id else a_id
+    if completion_index(state).mark(user_id, qnum, other):
+        state["completed_by_user"].setdefault(str(user_id), []).append(qnum)
+        save_state("completed", state, user_id, qnum)
+
+def is_fully_closed(state: Dict[str, Any], qnum: int) -> bool:
+    return completion_index(state).is_closed(qnum)
+
+def pick_random_number(state: Dict[str, Any], user_id: int) -> Optional[int]:
+    # закрытое обоими закрыто и для user_id, поэтому достаточно его собственной карты
+    pending = state.get("pending")
+    return completion_index(state).sample(user_id, exclude=pending["qnum"] if pending else None)
+
+def clear_pending(state):
+    state["pending"] = None; state["draft_answers"] = []
+    save_state("pending", state); save_state("drafts_cleared", state)
+    REMINDERS.cancel(state["id"])
+
+def reset_completed(state):
+    state["completed_by_user"] = {}
+    completions.forget(state)
+    save_state("completed_reset", state)
+
+def switch_bank(state, name: str) -> None:
+    # закрытия текущего банка откладываются в other_banks и вернутся при обратном переключении
+    others = state.setdefault("other_banks", {})
+    others[state.get("bank", "default")] = state["completed_by_user"]
+    state["completed_by_user"] = others.pop(name, {})
+    state["bank"] = name
+    completions.forget(state)
+    save_state("pair", state)
+
+# ---------- PAIRS ----------
+def get_pair(user_id: int) -> Optional[Dict[str, Any]]:
+    root = load_state()
+    pair_id = root["user_pair"].get(str(user_id))
+    return root["pairs"].get(pair_id) if pair_id else None
+
+def invite_code(root: Dict[str, Any]) -> str:
+    # за маршрутизатором код начинается с номера воркера, чтобы B попал туда же, где пара
+    prefix = f"{WORKER_SHARD}-" if WORKER_SHARD else ""
+    code = prefix + secrets.token_urlsafe(6)
+    while code in root["invites"]:
+        code = prefix + secrets.token_urlsafe(6)
+    return code
+
+def create_pair(owner_id: int) -> Dict[str, Any]:
+    root = load_state()
+    pair_id = str(root["next_pair_id"])
+    root["next_pair_id"] += 1
+    pair = new_pair_state(pair_id)
+    pair["roles"]["A"] = owner_id
+    pair["participants"].append(owner_id)
+    code = invite_code(root)
+    pair["code"] = code
+    root["invites"][code] = pair_id
+    root["pairs"][pair_id] = pair
+    root["user_pair"][str(owner_id)] = pair_id
+    save_state("meta", "next_pair_id", root["next_pair_id"])
+    save_state("pair", pair)
+    save_state("member", pair, owner_id)
+    return pair
+
+def _drop_pair(root: Dict[str, Any], pair: Dict[str, Any]) -> None:
+    if pair.get("code"):
+        root["invites"].pop(pair["code"], None)
+    for uid in pair["participants"]:
+        root["user_pair"].pop(str(uid), None)
+    root["pairs"].pop(pair["id"], None)
+    completions.forget(pair)
+    DRAFT_BUDGET.forget(pair["id"])
+    REMINDERS.cancel(pair["id"])
+    save_state("pair_deleted", pair)
+
+def join_pair(user_id: int, code: str) -> Tuple[Optional[Dict[str, Any]], str]:
+    root = load_state()
+    pair_id = root["invites"].get(code)
+    if not pair_id:
+        return None, "bad_code"
+    pair = root["pairs"][pair_id]
+    if pair["roles"]["A"] == user_id:
+        return pair, "own"
+    current = get_pair(user_id)
+    if current is not None:
+        if roles_assigned(current):
+            return current, "busy"
+        # одиночная пара без партнёра больше не нужна
+        _drop_pair(root, current)
+    pair["roles"]["B"] = user_id
+    pair["participants"].append(user_id)
+    root["user_pair"][str(user_id)] = pair_id
+    root["invites"].pop(code, None)
+    pair["code"] = None
+    save_state("pair", pair)
+    save_state("member", pair, user_id)
+    return pair, "joined"
+
+def invite_text(context: ContextTypes.DEFAULT_TYPE, pair: Dict[str, Any]) -> str:
+    code = pair["code"]
+    how = f"открыть ссылку https://t.me/{context.bot.username}?start={code} или " if context.bot.username else ""
+    return f"Код приглашения: {code}\nПартнёр может {how}отправить боту /join {code}."
 
 def auto_swap_roles(state):
     state["roles"]["A"], state["roles"]["B"] = state["roles"]["B"], state["roles"]["A"]
-    save_state(state)
+    save_state("roles_swapped", state)
 
 # ---------- QUESTION HELPERS ----------
 async def resend_current_question(context: ContextTypes.DEFAULT_TYPE, state: Dict[str, Any], to_chat_id: int) -> None:
@@ -164,13 +370,14 @@ async def resend_current_question(context: ContextTypes.DEFAULT_TYPE, state: Dic
     if not pending:
         await context.bot.send_message(chat_id=to_chat_id, text="Сейчас нет активного вопроса.")
         return
-    qnum = pending["qnum"]; qtext = QUESTIONS[qnum - 1]
+    qnum = pending["qnum"]; qtext = bank_for(state).get(qnum)
     if to_chat_id == pending["from_user"]:
         hdr = "Текущий вопрос, который ты отправил:"
         tail = "Когда получишь ответ и B нажмёт «Передать ответ», роли автоматически поменяются."
     elif to_chat_id == pending["to_user"]:
         hdr = "Напоминаю текущий вопрос:"
-        tail = ("Загрузи ответ в формате текста, голосового сообщения или кружочка — их количество не ограничено. "
+        tail = ("Загрузи ответ в формате текста, голосового сообщения или кружочка — "
+                f"можно несколько, до {DRAFT_MAX_ITEMS}. "
                 "А после нажми кнопку «Передать ответ».")
     else:
         hdr = "Текущий активный вопрос:"; tail = ""
@@ -180,190 +387,471 @@ async def resend_current_question(context: ContextTypes.DEFAULT_TYPE, state: Dic
         reply_markup=send_answer_kb() if to_chat_id == pending.get("to_user") else None
     )
 
+NO_PAIR_TEXT = "Ты ещё не в паре. Нажми /start, чтобы создать пару, или /join КОД, чтобы присоединиться."
+
     # ---------- HANDLERS ----------
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    state = load_state()
     chat_id = update.effective_chat.id
-    assigned = auto_assign_role_on_start(state, chat_id)
-    intro = ("Этот бот для двух людей. Первый, кто нажмёт /start, становится A; второй — B. "
+    if context.args:
+        await _join(update, context, context.args[0]); return
+    state = get_pair(chat_id)
+    assigned = "none"
+    if state is None:
+        state = create_pair(chat_id); assigned = "A"
+    intro = ("Этот бот для двух людей. Кто нажал /start, создаёт пару и становится A; "
+             "партнёр присоединяется по коду приглашения и становится B. "
              "После «Передать ответ» роли автоматически меняются.\n\nВыберите действие:")
-    role_msg = "Вы стали A (задаёте первый вопрос).\n" if assigned == "A" else ("Вы стали B (ответите на первый вопрос).\n" if assigned == "B" else "")
+    role_msg = "Вы стали A (задаёте первый вопрос).\n" if assigned == "A" else ""
+    if not roles_assigned(state) and state.get("code"):
+        role_msg += invite_text(context, state) + "\n\n"
     await update.effective_chat.send_message(role_msg + intro, reply_markup=main_menu_kb())
 
+async def join_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not context.args:
+        await update.effective_chat.send_message("Использование: /join КОД", reply_markup=back_menu_kb()); return
+    await _join(update, context, context.args[0])
+
+async def _join(update: Update, context: ContextTypes.DEFAULT_TYPE, code: str):
+    chat_id = update.effective_chat.id
+    pair, status = join_pair(chat_id, code.strip())
+    if status == "bad_code":
+        await update.effective_chat.send_message("Код приглашения не найден или уже использован.", reply_markup=back_menu_kb()); return
+    if status == "own":
+        await update.effective_chat.send_message("Это твой собственный код — отправь его партнёру.", reply_markup=back_menu_kb()); return
+    if status == "busy":
+        await update.effective_chat.send_message("Ты уже состоишь в паре.", reply_markup=main_menu_kb()); return
+    await update.effective_chat.send_message("Вы стали B (ответите на первый вопрос).\n\nВыберите действие:", reply_markup=main_menu_kb())
+    try: await context.bot.send_message(chat_id=pair["roles"]["A"], text="Партнёр присоединился и стал B. Задай первый вопрос.", reply_markup=main_menu_kb())
+    except Exception: logging.exception("notify A failed")
+
 async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.effective_chat.send_message(
-        "1) Первый /start → A. Второй /start → B.\n"
+        "1) /start создаёт пару (ты A) и выдаёт код приглашения. Партнёр вводит /join КОД → B.\n"
         "2) A выбирает конкретный номер или случайный (без повторов для него).\n"
         "3) B может отправлять несколько сообщений-ответов: текст, голос, аудио, кружочек. Потом нажать «Передать ответ».\n"
         "4) Частично закрыт — для того, кто получил ответ; полностью — когда оба получили.\n"
         "5) «Посмотреть список вопросов» — кнопка в меню.\n"
         "6) «Напомнить вопрос» — кнопка или /question.\n"
-        "7) /stats — статистика; /list — список вопросов; /reset — очистка истории.",
+        "7) /stats — статистика; /list — список вопросов; /reset — очистка истории.\n"
+        "8) /join КОД — присоединиться к паре по коду.\n"
+        "9) /bank — банки вопросов пары; /bank ИМЯ — переключиться на другой банк.\n"
+        "10) /remind — напоминания о вопросе без ответа: расписание, часовой пояс, тихие часы.\n"
+        "11) /history — архив переданных ответов; /search СЛОВА — поиск по ответам и вопросам.",
         reply_markup=back_menu_kb()
     )
 
+def stats_lines(state: Dict[str, Any]) -> List[str]:
+    # сводка ответов пары из агрегатов архива (analytics.py): ничего не пересчитывается;
+    # архив уже загружен — вызывающий дожидается get_archive().ready()
+    from analytics import duration
+    stats = get_archive().stats()
+    tally = stats.pair(state["id"])
+    bank = state.get("bank", "default")
+    covered, total = stats.coverage(state["id"], bank), len(bank_for(state))
+    lines = [f"Ответов получено: {tally.answers}" + (
+        " (" + ", ".join(f"{DRAFT_KINDS[k]} — {n}" for k, n in tally.items.items() if k in DRAFT_KINDS) + ")"
+        if tally.items else "")]
+    picks = dict(tally.picks)
+    pending = state.get("pending")
+    if pending and pending.get("pick"):
+        picks[pending["pick"]] = picks.get(pending["pick"], 0) + 1
+    lines.append(f"Вопросов: случайных {picks.get('random', 0)}, конкретных {picks.get('specific', 0)}")
+    if tally.timed:
+        median = tally.median_bound()
+        lines.append(f"Время до ответа: в среднем {duration(tally.mean())}"
+                     + (f", у половины — до {duration(median)}" if median else "")
+                     + f", быстрее всего {duration(tally.fastest)}")
+    lines.append(f"Покрытие банка «{bank}»: {covered} из {total} ({covered * 100 // max(total, 1)}%)")
+    return lines
+
 async def stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    state = load_state()
+    state = get_pair(update.effective_chat.id)
+    if state is None:
+        await update.effective_chat.send_message(NO_PAIR_TEXT); return
     a, b = state["roles"]["A"], state["roles"]["B"]
-    ca = len(get_completed_for_user(state, a)) if a else 0
-    cb = len(get_completed_for_user(state, b)) if b else 0
-    fully = [i for i in range(1, TOTAL_QUESTIONS+1) if is_fully_closed(state, i)]
-    msg = (
-        "📊 Статистика\n"
-        f"A ({a if a else '—'}): частично закрыто {ca}\n"
-        f"B ({b if b else '—'}): частично закрыто {cb}\n"
-        f"Полностью закрытые номера: {fully if fully else '—'}"
-    )
+    ca = completed_count(state, a)
+    cb = completed_count(state, b)
+    idx = completion_index(state)
+    fully = ", ".join(map(str, idx.closed_numbers(STATS_CLOSED_SHOWN)))
+    if idx.both_count > STATS_CLOSED_SHOWN:
+        fully += f" … и ещё {idx.both_count - STATS_CLOSED_SHOWN}"
+    await get_archive().ready()
+    msg = "\n".join([
+        "📊 Статистика",
+        f"A ({a if a else '—'}): частично закрыто {ca}",
+        f"B ({b if b else '—'}): частично закрыто {cb}",
+        f"Полностью закрытые номера ({idx.both_count}): {fully}" if fully else "Полностью закрытые номера: —",
+        *stats_lines(state),
+    ])
     await update.effective_chat.send_message(msg, reply_markup=back_menu_kb())
 
-async def list_questions(update: Update, context: ContextTypes.DEFAULT_TYPE, from_button=False, page=0):
-    text = get_questions_page(page)
-    kb = questions_nav_kb(page)
+async def list_questions(update: Update, context: ContextTypes.DEFAULT_TYPE, from_button=False, page=0,
+                         bank_name: Optional[str] = None):
+    chat_id = update.effective_chat.id
+    state = get_pair(chat_id)
+    bank = bank_for(state)
+    mine = both = 0
+    if bank_name is not None and bank_name != bank.name and BANKS.exists(bank_name):
+        # ◀️/▶️ списка, открытого до смены банка: листается тот банк, отметки текущего к нему не относятся
+        bank = BANKS.get(bank_name)
+    elif state is not None:
+        idx = completion_index(state)
+        mine, both = idx.bits.get(chat_id, 0), idx.both
+    text, kb = PAGES.render(bank, page, mine, both)
     if from_button and update.callback_query:
         await update.callback_query.edit_message_text(text, reply_markup=kb)
     else:
         await update.effective_chat.send_message(text, reply_markup=kb)
 
+async def bank_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = update.effective_chat.id
+    state = get_pair(chat_id)
+    if state is None:
+        await update.effective_chat.send_message(NO_PAIR_TEXT); return
+    current = state.get("bank", "default")
+    if not context.args:
+        lines = [f"{'▶️' if name == current else '•'} {name} — вопросов: {len(BANKS.get(name))}" for name in BANKS.names()]
+        await update.effective_chat.send_message(
+            "Банки вопросов:\n" + "\n".join(lines) + "\n\nПереключить: /bank ИМЯ", reply_markup=back_menu_kb()
+        ); return
+    name = context.args[0]
+    if not BANKS.exists(name):
+        await update.effective_chat.send_message("Такого банка нет. Список — /bank."); return
+    if name == current:
+        await update.effective_chat.send_message(f"Банк «{name}» уже выбран."); return
+    if state.get("pending"):
+        await update.effective_chat.send_message("Есть активный вопрос — переключить банк можно после ответа."); return
+    switch_bank(state, name)
+    text = f"Банк вопросов переключён на «{name}» (вопросов: {len(bank_for(state))})."
+    for uid in state["participants"]:
+        await context.bot.send_message(chat_id=uid, text=text, reply_markup=main_menu_kb())
+
+# ---------- ARCHIVE ----------
+ARCHIVE = None
+
+def get_archive():
+    # модуль архива (стеммер, регулярные выражения) импортируется при первом обращении, не при старте.
+    # Файл архива читается в потоке из _post_init; обработчики перед чтением ждут get_archive().ready()
+    global ARCHIVE
+    if ARCHIVE is None:
+        from archive import AnswerArchive
+        ARCHIVE = AnswerArchive(ARCHIVE_FILE)
+    return ARCHIVE
+
+MEDIA_NAMES = {"voice": "голосовых", "audio": "аудио", "video_note": "кружочков"}
+
+def _clip(text: str, limit: int) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+def archive_line(state: Dict[str, Any], chat_id: int, n: int, record: Dict[str, Any]) -> str:
+    when = datetime.fromtimestamp(record["t"], ZoneInfo(reminder_settings(state)["tz"])).strftime("%d.%m.%Y %H:%M")
+    who = "ты" if record["from"] == chat_id else "партнёр"
+    texts = [it["data"]["text"] for it in record["items"] if it["type"] == "text"]
+    media: Dict[str, int] = {}
+    for it in record["items"]:
+        if it["type"] in MEDIA_NAMES:
+            media[it["type"]] = media.get(it["type"], 0) + 1
+    extra = ", ".join(f"{MEDIA_NAMES[t]}: {c}" for t, c in media.items())
+    answer = _clip(" / ".join(texts), 200) if texts else ""
+    if extra:
+        answer = f"{answer} ({extra})" if answer else extra
+    return f"{n}) №{record['q']} · {when} · отвечал(а) {who}\n   ❓ {_clip(record['qt'] or '', 90)}\n   💬 {answer}"
+
+async def archive_page(state: Dict[str, Any], chat_id: int, page: int,
+                       query: Optional[str] = None) -> Tuple[str, InlineKeyboardMarkup]:
+    arch = get_archive()
+    await arch.ready()
+    if query is None:
+        ids, total = arch.history(state["id"], page, HISTORY_PER_PAGE)
+        title, empty, nav = "🗂 История ответов", "Архив пока пуст — ответы появятся после «Передать ответ».", "hist"
+    else:
+        ids, total = arch.search(state["id"], query, page, HISTORY_PER_PAGE)
+        title, empty, nav = f"🔎 «{_clip(query, 40)}»: найдено {total}", "Ничего не нашлось.", "srch"
+    if not ids:
+        return f"{title}\n\n{empty}", back_menu_kb()
+    pages = (total + HISTORY_PER_PAGE - 1) // HISTORY_PER_PAGE
+    lines = [archive_line(state, chat_id, i + 1, arch.get(state["id"], rid)) for i, rid in enumerate(ids)]
+    text = f"{title} (стр. {page + 1}/{pages})\n\n" + "\n\n".join(lines) + "\n\nНажми номер, чтобы получить ответ целиком."
+    # кнопка записи несёт и pair_id: id записей свои у каждой пары
+    buttons = [[InlineKeyboardButton(str(i + 1), callback_data=encode("hshow", rid, int(state["id"])))
+                for i, rid in enumerate(ids)]]
+    row = []
+    if page > 0:
+        row.append(InlineKeyboardButton("◀️", callback_data=encode(nav, page - 1)))
+    if page + 1 < pages:
+        row.append(InlineKeyboardButton("▶️", callback_data=encode(nav, page + 1)))
+    if row:
+        buttons.append(row)
+    buttons.append([InlineKeyboardButton("⬅️ В меню", callback_data=encode("back_to_menu"))])
+    return text, InlineKeyboardMarkup(buttons)
+
+async def show_archived(update: Update, context: ContextTypes.DEFAULT_TYPE, state: Dict[str, Any], rid: int) -> None:
+    # ответ из архива пересылается заново через outbox: копией, а если исходник удалён — по file_id
+    chat_id = update.effective_chat.id
+    await get_archive().ready()
+    record = get_archive().get(state["id"], rid) if rid is not None else None
+    if record is None:
+        await context.bot.send_message(chat_id=chat_id, text="Запись не найдена."); return
+    get_outbox().submit({"id": f"{state['id']}-h{rid}-{update.update_id}", "chat_id": chat_id, "items": (
+        [{"type": "text", "data": {"text": f"Ответ на вопрос №{record['q']}:\n\n{record['qt']}"}}] + record["items"]
+    )})
+
+async def history_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = update.effective_chat.id
+    state = get_pair(chat_id)
+    if state is None:
+        await update.effective_chat.send_message(NO_PAIR_TEXT); return
+    text, kb = await archive_page(state, chat_id, 0)
+    await update.effective_chat.send_message(text, reply_markup=kb)
+
+async def search_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = update.effective_chat.id
+    state = get_pair(chat_id)
+    if state is None:
+        await update.effective_chat.send_message(NO_PAIR_TEXT); return
+    if not context.args:
+        await update.effective_chat.send_message("Использование: /search СЛОВА — поиск по ответам и вопросам.",
+                                                 reply_markup=back_menu_kb()); return
+    query = " ".join(context.args)
+    context.user_data["search"] = query
+    text, kb = await archive_page(state, chat_id, 0, query)
+    await update.effective_chat.send_message(text, reply_markup=kb)
+
+REMIND_USAGE = ("Настроить: /remind 2 12 48 — через сколько часов после вопроса напоминать; "
+                "/remind off | on; /remind tz Europe/Berlin; /remind quiet 22-8 | off; /remind reset.")
+
+async def remind_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    state = get_pair(update.effective_chat.id)
+    if state is None:
+        await update.effective_chat.send_message(NO_PAIR_TEXT); return
+    args = context.args or []
+    own = dict(state.get("reminders") or {})
+    try:
+        if not args:
+            pass
+        elif args[0] == "off":
+            own["hours"] = []
+        elif args[0] == "on":
+            own.pop("hours", None)
+        elif args[0] == "reset":
+            own = {}
+        elif args[0] == "tz" and len(args) == 2:
+            own["tz"] = parse_tz(args[1])
+        elif args[0] == "quiet" and len(args) == 2:
+            own["quiet"] = parse_quiet(args[1])
+        else:
+            own["hours"] = parse_hours(args)
+    except ValueError:
+        await update.effective_chat.send_message("Не понял настройку.\n" + REMIND_USAGE); return
+    if args:
+        state["reminders"] = own or None
+        save_state("pair", state)
+        schedule_reminder(state)
+    cfg = reminder_settings(state)
+    hours = ", ".join(f"{h:g}" for h in cfg["hours"])
+    quiet = f"{cfg['quiet'][0]:02d}:00–{cfg['quiet'][1]:02d}:00" if cfg["quiet"] else "нет"
+    when = REMINDERS.due.get(state["id"])
+    upcoming = datetime.fromtimestamp(when, ZoneInfo(cfg["tz"])).strftime("%d.%m %H:%M") if when else "—"
+    await update.effective_chat.send_message(
+        "⏰ Напоминания о вопросе без ответа\n"
+        f"Через сколько часов после вопроса: {hours if hours else 'выключены'}\n"
+        f"Часовой пояс: {cfg['tz']}\nТихие часы: {quiet}\nСледующее: {upcoming}\n\n" + REMIND_USAGE,
+        reply_markup=back_menu_kb()
+    )
+
 async def question_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    state = load_state()
+    state = get_pair(update.effective_chat.id)
+    if state is None:
+        await update.effective_chat.send_message(NO_PAIR_TEXT); return
     await resend_current_question(context, state, to_chat_id=update.effective_chat.id)
 
 async def reset_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    state = load_state()
-    state["completed_by_user"] = {}
-    save_state(state)
+    state = get_pair(update.effective_chat.id)
+    if state is None:
+        await update.effective_chat.send_message(NO_PAIR_TEXT); return
+    reset_completed(state)
     await update.effective_chat.send_message("История частичных/полных закрытий очищена.", reply_markup=back_menu_kb())
 
 # ---------- on_button ----------
+# Нажатие разбирается callbacks.py, обработчик берётся из таблицы ROUTER за O(1). Условия маршрута
+# проверяются один раз до обработчика, при отказе его текст заменяет сообщение с кнопкой.
+GUARDS = {
+    "pair": (lambda state, uid: state is not None, NO_PAIR_TEXT),
+    "asker": (is_user_A, "Сейчас задаёт вопросы только A."),
+    "partner": (lambda state, uid: roles_assigned(state),
+                "Ожидаю второго участника (B) — пусть присоединится по коду приглашения."),
+    "free": (lambda state, uid: allows(state, "ask"), "Уже есть активный вопрос. Дождись ответа."),
+    "answerer": (is_user_B, "Эта кнопка для B."),
+    "awaited": (lambda state, uid: phase_of(state) == PENDING and state["pending"]["to_user"] == uid,
+                "Нет ожидающего вопроса."),
+}
+ROUTER = Router(GUARDS)
+ASK_GUARDS = ("pair", "asker", "partner", "free")
+
 async def on_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    state = load_state()
     q = update.callback_query
     await q.answer()
-    data = q.data
     chat_id = q.message.chat_id
+    resolved = ROUTER.resolve(q.data)
+    if resolved is None:
+        await q.edit_message_text("Эта кнопка устарела. Главное меню:", reply_markup=main_menu_kb()); return
+    route, args = resolved
+    state = get_pair(chat_id)
+    refusal = ROUTER.refusal(route.guards, state, chat_id)
+    if refusal is not None:
+        await q.edit_message_text(refusal, reply_markup=back_menu_kb()); return
+    await route.handler(update, context, state, *args)
+
+@ROUTER.route("back_to_menu")
+async def menu_button(update: Update, context: ContextTypes.DEFAULT_TYPE, state):
+    if state is not None and phase_of(state) == AWAITING_QNUM and is_user_A(state, update.effective_chat.id):
+        advance(state, "cancel", save_state)
+    await update.callback_query.edit_message_text("Главное меню:", reply_markup=main_menu_kb())
+
+@ROUTER.route("list_questions")
+async def list_button(update: Update, context: ContextTypes.DEFAULT_TYPE, state):
+    await list_questions(update, context, from_button=True, page=0)
+
+@ROUTER.route("qpage")
+async def page_button(update: Update, context: ContextTypes.DEFAULT_TYPE, state, page, bank_name):
+    await list_questions(update, context, from_button=True, page=page or 0, bank_name=bank_name)
+
+@ROUTER.route("whois", "pair")
+async def whois_button(update: Update, context: ContextTypes.DEFAULT_TYPE, state):
+    a, b = state["roles"]["A"], state["roles"]["B"]
+    ca = completed_count(state, a)
+    cb = completed_count(state, b)
+    await get_archive().ready()
+    tally = get_archive().stats().pair(state["id"])
+    answered = f"\nОтветов в паре: {tally.answers}"
+    if tally.timed:
+        from analytics import duration
+        answered += f", в среднем за {duration(tally.mean())}"
+    await update.callback_query.edit_message_text(
+        f"A: {a if a else '—'} (закрыто: {ca})\nB: {b if b else '—'} (закрыто: {cb}){answered}",
+        reply_markup=back_menu_kb())
+
+@ROUTER.route("hist", "pair")
+async def history_button(update: Update, context: ContextTypes.DEFAULT_TYPE, state, page):
+    text, kb = await archive_page(state, update.effective_chat.id, page or 0)
+    await update.callback_query.edit_message_text(text, reply_markup=kb)
+
+@ROUTER.route("srch", "pair")
+async def search_button(update: Update, context: ContextTypes.DEFAULT_TYPE, state, page):
+    query = context.user_data.get("search")
+    if query is None:
+        await update.callback_query.edit_message_text("Результаты поиска устарели — повтори /search.",
+                                                      reply_markup=back_menu_kb()); return
+    text, kb = await archive_page(state, update.effective_chat.id, page or 0, query)
+    await update.callback_query.edit_message_text(text, reply_markup=kb)
+
+@ROUTER.route("hshow", "pair")
+async def archived_button(update: Update, context: ContextTypes.DEFAULT_TYPE, state, rid, pair_id):
+    if pair_id is not None and str(pair_id) != state["id"]:
+        await update.callback_query.edit_message_text("Эта запись из архива другой пары.", reply_markup=back_menu_kb())
+        return
+    await show_archived(update, context, state, rid)
 
-    maybe_assign_B(state, chat_id)
-
-    if data == "back_to_menu":
-        await q.edit_message_text("Главное меню:", reply_markup=main_menu_kb()); return
-
-    if data == "whois":
-        a, b = state["roles"]["A"], state["roles"]["B"]
-        ca = len(get_completed_for_user(state, a)) if a else 0
-        cb = len(get_completed_for_user(state, b)) if b else 0
-        await q.edit_message_text(f"A: {a if a else '—'} (закрыто: {ca})\nB: {b if b else '—'} (закрыто: {cb})", reply_markup=back_menu_kb()); return
-
-    if data == "reset_history":
-        state["completed_by_user"] = {}; save_state(state)
-        await q.edit_message_text("История частичных/полных закрытий очищена.", reply_markup=main_menu_kb()); return
+@ROUTER.route("reset_history", "pair")
+async def reset_button(update: Update, context: ContextTypes.DEFAULT_TYPE, state):
+    reset_completed(state)
+    await update.callback_query.edit_message_text("История частичных/полных закрытий очищена.", reply_markup=main_menu_kb())
 
-    if data == "repeat_q":
-        await resend_current_question(context, state, to_chat_id=chat_id); return
+@ROUTER.route("repeat_q", "pair")
+async def repeat_button(update: Update, context: ContextTypes.DEFAULT_TYPE, state):
+    await resend_current_question(context, state, to_chat_id=update.effective_chat.id)
 
-    if data == "list_questions":
-        await list_questions(update, context, from_button=True, page=0); return
+@ROUTER.route("ask_specific", *ASK_GUARDS)
+async def ask_specific_button(update: Update, context: ContextTypes.DEFAULT_TYPE, state):
+    # номер придёт следующим текстом A (on_text); фаза хранится в паре и переживает перезапуск
+    advance(state, "ask_specific", save_state)
+    await update.callback_query.edit_message_text(
+        f"Введи номер (1..{len(bank_for(state))}). Для тебя недоступны номера, по которым ты уже получил ответ.\n"
+        "Можно также посмотреть список вопросов.",
+        reply_markup=specific_menu_kb()
+    )
 
-    if data.startswith("qpage_"):
-        try:
-            page = int(data.split("_")[1])
-        except:
-            page = 0
-        await list_questions(update, context, from_button=True, page=page); return
-
-    if data == "ask_specific":
-        if not is_user_A(state, chat_id):
-            await q.edit_message_text("Сейчас задаёт вопросы только A.", reply_markup=back_menu_kb()); return
-        if not roles_assigned(state):
-            await q.edit_message_text("Ожидаю второго участника (B) — пусть нажмёт /start.", reply_markup=back_menu_kb()); return
-        if state.get("pending"):
-            await q.edit_message_text("Уже есть активный вопрос. Дождись ответа.", reply_markup=back_menu_kb()); return
-        context.user_data["await_qnum"] = True
+@ROUTER.route("ask_random", *ASK_GUARDS)
+async def ask_random_button(update: Update, context: ContextTypes.DEFAULT_TYPE, state):
+    chat_id = update.effective_chat.id
+    qnum = pick_random_number(state, chat_id)
+    if qnum is None:
+        await update.callback_query.edit_message_text("Нет доступных номеров для тебя (всё уже закрыто для тебя).",
+                                                      reply_markup=back_menu_kb()); return
+    await send_question(context, state, from_a=chat_id, qnum=qnum, is_random=True)
+
+@ROUTER.route("send_answer", "pair", "answerer", "awaited")
+async def send_answer_button(update: Update, context: ContextTypes.DEFAULT_TYPE, state):
+    q = update.callback_query
+    chat_id = update.effective_chat.id
+    drafts: List[Dict[str, Any]] = state.get("draft_answers") or []
+    if not drafts:
         await q.edit_message_text(
-            "Введи номер (1..127). Для тебя недоступны номера, по которым ты уже получил ответ.\n"
-            "Можно также посмотреть список вопросов.",
-            reply_markup=specific_menu_kb()
-        ); return
+            "Сначала отправь сообщения-ответы (текст/голос/аудио/кружочек), затем нажми «Передать ответ». "
+            "Я напомню вопрос ниже.",
+            reply_markup=back_menu_kb()
+        )
+        await resend_current_question(context, state, to_chat_id=chat_id)
+        return
 
-    if data == "ask_random":
-        if not is_user_A(state, chat_id):
-            await q.edit_message_text("Сейчас задаёт вопросы только A.", reply_markup=back_menu_kb()); return
-        if not roles_assigned(state):
-            await q.edit_message_text("Ожидаю второго участника (B) — пусть нажмёт /start.", reply_markup=back_menu_kb()); return
-        if state.get("pending"):
-            await q.edit_message_text("Уже есть активный вопрос. Дождись ответа.", reply_markup=back_menu_kb()); return
-        remain = remaining_numbers_for_user(state, chat_id)
-        if not remain:
-            await q.edit_message_text("Нет доступных номеров для тебя (всё уже закрыто для тебя).", reply_markup=back_menu_kb()); return
-        qnum = random.choice(remain)
-        await send_question(context, state, from_a=chat_id, qnum=qnum, is_random=True); return
-
-    if data == "send_answer":
-        if not is_user_B(state, chat_id):
-            await q.edit_message_text("Эта кнопка для B.", reply_markup=back_menu_kb()); return
-        if not state.get("pending") or state["pending"]["to_user"] != chat_id:
-            await q.edit_message_text("Нет ожидающего вопроса.", reply_markup=back_menu_kb()); return
-
-        drafts: List[Dict[str, Any]] = state.get("draft_answers") or []
-        if not drafts:
-            await q.edit_message_text(
-                "Сначала отправь сообщения-ответы (текст/голос/аудио/кружочек), затем нажми «Передать ответ». "
-                "Я напомню вопрос ниже.",
-                reply_markup=back_menu_kb()
-            )
-            await resend_current_question(context, state, to_chat_id=chat_id)
-            return
+    # Отправляем ВСЕ ответы отправителю (A) через outbox: задание сохраняется сразу,
+    # доставка идёт в фоне с соблюдением лимитов и повторами, а роли меняются не дожидаясь её.
+    # Пара в фазе «delivering», пока задание этого раунда не снято с очереди (answers_delivered)
+    a_chat = state["pending"]["from_user"]
+    qnum = state["pending"]["qnum"]
+    # ключ идемпотентности — сам вопрос, а не апдейт: ответы на него уходят A не больше одного раза
+    sent_at = state["pending"].get("sent_at")
+    key = f"{state['id']}-a{qnum}-{int(sent_at * 1000)}" if sent_at else f"{state['id']}-{update.update_id}"
+    deliver(state, key, save_state)
+    ACKS.reset(chat_id)
+    queued = get_outbox().submit({"id": key, "chat_id": a_chat, "pair": state["id"], "items": (
+        [{"type": "text", "data": {"text": "Привет, тебе пришли ответы!"}}] + drafts +
+        [{"type": "text", "data": {"text": "Теперь ты B — жди вопрос.", "menu": True}}]
+    )})
+    get_archive().add({"p": state["id"], "bank": state.get("bank", "default"), "q": qnum,
+                       "qt": bank_for(state).get(qnum), "t": time.time(), "from": chat_id, "to": a_chat,
+                       "sent": sent_at, "pick": state["pending"].get("pick"), "items": drafts})
+    mark_completed_for_user(state, a_chat, qnum)
+    clear_pending(state)
+    auto_swap_roles(state)
+    if not queued:
+        # эти ответы уже были доставлены — ждать нечего
+        delivered(state, key, save_state)
+    get_outbox().submit({"id": key + "-a", "chat_id": state["roles"]["A"], "items": [
+        {"type": "text", "data": {"text": "Теперь ты A — задай следующий вопрос.", "menu": True}}
+    ]})
+    await q.edit_message_text("Спасибо, твои ответы переданы.", reply_markup=back_menu_kb())
 
-        # Отправляем ВСЕ ответы отправителю (A)
-        a_chat = state["pending"]["from_user"]
-        qnum = state["pending"]["qnum"]
-        await context.bot.send_message(chat_id=a_chat, text="Привет, тебе пришли ответы!")
-
-        for item in drafts:
-            t = item["type"]; data = item["data"]
-            try:
-                if t == "text":
-                    await context.bot.send_message(chat_id=a_chat, text=data["text"])
-                elif t == "voice":
-                    await context.bot.send_voice(chat_id=a_chat, voice=data["file_id"], caption=data.get("caption"))
-                elif t == "audio":
-                    await context.bot.send_audio(chat_id=a_chat, audio=data["file_id"], caption=data.get("caption"))
-                elif t == "video_note":
-                    await context.bot.send_video_note(chat_id=a_chat, video_note=data["file_id"])
-            except Exception:
-                logging.exception("Не удалось переслать один из ответов A")
-
-        await q.edit_message_text("Спасибо, твои ответы переданы.", reply_markup=back_menu_kb())
-        mark_completed_for_user(state, a_chat, qnum)
-        clear_pending(state)
-        auto_swap_roles(state)
-        new_a, new_b = state["roles"]["A"], state["roles"]["B"]
-        try: await context.bot.send_message(chat_id=new_a, text="Теперь ты A — задай следующий вопрос.", reply_markup=main_menu_kb())
-        except Exception: logging.exception("notify A failed")
-        try: await context.bot.send_message(chat_id=new_b, text="Теперь ты B — жди вопрос.", reply_markup=main_menu_kb())
-        except Exception: logging.exception("notify B failed")
-        return
 # ---------- send_question ----------
-async def send_question(context: ContextTypes.DEFAULT_TYPE, state: Dict[str, Any], from_a: int, qnum: int, is_random: bool):
-    b_chat = state["roles"]["B"]
-    if not b_chat:
-        await context.bot.send_message(chat_id=from_a, text="B ещё не присоединился. Пусть второй участник нажмёт /start.")
-        return
-    if state.get("pending"):
-        await context.bot.send_message(chat_id=from_a, text="Уже есть активный вопрос. Дождись ответа.")
-        return
-    if qnum < 1 or qnum > TOTAL_QUESTIONS:
-        await context.bot.send_message(chat_id=from_a, text="Номер вне диапазона (1..127)."); return
-
-    if qnum in get_completed_for_user(state, from_a):
-        await context.bot.send_message(chat_id=from_a, text=f"Вопрос №{qnum} уже закрыт для тебя. Выбери другой номер."); return
+def qnum_refusal(state: Dict[str, Any], user_id: int, text: str) -> Optional[str]:
+    # номер, который A ввёл после «Запросить конкретный вопрос»: None — номер годится
+    total = len(bank_for(state))
+    try:
+        qnum = int(text.strip())
+    except ValueError:
+        return f"Нужно число от 1 до {total}."
+    if qnum < 1 or qnum > total:
+        return f"Номер вне диапазона (1..{total})."
+    if is_completed_for_user(state, user_id, qnum):
+        return f"Вопрос №{qnum} уже закрыт для тебя. Выбери другой номер."
     if is_fully_closed(state, qnum):
-        await context.bot.send_message(chat_id=from_a, text=f"Вопрос №{qnum} уже полностью закрыт (оба получили ответы)."); return
+        return f"Вопрос №{qnum} уже полностью закрыт (оба получили ответы)."
+    return None
 
-    state["pending"] = {"to_user": b_chat, "from_user": from_a, "qnum": qnum}
+async def send_question(context: ContextTypes.DEFAULT_TYPE, state: Dict[str, Any], from_a: int, qnum: int, is_random: bool):
+    # всё проверено до вызова: условия маршрута (A, B в паре, вопроса нет) и номер (qnum_refusal
+    # или выбор из незакрытых)
+    b_chat = state["roles"]["B"]
+    state["pending"] = {"to_user": b_chat, "from_user": from_a, "qnum": qnum, "sent_at": time.time(), "reminded": 0,
+                        "pick": "random" if is_random else "specific"}
     state["draft_answers"] = []
-    save_state(state)
+    save_state("pending", state); save_state("drafts_cleared", state)
+    advance(state, "ask", save_state)
+    ACKS.reset(b_chat)
+    schedule_reminder(state)
 
-    qtext = QUESTIONS[qnum - 1]
+    qtext = bank_for(state).get(qnum)
     await context.bot.send_message(
         chat_id=from_a,
         text=f"Готово, твой вопрос №{qnum} передан. Его текст звучит так:\n\n{qtext}"
@@ -372,45 +860,78 @@ async def send_question(context: ContextTypes.DEFAULT_TYPE, state: Dict[str, Any
     prefix_b = "Привет, тебе пришел рандомный вопрос" if is_random else "Привет, тебе пришел конкретный вопрос"
     msg_b = (
         f"{prefix_b}.\n\n№{qnum}: {qtext}\n\n"
-        "Загрузи ответ в формате текста, голосового сообщения или кружочка — их количество не ограничено. "
+        "Загрузи ответ в формате текста, голосового сообщения или кружочка — "
+        f"можно несколько, до {DRAFT_MAX_ITEMS}. "
         "А после нажми кнопку «Передать ответ»."
     )
     await context.bot.send_message(chat_id=b_chat, text=msg_b, reply_markup=send_answer_kb())
 
 # --------- МНОГООТВЕТНОСТЬ ОТ B ---------
+# Черновики B ограничены числом и размером (DraftBudget); если запись состояния отстала, черновик
+# ждёт её (STORE.caught_up) и не принимается, только если она так и не догнала. Вместо ответа на каждый черновик B видит одну сводку «Принято N», которая правится
+# на месте (AckBoard): пачка пересланных сообщений не превращается в такую же пачку исходящих.
+DRAFT_KINDS = {"text": "текст", "voice": "голосовые", "audio": "аудио", "video_note": "кружочки"}
+DRAFT_BUDGET = DraftBudget(DRAFT_MAX_ITEMS, DRAFT_MAX_BYTES)
+
+def render_ack(ack) -> Tuple[str, InlineKeyboardMarkup]:
+    accepted = sum(ack.accepted.values())
+    kinds = ", ".join(f"{DRAFT_KINDS[k]} — {n}" for k, n in ack.accepted.items())
+    lines = [f"Принято сообщений: {accepted}" + (f" ({kinds})." if kinds else ".")]
+    rate = ack.rejected.get("rate_user", 0) + ack.rejected.get("rate_pair", 0)
+    full = ack.rejected.get("draft_items", 0) + ack.rejected.get("draft_bytes", 0)
+    busy = ack.rejected.get("busy", 0)
+    if rate:
+        lines.append(f"Не принято {rate} — слишком быстро. Отправь их ещё раз чуть позже.")
+    if busy:
+        lines.append(f"Не принято {busy} — бот перегружен. Отправь их ещё раз через минуту.")
+    if full:
+        lines.append(f"Не принято {full} — ответ уже максимального размера "
+                     f"({DRAFT_MAX_ITEMS} сообщений, {DRAFT_MAX_BYTES >> 10} КБ). Нажми «Передать ответ».")
+    else:
+        lines.append("Можешь отправить ещё или нажать «Передать ответ».")
+    return "\n".join(lines), send_answer_kb()
+
+ACKS = AckBoard(render_ack, delay=DRAFT_ACK_DELAY)
+
+def awaits_answer(state: Optional[Dict[str, Any]], chat_id: int) -> bool:
+    return (state is not None and phase_of(state) == PENDING and state["pending"]["to_user"] == chat_id
+            and is_user_B(state, chat_id))
+
 def _append_draft(state: Dict[str, Any], item: Dict[str, Any]) -> None:
     drafts = state.get("draft_answers") or []
     drafts.append(item)
     state["draft_answers"] = drafts
-    save_state(state)
+    DRAFT_BUDGET.added(state, item)
+    save_state("draft", state, item)
+
+async def add_draft(context: ContextTypes.DEFAULT_TYPE, state: Dict[str, Any], chat_id: int, item: Dict[str, Any]) -> None:
+    # запись состояния отстала — черновик ждёт её, а не копится в памяти сверх меры
+    caught_up = await STORE.caught_up(STATE_BACKPRESSURE, STATE_BACKPRESSURE_WAIT)
+    reason = DRAFT_BUDGET.refusal(state, item) if caught_up else "busy"
+    if reason is None:
+        _append_draft(state, item)
+    else:
+        metrics.INBOUND_REJECTED.inc(reason)
+    ACKS.note(context.bot, chat_id, item["type"], rejected=reason)
 
 async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    state = load_state()
     chat_id = update.effective_chat.id
-    maybe_assign_B(state, chat_id)
+    state = get_pair(chat_id)
+    if state is None:
+        await update.message.reply_text(NO_PAIR_TEXT); return
     text = update.message.text or ""
 
-    if context.user_data.get("await_qnum"):
-        context.user_data["await_qnum"] = False
-        if not is_user_A(state, chat_id):
-            await update.message.reply_text("Сейчас спрашивает только A.", reply_markup=back_menu_kb()); return
-        if not roles_assigned(state):
-            await update.message.reply_text("Ожидаю второго участника (B) — пусть нажмёт /start.", reply_markup=back_menu_kb()); return
-        if state.get("pending"):
-            await update.message.reply_text("Уже есть активный вопрос. Дождись ответа.", reply_markup=back_menu_kb()); return
-        try:
-            qnum = int(text.strip())
-        except Exception:
-            await update.message.reply_text("Нужно число от 1 до 127.", reply_markup=back_menu_kb()); return
-        if qnum in get_completed_for_user(state, chat_id):
-            await update.message.reply_text(f"Вопрос №{qnum} уже закрыт для тебя. Выбери другой номер.", reply_markup=back_menu_kb()); return
-        if is_fully_closed(state, qnum):
-            await update.message.reply_text(f"Вопрос №{qnum} уже полностью закрыт (оба получили ответы).", reply_markup=back_menu_kb()); return
-        await send_question(context, state, from_a=chat_id, qnum=qnum, is_random=False); return
+    if phase_of(state) == AWAITING_QNUM and is_user_A(state, chat_id):
+        # условия (A, B в паре, вопроса нет) проверены при входе в фазу, и пока она длится, не меняются
+        refusal = qnum_refusal(state, chat_id, text)
+        if refusal is not None:
+            advance(state, "cancel", save_state)
+            await update.message.reply_text(refusal, reply_markup=back_menu_kb()); return
+        await send_question(context, state, from_a=chat_id, qnum=int(text.strip()), is_random=False); return
 
-    if state.get("pending") and state["pending"]["to_user"] == chat_id and is_user_B(state, chat_id):
-        _append_draft(state, {"from_user": chat_id, "type": "text", "data": {"text": text}})
-        await update.message.reply_text("Текст принят. Можешь отправить ещё или нажать «Передать ответ».", reply_markup=send_answer_kb()); return
+    if awaits_answer(state, chat_id):
+        await add_draft(context, state, chat_id, {"from_user": chat_id, "type": "text", "data": {"text": text}, "message_id": update.message.message_id})
+        return
 
     if text.strip().lower() in {"вопрос", "напомни", "напомнить вопрос"}:
         await resend_current_question(context, state, to_chat_id=chat_id); return
@@ -418,62 +939,330 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Выбери действие:", reply_markup=main_menu_kb())
 
 async def on_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    state = load_state()
     chat_id = update.effective_chat.id
-    maybe_assign_B(state, chat_id)
-    if state.get("pending") and state["pending"]["to_user"] == chat_id and is_user_B(state, chat_id):
+    state = get_pair(chat_id)
+    if awaits_answer(state, chat_id):
         voice = update.message.voice; caption = update.message.caption
-        _append_draft(state, {"from_user": chat_id, "type": "voice", "data": {"file_id": voice.file_id, "caption": caption}})
-        await update.message.reply_text("Голосовое принято. Можешь отправить ещё или нажать «Передать ответ».", reply_markup=send_answer_kb()); return
+        await add_draft(context, state, chat_id, {"from_user": chat_id, "type": "voice", "data": {"file_id": voice.file_id, "caption": caption}, "message_id": update.message.message_id})
+        return
     await update.message.reply_text("Сейчас нет ожидающего вопроса.", reply_markup=back_menu_kb())
 
 async def on_audio(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    state = load_state()
     chat_id = update.effective_chat.id
-    maybe_assign_B(state, chat_id)
-    if state.get("pending") and state["pending"]["to_user"] == chat_id and is_user_B(state, chat_id):
+    state = get_pair(chat_id)
+    if awaits_answer(state, chat_id):
         audio = update.message.audio; caption = update.message.caption
-        _append_draft(state, {"from_user": chat_id, "type": "audio", "data": {"file_id": audio.file_id, "caption": caption}})
-        await update.message.reply_text("Аудио принято. Можешь отправить ещё или нажать «Передать ответ».", reply_markup=send_answer_kb()); return
+        await add_draft(context, state, chat_id, {"from_user": chat_id, "type": "audio", "data": {"file_id": audio.file_id, "caption": caption}, "message_id": update.message.message_id})
+        return
     await update.message.reply_text("Сейчас нет ожидающего вопроса.", reply_markup=back_menu_kb())
 
 async def on_video_note(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    state = load_state()
     chat_id = update.effective_chat.id
-    maybe_assign_B(state, chat_id)
-    if state.get("pending") and state["pending"]["to_user"] == chat_id and is_user_B(state, chat_id):
+    state = get_pair(chat_id)
+    if awaits_answer(state, chat_id):
         vn = update.message.video_note
-        _append_draft(state, {"from_user": chat_id, "type": "video_note", "data": {"file_id": vn.file_id}})
-        await update.message.reply_text("Кружочек принят. Можешь отправить ещё или нажать «Передать ответ».", reply_markup=send_answer_kb()); return
+        await add_draft(context, state, chat_id, {"from_user": chat_id, "type": "video_note", "data": {"file_id": vn.file_id}, "message_id": update.message.message_id})
+        return
     await update.message.reply_text("Сейчас нет ожидающего вопроса.", reply_markup=back_menu_kb())
 
 async def on_other(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    state = load_state()
-    chat_id = update.effective_chat.id
-    maybe_assign_B(state, chat_id)
     await update.effective_chat.send_message("Поддерживаются: текст, голос, аудио, кружочек. Используй кнопку «Напомнить вопрос».", reply_markup=back_menu_kb())
+# ---------- OUTBOX ----------
+OUTBOX: Optional[Outbox] = None
+
+def get_outbox() -> Outbox:
+    global OUTBOX
+    if OUTBOX is None:
+        OUTBOX = Outbox(
+            load_state()["outbox"], save_state,
+            limiter=RateLimiter(SEND_RATE_GLOBAL, SEND_RATE_CHAT, SEND_BURST_CHAT),
+            reply_markup=lambda item: (send_answer_kb() if item["data"].get("answer")
+                                       else main_menu_kb() if item["data"].get("menu") else None),
+            done=get_dedupe(),
+            on_done=answers_delivered,
+        )
+    return OUTBOX
+
+def answers_delivered(job: Dict[str, Any]) -> None:
+    # задание с ответами B снято с очереди — пара выходит из фазы «delivering»,
+    # если это задание её текущего раунда, а не прошлого (новый вопрос уже задан и отвечен)
+    pair = load_state()["pairs"].get(job.get("pair"))
+    if pair is not None:
+        delivered(pair, job["id"], save_state)
+
+# ---------- DEDUPE ----------
+# Повтор апдейта (вебхук повторил запрос, после падения polling отдал те же апдейты) отбрасывается
+# до обработчиков: update_id и id нажатия кнопки проверяются по окну недавних ключей за O(1).
+# Группа -2 только занимает ключи апдейта в памяти, записываются они в группе 1 — после
+# обработчика и всех его изменений состояния (см. dedupe.py): упавший посреди обработки апдейт
+# при повторе обрабатывается заново, а не теряется.
+DEDUPE: Optional[DedupeWindow] = None
+
+def get_dedupe() -> DedupeWindow:
+    global DEDUPE
+    window = load_state()["dedupe"]
+    if DEDUPE is None or DEDUPE.window is not window:
+        DEDUPE = DedupeWindow(window, save_state)
+    return DEDUPE
+
+def update_keys(update: Update) -> List[str]:
+    keys = [f"u{update.update_id}"]
+    if update.callback_query:
+        keys.append(f"c{update.callback_query.id}")
+    return keys
+
+async def drop_duplicate(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    dedupe = get_dedupe()
+    keys = update_keys(update)
+    fresh = [dedupe.claim(key) for key in keys]
+    if not all(fresh):
+        for key, claimed in zip(keys, fresh):
+            if claimed:
+                dedupe.release(key)
+        metrics.DUPLICATES.inc("callback_query" if update.callback_query and fresh[0] else "update")
+        logging.info("Повтор апдейта %s отброшен", update.update_id)
+        raise ApplicationHandlerStop
+
+def settle_update(update: Update) -> None:
+    dedupe = get_dedupe()
+    for key in update_keys(update):
+        dedupe.commit(key)
+
+async def remember_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # группа 1: обработчик группы 0 завершился (PTB доходит сюда и после его ошибки — такой
+    # апдейт Telegram сам не повторит, а его частичные изменения уже записаны раньше отметки)
+    settle_update(update)
+
+# ---------- INBOUND ----------
+# Входящие сообщения ограничены вёдрами токенов на пользователя и на пару до обработчиков: лишнее
+# не трогает состояние. Отвечающему B отказ показывается в его сводке «Принято N», остальным —
+# одно предупреждение на всплеск; дальше отказы молчаливые.
+INBOUND = InboundLimiter(INBOUND_RATE_USER, INBOUND_BURST_USER, INBOUND_RATE_PAIR, INBOUND_BURST_PAIR)
+
+async def throttle_inbound(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if update.message is None or user is None:
+        return
+    pair_id = load_state()["user_pair"].get(str(user.id))
+    refused = INBOUND.admit(user.id, pair_id)
+    if refused is None:
+        return
+    reason, wait = refused
+    metrics.INBOUND_REJECTED.inc(reason)
+    if awaits_answer(get_pair(user.id), user.id):
+        kind = next((k for k in DRAFT_KINDS if getattr(update.message, k, None)), "text")
+        ACKS.note(context.bot, user.id, kind, rejected=reason)
+    elif INBOUND.warn_once(user.id):
+        await context.bot.send_message(chat_id=update.effective_chat.id,
+                                       text=f"Слишком много сообщений подряд — лишние не обработаны. "
+                                            f"Подожди {max(1, round(wait))} с.")
+    settle_update(update)     # группа 1 не выполнится; отказ ничего не менял в состоянии
+    raise ApplicationHandlerStop
+
+# ---------- REMINDERS ----------
+# Напоминания B о вопросе без ответа: один планировщик на весь бот (см. reminders.py), ключ — pair_id.
+# Срок вычисляется из pending пары, поэтому после перезапуска планировщик собирается заново.
+def reminder_settings(state: Dict[str, Any]) -> Dict[str, Any]:
+    own = state.get("reminders") or {}
+    return {"hours": own.get("hours", REMINDER_HOURS), "tz": own.get("tz", REMINDER_TZ),
+            "quiet": own.get("quiet", REMINDER_QUIET)}
+
+def reminder_due(state: Dict[str, Any], now: Optional[float] = None) -> Optional[float]:
+    if not state.get("pending"):
+        return None
+    cfg = reminder_settings(state)
+    return next_due(state["pending"], cfg["hours"], cfg["tz"], cfg["quiet"], time.time() if now is None else now)
+
+def stamp_sent_at(state: Dict[str, Any], now: Optional[float] = None) -> None:
+    # вопрос из состояния до напоминаний не знает sent_at: отсчёт идёт от первого планирования и
+    # сохраняется — иначе срок при каждой проверке сдвигался бы на «сейчас» и напоминание не пришло бы
+    pending = state.get("pending")
+    if pending and not pending.get("sent_at"):
+        pending["sent_at"] = time.time() if now is None else now
+        save_state("pending", state)
+
+def schedule_reminder(state: Dict[str, Any]) -> None:
+    stamp_sent_at(state)
+    REMINDERS.schedule(state["id"], reminder_due(state))
+
+def load_reminders() -> None:
+    now = time.time()
+    due = []
+    for pair in load_state()["pairs"].values():
+        stamp_sent_at(pair, now)
+        when = reminder_due(pair, now)
+        if when is not None:
+            due.append((pair["id"], when))
+    REMINDERS.load(due)
+    logging.info("Напоминания: запланировано %s", len(due))
+
+async def remind(pair_id: str) -> None:
+    async with PAIR_LOCKS.hold(f"pair:{pair_id}"):
+        state = load_state()["pairs"].get(pair_id)
+        due = reminder_due(state) if state else None
+        if due is None:
+            return      # пока ждали блокировку, вопрос закрыли
+        if due > time.time():
+            # задали новый вопрос или срок сдвинулся: ждём его, а не бросаем напоминание
+            schedule_reminder(state)
+            return
+        pending = state["pending"]
+        hours = reminder_settings(state)["hours"]
+        step = pending.get("reminded", 0)
+        last = step == len(hours) - 1
+        qnum = pending["qnum"]
+        hdr = f"Вопрос ждёт ответа уже {hours[step]:g} ч" if last else "Вопрос всё ещё ждёт ответа"
+        tail = ("Ответы уже есть — не забудь нажать «Передать ответ»." if state.get("draft_answers") else
+                "Загрузи ответ текстом, голосом или кружочком и нажми «Передать ответ».")
+        # сообщения идут через outbox: общий лимит отправки, повторы, переживают перезапуск
+        key = f"{pair_id}-r{int(pending.get('sent_at') or 0)}-{step}"
+        get_outbox().submit({"id": key, "chat_id": pending["to_user"], "items": [
+            {"type": "text", "data": {"text": f"⏰ {hdr}:\n\n№{qnum}: {bank_for(state).get(qnum)}\n\n{tail}",
+                                      "answer": True}}
+        ]})
+        if last:
+            get_outbox().submit({"id": key + "-a", "chat_id": pending["from_user"], "items": [
+                {"type": "text", "data": {"text": f"Партнёр пока не ответил на вопрос №{qnum}. "
+                                                  "Больше напоминаний не будет — можно напомнить лично."}}
+            ]})
+        pending["reminded"] = step + 1
+        save_state("reminded", state)
+        metrics.REMINDERS.inc(str(step + 1))
+        schedule_reminder(state)
+
+REMINDERS = ReminderScheduler(remind, rate=REMINDER_RATE)
+metrics.REMINDERS_SCHEDULED.set_function(lambda: len(REMINDERS))
+
+METRICS_RUNNER = None
+
+# ---------- STARTUP ----------
+# Холодный старт: состояние и банк по умолчанию читаются в отдельном потоке, пока Application
+# собирается и ходит в Telegram (get_me, setWebhook); _post_init дожидается потока до первого апдейта.
+# Архив ответов _post_init только запускает читаться в потоке: апдейты не ждут его, кроме /history,
+# /search и сводок ответов, которые дожидаются загрузки, не блокируя цикл.
+# При остановке всё прочитанное сохраняется образом (startup.py), и следующий старт его не пересчитывает.
+WARM_UP: Optional[threading.Thread] = None
+
+def warm_up() -> None:
+    load_state()
+    bank_for(None)
+
+def start_warm_up() -> None:
+    global WARM_UP
+    if WARM_UP is None:
+        WARM_UP = threading.Thread(target=warm_up, name="warm-up", daemon=True)
+        WARM_UP.start()
+
+def save_startup_image() -> None:
+    if STARTUP_IMAGE:
+        try:
+            startup.save_image(Path(STARTUP_IMAGE), STORE, BANKS)
+        except Exception:
+            logging.exception("startup image write error")
+
+async def _post_init(app: Application) -> None:
+    global METRICS_RUNNER
+    if WARM_UP is not None:
+        await asyncio.to_thread(WARM_UP.join)
+    STORE.start()
+    get_outbox().start(app.bot)
+    load_reminders()
+    REMINDERS.start()
+    get_archive().start()
+    if METRICS_PORT:
+        METRICS_RUNNER = await metrics.serve(METRICS_LISTEN, METRICS_PORT)
+
+async def _post_shutdown(app: Application) -> None:
+    global METRICS_RUNNER
+    await REMINDERS.stop()
+    await ACKS.stop()
+    await get_outbox().stop()
+    await STORE.stop()
+    save_startup_image()
+    if ARCHIVE is not None:
+        ARCHIVE.close()
+    if METRICS_RUNNER is not None:
+        await METRICS_RUNNER.cleanup()
+        METRICS_RUNNER = None
+
+# ---------- CONCURRENCY ----------
+# При concurrent_updates обработчики одной пары не должны перемежаться на await:
+# каждый апдейт берёт блокировку своей пары (или пользователя, если пары ещё нет).
+PAIR_LOCKS = KeyedLocks()
+
+def lock_key(user_id: int) -> str:
+    pair_id = load_state()["user_pair"].get(str(user_id))
+    return f"pair:{pair_id}" if pair_id else f"user:{user_id}"
+
+def serialized(handler):
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user = update.effective_user or update.effective_chat
+        if user is None:
+            return await handler(update, context)
+        while True:
+            key = lock_key(user.id)
+            async with PAIR_LOCKS.hold(key):
+                # пока ждали, пользователь мог войти в пару — тогда берём уже её блокировку
+                if key == lock_key(user.id):
+                    return await handler(update, context)
+    return wrapper
+
 def build_app() -> Application:
     if not TOKEN:
         raise RuntimeError("Нет TELEGRAM_TOKEN в переменных окружения.")
-    app = Application.builder().token(TOKEN).build()
-    app.add_handler(CommandHandler("start", start))
+    app = (Application.builder().token(TOKEN)
+           .concurrent_updates(CONCURRENT_UPDATES if CONCURRENT_UPDATES > 1 else False)
+           .request(metrics.InstrumentedRequest(connection_pool_size=256))
+           .post_init(_post_init).post_shutdown(_post_shutdown).build())
+    app.add_handler(CommandHandler("start", serialized(start)))
+    app.add_handler(CommandHandler("join", serialized(join_cmd)))
     app.add_handler(CommandHandler("help", help_cmd))
-    app.add_handler(CommandHandler("stats", stats_cmd))
-    app.add_handler(CommandHandler("question", question_cmd))
-    app.add_handler(CommandHandler("reset", reset_cmd))
+    app.add_handler(CommandHandler("stats", serialized(stats_cmd)))
+    app.add_handler(CommandHandler("question", serialized(question_cmd)))
+    app.add_handler(CommandHandler("reset", serialized(reset_cmd)))
     app.add_handler(CommandHandler("list", list_questions))
+    app.add_handler(CommandHandler("bank", serialized(bank_cmd)))
+    app.add_handler(CommandHandler("remind", serialized(remind_cmd)))
+    app.add_handler(CommandHandler("history", serialized(history_cmd)))
+    app.add_handler(CommandHandler("search", serialized(search_cmd)))
 
-    app.add_handler(CallbackQueryHandler(on_button))
+    app.add_handler(CallbackQueryHandler(serialized(on_button)))
 
-    app.add_handler(MessageHandler(filters.VOICE, on_voice))
-    app.add_handler(MessageHandler(filters.AUDIO, on_audio))
-    app.add_handler(MessageHandler(filters.VIDEO_NOTE, on_video_note))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, on_text))
+    app.add_handler(MessageHandler(filters.VOICE, serialized(on_voice)))
+    app.add_handler(MessageHandler(filters.AUDIO, serialized(on_audio)))
+    app.add_handler(MessageHandler(filters.VIDEO_NOTE, serialized(on_video_note)))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, serialized(on_text)))
     app.add_handler(MessageHandler(~(filters.TEXT | filters.VOICE | filters.AUDIO | filters.VIDEO_NOTE), on_other))
+    metrics.instrument_handlers(app)
+    # проверка повторов и лимит входящих — до всех групп, отметка апдейта — после; всё вне метрик
+    # обработчиков: апдейт считается один раз, и повтор не тратит токены
+    app.add_handler(TypeHandler(Update, drop_duplicate), group=-2)
+    app.add_handler(TypeHandler(Update, throttle_inbound), group=-1)
+    app.add_handler(TypeHandler(Update, remember_update), group=1)
     return app
 
+def health() -> Dict[str, Any]:
+    root = load_state()
+    return {"status": "ok", "mode": BOT_MODE, "shard": WORKER_SHARD,
+            "pairs": len(root["pairs"]), "outbox": len(root["outbox"]), "reminders": len(REMINDERS),
+            "duplicates_dropped": get_dedupe().duplicates,
+            "inbound_rejected": int(sum(metrics.INBOUND_REJECTED.values.values())),
+            "unsaved_changes": STORE.dirty}
+
+def membership(user_id: int) -> Dict[str, Any]:
+    # для маршрутизатора (webhook.py): в какой паре пользователь на этом воркере и полна ли она
+    pair = get_pair(user_id)
+    return {"pair": pair["id"] if pair else None, "full": bool(pair) and roles_assigned(pair)}
+
 def main():
+    start_warm_up()
     app = build_app()
+    if BOT_MODE == "webhook":
+        from webhook import run_worker
+        logging.info("Бот запускается (webhook, порт %s)...", PORT)
+        asyncio.run(run_worker(app, WEBHOOK_LISTEN, PORT, WEBHOOK_URL, WEBHOOK_SECRET, health, membership))
+        return
     logging.info("Бот запускается (polling)...")
     app.run_polling(close_loop=False)
 
@@ -0,0 +1,136 @@
+# callbacks.py — данные inline-кнопок и маршрутизация нажатий
+# - callback_data — компактная типизированная запись «<версия><код действия>[:поле...]», целые — в base36:
+#   "1a" — случайный вопрос, "1p:3:travel" — страница 3 списка банка travel, "1r:2s:h" — запись архива
+#   №100 пары 17. Поля описаны у действия (int/str), пустое или отсутствующее поле — None.
+#   Telegram ограничивает callback_data 64 байтами — encode это проверяет.
+# - Кнопки старого формата из уже отправленных сообщений ("ask_random", "qpage_3", "hshow_12")
+#   по-прежнему разбираются; данные неизвестной версии — устаревшая кнопка (decode → None).
+# - Разбор — один поиск в словаре по коду действия, без цепочки сравнений. Маршрут — таблица
+#   действие → (обработчик, условия); условия («есть пара», «нажал A», …) проверяются один раз
+#   до обработчика, и обработчик их не повторяет.
+
+import functools
+from typing import Dict, Any, Callable, Optional, NamedTuple, Tuple
+
+VERSION = "1"
+MAX_BYTES = 64
+
+
+class Action(NamedTuple):
+    name: str
+    code: str
+    fields: Tuple[type, ...] = ()
+
+
+ACTIONS = (
+    Action("back_to_menu", "m"),
+    Action("list_questions", "l"),
+    Action("qpage", "p", (int, str)),          # страница, банк
+    Action("whois", "w"),
+    Action("hist", "h", (int,)),               # страница истории
+    Action("srch", "s", (int,)),               # страница результатов /search
+    Action("hshow", "r", (int, int)),          # запись архива, пара
+    Action("reset_history", "x"),
+    Action("repeat_q", "q"),
+    Action("ask_specific", "c"),
+    Action("ask_random", "a"),
+    Action("send_answer", "d"),
+)
+BY_NAME = {a.name: a for a in ACTIONS}
+BY_CODE = {a.code: a for a in ACTIONS}
+# старый формат: имя действия целиком или «префикс_число»
+LEGACY = {a.name: a for a in ACTIONS if not a.fields}
+LEGACY_PREFIX = {a.name: a for a in ACTIONS if a.fields}
+
+_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def _b36(n: int) -> str:
+    if n < 0:
+        return "-" + _b36(-n)
+    out = ""
+    while True:
+        n, r = divmod(n, 36)
+        out = _DIGITS[r] + out
+        if not n:
+            return out
+
+
+def encode(name: str, *values: Any) -> str:
+    action = BY_NAME[name]
+    parts = [VERSION + action.code]
+    for kind, value in zip(action.fields, values):
+        parts.append("" if value is None else _b36(value) if kind is int else str(value))
+    while len(parts) > 1 and not parts[-1]:
+        parts.pop()
+    data = ":".join(parts)
+    if len(data.encode()) > MAX_BYTES:
+        raise ValueError(f"callback data longer than {MAX_BYTES} bytes: {data!r}")
+    return data
+
+
+@functools.lru_cache(maxsize=4096)
+def decode(data: str) -> Optional[Tuple[Action, Tuple[Any, ...]]]:
+    # (действие, значения полей) или None — кнопка неизвестна или устарела; кнопок в ходу немного
+    # (меню, страницы), поэтому повторное нажатие разбирается одним поиском в кэше
+    try:
+        if data[:1] == VERSION:
+            head, _, rest = data.partition(":")
+            action = BY_CODE.get(head[1:])
+            if action is None or not action.fields:
+                return (action, ()) if action is not None else None
+            # последнее поле забирает остаток целиком: в имени банка может встретиться ":"
+            raw = rest.split(":", len(action.fields) - 1) if rest else []
+            values = [None] * len(action.fields)
+            for i, v in enumerate(raw):
+                if v:
+                    values[i] = int(v, 36) if action.fields[i] is int else v
+            return action, tuple(values)
+        action = LEGACY.get(data)
+        if action is not None:
+            return action, ()
+        prefix, _, arg = data.rpartition("_")
+        action = LEGACY_PREFIX.get(prefix)
+        if action is None:
+            return None
+        return action, (int(arg),) + (None,) * (len(action.fields) - 1)
+    except ValueError:
+        return None
+
+
+class Route(NamedTuple):
+    handler: Callable[..., Any]
+    guards: Tuple[str, ...]
+
+
+class Router:
+    def __init__(self, guards: Dict[str, Tuple[Callable[[Any, int], bool], str]]):
+        self.guards = guards          # имя → (проверка(state, user_id), текст отказа)
+        self.routes: Dict[str, Route] = {}
+
+    def route(self, name: str, *guards: str):
+        if name not in BY_NAME:
+            raise KeyError(f"unknown callback action: {name}")
+        for guard in guards:
+            if guard not in self.guards:
+                raise KeyError(f"unknown guard: {guard}")
+
+        def register(handler):
+            self.routes[name] = Route(handler, guards)
+            return handler
+        return register
+
+    def resolve(self, data: Optional[str]) -> Optional[Tuple[Route, Tuple[Any, ...]]]:
+        decoded = decode(data or "")
+        if decoded is None:
+            return None
+        route = self.routes.get(decoded[0].name)
+        return (route, decoded[1]) if route is not None else None
+
+    def refusal(self, guards: Tuple[str, ...], state: Any, user_id: int) -> Optional[str]:
+        # первое невыполненное условие — его текст; None — можно выполнять
+        for name in guards:
+            check, text = self.guards[name]
+            if not check(state, user_id):
+                return text
+        return None
@@ -0,0 +1,140 @@
+# completions.py — битовые карты закрытых вопросов и выбор случайного номера без повторов
+# - Для каждого участника пары: int-битмап закрытых номеров и счётчик (проверка и подсчёт за O(1)).
+# - «Полностью закрытые» (оба получили ответ) — пересечение, обновляется при каждой отметке.
+# - Случайный номер берётся из псевдослучайной перестановки 1..N (сеть Фейстеля):
+#   для участника хранится только (seed, cursor), каждый номер за цикл просматривается не больше раза,
+#   поэтому выбор стоит O(1) амортизированно и не требует списка оставшихся номеров.
+# - Когда свободных номеров меньше 1/_DENSE, обход перестановки тратит на выбор ~N/свободных шагов;
+#   тогда берётся k-й единичный бит карты свободных номеров (~закрытые & маска): карта делится пополам
+#   по bit_count, выбор стоит O(N/64) машинных слов и не зависит от того, сколько номеров осталось.
+
+import random
+from typing import Dict, Any, List, Optional, Tuple
+
+_ROUNDS = 4
+_DENSE = 8
+
+
+def nth_bit(x: int, k: int) -> int:
+    # позиция k-го (с нуля) единичного бита x; k < x.bit_count()
+    base, width = 0, x.bit_length()
+    while width > 64:
+        half = width // 2
+        low = x & ((1 << half) - 1)
+        c = low.bit_count()
+        if k < c:
+            x, width = low, half
+        else:
+            k -= c
+            x >>= half
+            base += half
+            width -= half
+    for _ in range(k):
+        x &= x - 1
+    return base + (x & -x).bit_length() - 1
+
+
+def permute(i: int, n: int, seed: int) -> int:
+    # биекция [0, n) → [0, n): Фейстель над областью 4^h ≥ n с «прогулкой по циклу»
+    h = max(1, ((n - 1).bit_length() + 1) // 2)
+    mask = (1 << h) - 1
+    while True:
+        left, right = i >> h, i & mask
+        for rnd in range(_ROUNDS):
+            left, right = right, left ^ (hash((seed, rnd, right)) & mask)
+        i = (left << h) | right
+        if i < n:
+            return i
+
+
+class CompletionIndex:
+    __slots__ = ("total", "bits", "counts", "both", "both_count", "walks")
+
+    def __init__(self, total: int, completed_by_user: Dict[str, List[int]], roles: Dict[str, Any]):
+        self.total = total
+        self.bits: Dict[int, int] = {}
+        self.counts: Dict[int, int] = {}
+        self.walks: Dict[int, Tuple[int, int]] = {}
+        for uid, qnums in completed_by_user.items():
+            b = 0
+            for q in qnums:
+                if 1 <= q <= total:
+                    b |= 1 << q
+            self.bits[int(uid)] = b
+            self.counts[int(uid)] = b.bit_count()
+        a, b = roles.get("A"), roles.get("B")
+        self.both = self.bits.get(a, 0) & self.bits.get(b, 0) if a and b else 0
+        self.both_count = self.both.bit_count()
+
+    def is_completed(self, user_id: int, qnum: int) -> bool:
+        return qnum > 0 and bool(self.bits.get(user_id, 0) >> qnum & 1)
+
+    def count(self, user_id: int) -> int:
+        return self.counts.get(user_id, 0)
+
+    def is_closed(self, qnum: int) -> bool:
+        return qnum > 0 and bool(self.both >> qnum & 1)
+
+    def closed_numbers(self, limit: Optional[int] = None) -> List[int]:
+        # по возрастанию; limit — только первые limit номеров
+        result = []
+        b = self.both
+        while b and (limit is None or len(result) < limit):
+            low = b & -b
+            result.append(low.bit_length() - 1)
+            b ^= low
+        return result
+
+    def mark(self, user_id: int, qnum: int, other_id: Optional[int]) -> bool:
+        bit = 1 << qnum
+        cur = self.bits.get(user_id, 0)
+        if cur & bit:
+            return False
+        self.bits[user_id] = cur | bit
+        self.counts[user_id] = self.counts.get(user_id, 0) + 1
+        if other_id and self.bits.get(other_id, 0) & bit:
+            self.both |= bit
+            self.both_count += 1
+        return True
+
+    def sample(self, user_id: int, exclude: Optional[int] = None) -> Optional[int]:
+        done = self.bits.get(user_id, 0)
+        free = self.total - self.counts.get(user_id, 0)
+        if exclude and not done >> exclude & 1:
+            free -= 1
+        if free <= 0:
+            return None
+        if free * _DENSE < self.total:
+            left = ~done & ((2 << self.total) - 2)
+            if exclude:
+                left &= ~(1 << exclude)
+            return nth_bit(left, random.randrange(free))
+        seed, cursor = self.walks.get(user_id) or (random.getrandbits(32), 0)
+        while True:
+            if cursor >= self.total:
+                # цикл пройден, а свободные номера остались (их пропускали) — новая перестановка
+                seed, cursor = random.getrandbits(32), 0
+            qnum = permute(cursor, self.total, seed) + 1
+            cursor += 1
+            if not done >> qnum & 1 and qnum != exclude:
+                self.walks[user_id] = (seed, cursor)
+                return qnum
+
+
+# ---------- КЭШ ПО ПАРАМ ----------
+# Индекс строится лениво из completed_by_user и дальше обновляется инкрементально.
+# Запись хранит сам словарь пары: если состояние перечитали, индекс пересоберётся.
+_INDEX: Dict[str, Tuple[Dict[str, Any], CompletionIndex]] = {}
+
+
+def index_for(pair: Dict[str, Any], total: int) -> CompletionIndex:
+    entry = _INDEX.get(pair["id"])
+    if entry is None or entry[0] is not pair or entry[1].total != total:
+        idx = CompletionIndex(total, pair.get("completed_by_user", {}), pair["roles"])
+        _INDEX[pair["id"]] = (pair, idx)
+        return idx
+    return entry[1]
+
+
+def forget(pair: Dict[str, Any]) -> None:
+    _INDEX.pop(pair["id"], None)
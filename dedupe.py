@@ -0,0 +1,98 @@
+# dedupe.py — окно недавно виденных ключей: повторы апдейтов и заданий отбрасываются за O(1)
+# - Ключ — update_id апдейта, id нажатия кнопки (callback query) или id выполненного задания outbox.
+# - Окно живёт в состоянии (root["dedupe"]): кольцевой буфер фиксированного размера
+#   {"size", "n", "ring"} — n-й ключ ложится в ячейку n % size и вытесняет самый старый.
+#   Рядом в памяти — множество тех же ключей для проверки за O(1) (как битовые карты в
+#   completions.py, оно не сохраняется и собирается из кольца при старте).
+# - Апдейт сначала только занимает свои ключи (claim, в памяти): его копия, пришедшая, пока он
+#   обрабатывается, уже отбрасывается. Операцией хранилища «seen» ключ записывается (commit)
+#   после обработчика, то есть позже всех изменений от апдейта: отметка не попадёт на диск раньше
+#   них. Если процесс упал посреди обработки, отметки на диске нет и повтор апдейта будет
+#   обработан заново — апдейт не теряется, даже если часть его изменений уже записана.
+
+from typing import Dict, Any, List, Optional, Callable, Iterable
+
+DEFAULT_SIZE = 10_000
+
+
+def new_window(size: int = DEFAULT_SIZE) -> Dict[str, Any]:
+    return {"size": size, "n": 0, "ring": []}
+
+
+def ring_push(window: Dict[str, Any], key: str) -> Optional[str]:
+    # кладёт ключ в кольцо; возвращает вытесненный ключ (или None, пока кольцо не заполнено)
+    ring, n = window["ring"], window["n"]
+    window["n"] = n + 1
+    if len(ring) < window["size"]:
+        ring.append(key)
+        return None
+    slot = n % window["size"]
+    evicted, ring[slot] = ring[slot], key
+    return evicted
+
+
+def ordered(window: Dict[str, Any]) -> List[str]:
+    # ключи от старого к новому
+    ring = window["ring"]
+    if len(ring) < window["size"]:
+        return list(ring)
+    pos = window["n"] % window["size"]
+    return ring[pos:] + ring[:pos]
+
+
+def build(keys: Iterable[str], size: int) -> Dict[str, Any]:
+    # окно из ключей по порядку: остаются последние size
+    window = new_window(size)
+    for key in keys:
+        ring_push(window, key)
+    return window
+
+
+def resize(window: Optional[Dict[str, Any]], size: int) -> Dict[str, Any]:
+    if window is None:
+        return new_window(size)
+    if window["size"] == size:
+        return window
+    return build(ordered(window)[-size:], size)
+
+
+class DedupeWindow:
+    def __init__(self, window: Dict[str, Any], save: Callable[..., None]):
+        self.window = window          # хранится в состоянии (root["dedupe"])
+        self.save = save              # save(op, window, key) — запись через хранилище
+        self.keys = set(window["ring"])
+        self.claimed: set = set()     # апдейты в обработке: ещё не записаны, но повторы уже отбрасываются
+        self.duplicates = 0
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.keys or key in self.claimed
+
+    def claim(self, key: str) -> bool:
+        # True — ключ новый и занят до commit/release; False — повтор
+        if key in self:
+            self.duplicates += 1
+            return False
+        self.claimed.add(key)
+        return True
+
+    def commit(self, key: str) -> None:
+        self.claimed.discard(key)
+        self.add(key)
+
+    def release(self, key: str) -> None:
+        self.claimed.discard(key)
+
+    def add(self, key: str) -> bool:
+        # True — ключ новый и запомнен; False — повтор
+        if key in self.keys:
+            self.duplicates += 1
+            return False
+        evicted = ring_push(self.window, key)
+        if evicted is not None:
+            self.keys.discard(evicted)
+        self.keys.add(key)
+        self.save("seen", self.window, key)
+        return True
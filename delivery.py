@@ -0,0 +1,274 @@
+# delivery.py — доставка ответов B → A через постоянную очередь (outbox)
+# - Задание (job) — упорядоченный список элементов для одного чата; оно сохраняется вместе с состоянием
+#   до отправки, поэтому «Передать ответ» возвращается сразу, а после перезапуска доставка продолжится.
+# - Подряд идущие черновики с message_id копируются одним copy_messages (до 100 за раз),
+#   подряд идущие аудио без message_id — одним send_media_group (до 10), остальное — по одному.
+#   copy_messages молча пропускает удалённые и некопируемые сообщения: если копий меньше, чем
+#   сообщений, какие пропущены — не узнать (возвращаются id новых сообщений), поэтому частичные
+#   копии удаляются и пакет уходит поштучно по file_id / тексту.
+# - Порядок внутри чата сохраняется (одна очередь на чат), разные чаты доставляются параллельно.
+# - Лимиты Telegram соблюдаются ведром токенов: общее на бота и отдельное на каждый чат.
+# - Временные ошибки повторяются с экспоненциальной паузой, RetryAfter выжидается.
+# - id задания — ключ идемпотентности: задание с тем же id не ставится повторно, ни пока оно
+#   в очереди, ни после доставки (выполненные id помнит окно повторов, см. dedupe.py).
+# - on_done(job) вызывается, когда задание снято с очереди (доставлено или брошено): так бот
+#   закрывает фазу «delivering» пары (phases.py).
+
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from typing import Dict, Any, List, Callable, Deque, Optional
+
+from telegram import InputMediaAudio
+from telegram.error import RetryAfter, Forbidden, BadRequest, TelegramError
+
+COPY_BATCH = 100        # лимит copy_messages
+MEDIA_GROUP_BATCH = 10  # лимит send_media_group
+
+
+class PartialCopy(TelegramError):
+    # copy_messages скопировал не всё: пакет досылается поштучно
+    pass
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, cost: float = 1.0) -> bool:
+        self._refill()
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return True
+        return False
+
+    async def acquire(self, cost: float = 1.0) -> None:
+        while not self.try_acquire(cost):
+            await asyncio.sleep((cost - self.tokens) / self.rate)
+
+    def full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.burst
+
+
+class RateLimiter:
+    # общий лимит на бота + лимит на чат; корзины простаивающих чатов вытесняются
+    def __init__(self, global_rate: float = 30.0, chat_rate: float = 1.0, chat_burst: float = 3.0,
+                 max_chats: int = 10_000):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_chats = max_chats
+        self.chats: "OrderedDict[int, TokenBucket]" = OrderedDict()
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chats.get(chat_id)
+        if bucket is None:
+            if len(self.chats) >= self.max_chats:
+                oldest, old_bucket = next(iter(self.chats.items()))
+                if old_bucket.full():
+                    self.chats.popitem(last=False)
+            bucket = self.chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        else:
+            self.chats.move_to_end(chat_id)
+        return bucket
+
+    async def acquire(self, chat_id: int) -> None:
+        await self._chat_bucket(chat_id).acquire()
+        await self.global_bucket.acquire()
+
+
+def plan_chunks(items: List[Dict[str, Any]], pos: int) -> List[Dict[str, Any]]:
+    # разбивает хвост задания на вызовы API, не меняя порядок
+    chunks = []
+    i = pos
+    while i < len(items):
+        item = items[i]
+        if item.get("message_id"):
+            j = i + 1
+            while (j < len(items) and j - i < COPY_BATCH and items[j].get("message_id")
+                   and items[j].get("from_user") == item.get("from_user")
+                   and items[j]["message_id"] > items[j - 1]["message_id"]):
+                j += 1
+            chunks.append({"kind": "copy", "start": i, "end": j})
+        elif item["type"] == "audio":
+            j = i + 1
+            while (j < len(items) and j - i < MEDIA_GROUP_BATCH and items[j]["type"] == "audio"
+                   and not items[j].get("message_id")):
+                j += 1
+            chunks.append({"kind": "media_group" if j - i > 1 else "single", "start": i, "end": j})
+        else:
+            j = i + 1
+            chunks.append({"kind": "single", "start": i, "end": j})
+        i = j
+    return chunks
+
+
+class Outbox:
+    def __init__(self, jobs: Dict[str, Dict[str, Any]], save: Callable[..., None],
+                 limiter: Optional[RateLimiter] = None, max_backoff: float = 60.0,
+                 reply_markup: Optional[Callable[[Dict[str, Any]], Any]] = None, done=None,
+                 on_done: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.jobs = jobs              # job_id → job, хранится в состоянии (root["outbox"])
+        self.save = save              # save(op, job) — запись через хранилище
+        self.done = done              # DedupeWindow выполненных заданий или None
+        self.on_done = on_done
+        self.limiter = limiter or RateLimiter()
+        self.max_backoff = max_backoff
+        self.reply_markup = reply_markup or (lambda item: None)
+        self.bot = None
+        self.queues: Dict[int, Deque[str]] = {}
+        self.workers: Dict[int, asyncio.Task] = {}
+        self.api_calls = 0
+        self.skipped = 0
+
+    # ---------- постановка в очередь ----------
+    def start(self, bot) -> None:
+        self.bot = bot
+        for job_id in sorted(self.jobs, key=lambda k: self.jobs[k]["created"]):
+            self._enqueue(self.jobs[job_id])
+
+    def submit(self, job: Dict[str, Any]) -> bool:
+        # False — задание с этим id уже поставлено или выполнено
+        if job["id"] in self.jobs or (self.done is not None and f"o{job['id']}" in self.done):
+            self.skipped += 1
+            return False
+        job.setdefault("pos", 0)
+        job.setdefault("created", time.time())
+        self.jobs[job["id"]] = job
+        self.save("outbox_put", job)
+        if self.bot is not None:
+            self._enqueue(job)
+        return True
+
+    def _enqueue(self, job: Dict[str, Any]) -> None:
+        chat_id = job["chat_id"]
+        self.queues.setdefault(chat_id, deque()).append(job["id"])
+        if chat_id not in self.workers:
+            self.workers[chat_id] = asyncio.create_task(self._drain(chat_id))
+
+    async def _drain(self, chat_id: int) -> None:
+        queue = self.queues[chat_id]
+        try:
+            while queue:
+                job = self.jobs.get(queue[0])
+                if job is not None:
+                    await self._deliver(job)
+                    self.jobs.pop(job["id"], None)
+                    self.save("outbox_done", job)
+                    if self.done is not None:
+                        self.done.add(f"o{job['id']}")
+                    if self.on_done is not None:
+                        self.on_done(job)
+                queue.popleft()
+        finally:
+            self.workers.pop(chat_id, None)
+            if not queue:
+                self.queues.pop(chat_id, None)
+
+    async def idle(self) -> None:
+        while self.workers:
+            await asyncio.gather(*list(self.workers.values()), return_exceptions=True)
+
+    async def stop(self) -> None:
+        # незавершённые задания остаются в outbox и продолжатся после перезапуска
+        for task in list(self.workers.values()):
+            task.cancel()
+        await asyncio.gather(*list(self.workers.values()), return_exceptions=True)
+        self.workers.clear()
+        self.queues.clear()
+
+    # ---------- доставка ----------
+    async def _deliver(self, job: Dict[str, Any]) -> None:
+        items = job["items"]
+        for chunk in plan_chunks(items, job["pos"]):
+            part = items[chunk["start"]:chunk["end"]]
+            ok = await self._with_retry(job, lambda: self._send_chunk(job, chunk["kind"], part))
+            if not ok and chunk["kind"] != "single":
+                # пакет не прошёл (например, исходное сообщение удалено) — шлём поштучно по file_id
+                for item in part:
+                    if job.get("dead"):
+                        break
+                    await self._with_retry(job, lambda item=item: self._send_chunk(job, "single", [item]))
+            job["pos"] = chunk["end"]
+            self.save("outbox_put", job)
+            if job.get("dead"):
+                return
+
+    async def _with_retry(self, job: Dict[str, Any], send) -> bool:
+        attempt = 0
+        while True:
+            try:
+                await send()
+                return True
+            except RetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+            except PartialCopy as e:
+                logging.warning("outbox: job %s: %s, resending one by one", job["id"], e)
+                return False
+            except Forbidden:
+                # получатель заблокировал бота — дальше слать бессмысленно
+                logging.warning("outbox: chat %s forbidden, dropping job %s", job["chat_id"], job["id"])
+                job["dead"] = True
+                return False
+            except BadRequest:
+                logging.exception("outbox: bad request in job %s", job["id"])
+                return False
+            except TelegramError:
+                attempt += 1
+                delay = min(self.max_backoff, 2 ** (attempt - 1))
+                logging.warning("outbox: job %s attempt %s failed, retry in %ss", job["id"], attempt, delay)
+                await asyncio.sleep(delay)
+
+    async def _delete(self, chat_id: int, message_ids: List[int]) -> None:
+        # свои повторы здесь: ошибка удаления не должна повторять уже прошедшее копирование
+        while True:
+            await self.limiter.acquire(chat_id)
+            self.api_calls += 1
+            try:
+                await self.bot.delete_messages(chat_id=chat_id, message_ids=message_ids)
+                return
+            except RetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+            except TelegramError:
+                # не удалились — лучше повтор части ответа, чем потеря остального
+                logging.warning("outbox: chat %s: partial copies not deleted", chat_id, exc_info=True)
+                return
+
+    async def _send_chunk(self, job: Dict[str, Any], kind: str, part: List[Dict[str, Any]]) -> None:
+        chat_id = job["chat_id"]
+        await self.limiter.acquire(chat_id)
+        self.api_calls += 1
+        bot = self.bot
+        if kind == "copy":
+            copies = await bot.copy_messages(chat_id=chat_id, from_chat_id=part[0]["from_user"],
+                                             message_ids=[it["message_id"] for it in part])
+            if len(copies) < len(part):
+                if copies:
+                    await self._delete(chat_id, [m.message_id for m in copies])
+                raise PartialCopy(f"copied {len(copies)} of {len(part)}")
+            return
+        if kind == "media_group":
+            await bot.send_media_group(chat_id=chat_id, media=[
+                InputMediaAudio(media=it["data"]["file_id"], caption=it["data"].get("caption")) for it in part
+            ])
+            return
+        item = part[0]
+        t, data = item["type"], item["data"]
+        if t == "text":
+            await bot.send_message(chat_id=chat_id, text=data["text"], reply_markup=self.reply_markup(item))
+        elif t == "voice":
+            await bot.send_voice(chat_id=chat_id, voice=data["file_id"], caption=data.get("caption"))
+        elif t == "audio":
+            await bot.send_audio(chat_id=chat_id, audio=data["file_id"], caption=data.get("caption"))
+        elif t == "video_note":
+            await bot.send_video_note(chat_id=chat_id, video_note=data["file_id"])
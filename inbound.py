@@ -0,0 +1,174 @@
+# inbound.py — входящий поток: лимиты частоты, ограниченный буфер черновиков и сводные подтверждения
+# - InboundLimiter: ведро токенов на пользователя и на пару (delivery.TokenBucket). Сообщение
+#   принимается, только если токен есть в обоих; отказ возвращает причину и через сколько секунд
+#   токен появится. Корзины простаивающих пользователей и пар вытесняются, как в RateLimiter.
+# - DraftBudget: черновиков у пары не больше max_items и не больше max_bytes (размер, который они
+#   занимают в состоянии). Размер текущего буфера считается один раз и дальше ведётся на добавлениях.
+# - AckBoard: вместо ответа на каждый черновик — одно сообщение «Принято N», которое правится на месте.
+#   Первое подтверждение уходит сразу, следующие изменения собираются и показываются не чаще раза
+#   в delay секунд; пачка из сотни пересланных сообщений — одно сообщение и пара правок.
+
+import json
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Callable, Tuple
+
+from telegram.error import BadRequest, TelegramError
+
+from delivery import TokenBucket
+
+
+class InboundLimiter:
+    def __init__(self, user_rate: float = 2.0, user_burst: float = 30.0, pair_rate: float = 4.0,
+                 pair_burst: float = 60.0, max_keys: int = 100_000):
+        self.user_rate, self.user_burst = user_rate, user_burst
+        self.pair_rate, self.pair_burst = pair_rate, pair_burst
+        self.max_keys = max_keys
+        self.users: "OrderedDict[int, TokenBucket]" = OrderedDict()
+        self.pairs: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self.warned: set = set()      # кому уже сказали «слишком быстро» в текущем всплеске
+
+    def _bucket(self, table: "OrderedDict", key, rate: float, burst: float) -> TokenBucket:
+        bucket = table.get(key)
+        if bucket is None:
+            if len(table) >= self.max_keys and next(iter(table.values())).full():
+                table.popitem(last=False)
+            bucket = table[key] = TokenBucket(rate, burst)
+        else:
+            table.move_to_end(key)
+        return bucket
+
+    def admit(self, user_id: int, pair_id: Optional[str]) -> Optional[Tuple[str, float]]:
+        # None — принято; иначе (причина, через сколько секунд появится токен)
+        user = self._bucket(self.users, user_id, self.user_rate, self.user_burst)
+        if not user.try_acquire():
+            return "rate_user", (1 - user.tokens) / user.rate
+        if pair_id is not None:
+            pair = self._bucket(self.pairs, pair_id, self.pair_rate, self.pair_burst)
+            if not pair.try_acquire():
+                user.tokens = min(user.burst, user.tokens + 1)   # токен пользователя возвращается
+                return "rate_pair", (1 - pair.tokens) / pair.rate
+        self.warned.discard(user_id)
+        return None
+
+    def warn_once(self, user_id: int) -> bool:
+        # True — первый отказ в этом всплеске: стоит ответить; дальше отказы молчаливые
+        if user_id in self.warned:
+            return False
+        self.warned.add(user_id)
+        return True
+
+
+def item_size(item: Dict[str, Any]) -> int:
+    return len(json.dumps(item, ensure_ascii=False, separators=(",", ":")).encode())
+
+
+class DraftBudget:
+    def __init__(self, max_items: int = 100, max_bytes: int = 256 << 10):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._sizes: Dict[str, List[Any]] = {}   # pair_id → [список черновиков, их размер]
+
+    def size(self, pair: Dict[str, Any]) -> int:
+        drafts = pair["draft_answers"]
+        entry = self._sizes.get(pair["id"])
+        if entry is None or entry[0] is not drafts:
+            # новый буфер (вопрос задан, ответ передан) или первый раз после старта
+            entry = self._sizes[pair["id"]] = [drafts, sum(item_size(it) for it in drafts)]
+        return entry[1]
+
+    def refusal(self, pair: Dict[str, Any], item: Dict[str, Any]) -> Optional[str]:
+        if len(pair["draft_answers"]) >= self.max_items:
+            return "draft_items"
+        if self.size(pair) + item_size(item) > self.max_bytes:
+            return "draft_bytes"
+        return None
+
+    def added(self, pair: Dict[str, Any], item: Dict[str, Any]) -> None:
+        entry = self._sizes.get(pair["id"])
+        if entry is not None and entry[0] is pair["draft_answers"]:
+            entry[1] += item_size(item)
+
+    def forget(self, pair_id: str) -> None:
+        self._sizes.pop(pair_id, None)
+
+
+class Ack:
+    __slots__ = ("accepted", "rejected", "message_id", "shown_at", "dirty", "task")
+
+    def __init__(self):
+        self.accepted: Dict[str, int] = {}    # тип черновика → принято
+        self.rejected: Dict[str, int] = {}    # причина → не принято
+        self.message_id: Optional[int] = None
+        self.shown_at = 0.0
+        self.dirty = False
+        self.task: Optional[asyncio.Task] = None
+
+
+class AckBoard:
+    def __init__(self, render: Callable[[Ack], Tuple[str, Any]], delay: float = 1.0, fresh: float = 60.0):
+        self.render = render          # render(ack) → (текст, клавиатура)
+        self.delay = delay            # не чаще одной правки за delay секунд
+        self.fresh = fresh            # сообщение старше — уже далеко в чате, пишем новое
+        self.acks: Dict[int, Ack] = {}
+        self.sent = 0
+        self.edited = 0
+
+    def note(self, bot, chat_id: int, kind: str, rejected: Optional[str] = None) -> None:
+        ack = self.acks.get(chat_id)
+        if ack is None:
+            ack = self.acks[chat_id] = Ack()
+        counts, key = (ack.rejected, rejected) if rejected else (ack.accepted, kind)
+        counts[key] = counts.get(key, 0) + 1
+        ack.dirty = True
+        if ack.task is None:
+            ack.task = asyncio.create_task(self._run(bot, chat_id, ack))
+
+    def reset(self, chat_id: int) -> None:
+        # буфер черновиков закрыт (ответ передан, задан новый вопрос): следующая сводка — с нуля
+        ack = self.acks.pop(chat_id, None)
+        if ack is not None and ack.task is not None:
+            ack.task.cancel()
+
+    async def _run(self, bot, chat_id: int, ack: Ack) -> None:
+        try:
+            if ack.message_id is not None:
+                await asyncio.sleep(self.delay)
+            while ack.dirty:
+                ack.dirty = False
+                await self._show(bot, chat_id, ack)
+                await asyncio.sleep(self.delay)
+        except TelegramError:
+            logging.exception("ack for chat %s failed", chat_id)
+        finally:
+            ack.task = None
+
+    async def _show(self, bot, chat_id: int, ack: Ack) -> None:
+        text, markup = self.render(ack)
+        now = time.monotonic()
+        if ack.message_id is not None and now - ack.shown_at < self.fresh:
+            try:
+                await bot.edit_message_text(text=text, chat_id=chat_id, message_id=ack.message_id,
+                                            reply_markup=markup)
+                self.edited += 1
+                return
+            except BadRequest as e:
+                if "not modified" in str(e).lower():
+                    return
+                # сообщение удалено или слишком старое для правки — пишем новое
+        msg = await bot.send_message(chat_id=chat_id, text=text, reply_markup=markup)
+        ack.message_id, ack.shown_at = msg.message_id, now
+        self.sent += 1
+
+    async def idle(self) -> None:
+        while any(ack.task is not None for ack in self.acks.values()):
+            await asyncio.gather(*[a.task for a in self.acks.values() if a.task is not None], return_exceptions=True)
+
+    async def stop(self) -> None:
+        tasks = [ack.task for ack in self.acks.values() if ack.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.acks.clear()
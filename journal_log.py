@@ -0,0 +1,46 @@
+# journal_log.py — история пары по журналу событий (STORAGE_BACKEND=journal)
+# Запуск: python journal_log.py PAIR_ID [state.journal]
+# Печатает события пары по времени: вопросы, напоминания, черновики, доставленные ответы, обмен ролями, сбросы.
+
+import sys
+import json
+import time
+from pathlib import Path
+
+from storage import journal_events
+from bot import STATE_JOURNAL
+
+
+def describe(ev) -> str:
+    kind = ev["e"]
+    if kind == "question_sent":
+        q = ev.get("q")
+        return f"вопрос №{q['qnum']} от {q['from_user']} для {q['to_user']}" if q else "активный вопрос снят"
+    if kind == "draft_added":
+        item = ev["item"]
+        return f"черновик {item.get('type')}: {json.dumps(item.get('data'), ensure_ascii=False)}"
+    if kind == "reminder_sent":
+        return f"напоминание №{ev['n']}"
+    if kind == "answer_delivered":
+        return f"{ev['u']} получил ответ на №{ev['q']} (банк {ev.get('bank', 'default')})"
+    if kind in ("pair_updated", "roles_swapped"):
+        return f"A={ev['a']} B={ev['b']} банк={ev.get('bank', 'default')}"
+    if kind == "member_joined":
+        return f"вошёл {ev['u']}"
+    return ""
+
+
+def main():
+    if len(sys.argv) < 2:
+        raise SystemExit("Укажите номер пары: python journal_log.py PAIR_ID [state.journal]")
+    pair_id = sys.argv[1]
+    path = Path(sys.argv[2]) if len(sys.argv) > 2 else STATE_JOURNAL
+    for ev in journal_events(path):
+        if ev.get("p") != pair_id:
+            continue
+        ts = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ev.get("t", 0)))
+        print(f"{ts}  {ev['e']:<16} {describe(ev)}")
+
+
+if __name__ == "__main__":
+    main()
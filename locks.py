@@ -0,0 +1,30 @@
+# locks.py — асинхронные блокировки по ключу (пара или пользователь без пары)
+# Апдейты одной пары обрабатываются строго по очереди (asyncio.Lock честный, FIFO),
+# апдейты разных пар — параллельно. Блокировка удаляется, когда её никто не ждёт,
+# поэтому память не растёт с числом пар.
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, List, Any
+
+
+class KeyedLocks:
+    def __init__(self):
+        self._locks: Dict[str, List[Any]] = {}   # key → [Lock, число держащих и ждущих]
+
+    @asynccontextmanager
+    async def hold(self, key: str):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    def __len__(self) -> int:
+        return len(self._locks)
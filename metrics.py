@@ -0,0 +1,227 @@
+# metrics.py — метрики в текстовом формате Prometheus без внешних зависимостей
+# - Counter / Gauge / Histogram с метками; наблюдение — словарь + bisect по границам корзин,
+#   кумулятивные суммы считаются только при выгрузке, поэтому горячий путь почти ничего не стоит.
+# - Gauge может вычисляться при выгрузке (set_function): размер файла состояния, очереди.
+# - timed() оборачивает обработчик PTB: время, число апдейтов по типу, ошибки.
+# - InstrumentedRequest — HTTPXRequest, замеряющий каждый вызов Bot API.
+# - serve() поднимает GET /metrics на локальном порту (aiohttp).
+
+import time
+import logging
+import functools
+from bisect import bisect_left
+from typing import Dict, Any, List, Optional, Tuple, Callable
+
+from telegram.error import NetworkError
+from telegram.request import HTTPXRequest
+
+from callbacks import decode
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[Any, ...]) -> str:
+    if not names:
+        return ""
+    parts = []
+    for n, v in zip(names, values):
+        v = str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{n}="{v}"')
+    return "{" + ",".join(parts) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = labels
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, doc: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, doc, labels)
+        self.values: Dict[Tuple[Any, ...], float] = {}
+
+    def inc(self, *labels, amount: float = 1.0) -> None:
+        self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def get(self, *labels) -> float:
+        return self.values.get(labels, 0.0)
+
+    def expose(self) -> List[str]:
+        return self.header() + [f"{self.name}{_labels(self.labelnames, k)} {v:g}" for k, v in self.values.items()]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, doc: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, doc, labels)
+        self.values: Dict[Tuple[Any, ...], float] = {}
+        self.function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, *labels) -> None:
+        self.values[labels] = value
+
+    def set_function(self, fn: Callable[[], float]) -> None:
+        self.function = fn
+
+    def expose(self) -> List[str]:
+        values = dict(self.values)
+        if self.function is not None:
+            try:
+                values[()] = self.function()
+            except Exception:
+                logging.exception("metrics: gauge %s failed", self.name)
+        return self.header() + [f"{self.name}{_labels(self.labelnames, k)} {v:g}" for k, v in values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labels: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(buckets)
+        self.series: Dict[Tuple[Any, ...], List[float]] = {}   # [корзины..., +Inf, сумма]
+
+    def observe(self, value: float, *labels) -> None:
+        s = self.series.get(labels)
+        if s is None:
+            s = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        s[bisect_left(self.buckets, value)] += 1
+        s[-1] += value
+
+    def count(self, *labels) -> int:
+        s = self.series.get(labels)
+        return sum(s[:-1]) if s else 0
+
+    def expose(self) -> List[str]:
+        lines = self.header()
+        for key, s in self.series.items():
+            acc = 0
+            for bound, n in zip(self.buckets + (float("inf"),), s[:-1]):
+                acc += n
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames + ('le',), key + (le,))} {acc}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {s[-1]:.6f}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {acc}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def expose(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics.values():
+            lines += metric.expose()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+HANDLER_SECONDS = REGISTRY.register(Histogram("bot_handler_seconds", "Handler latency", ("handler",)))
+HANDLER_ERRORS = REGISTRY.register(Counter("bot_handler_errors_total", "Handler exceptions", ("handler",)))
+UPDATES = REGISTRY.register(Counter("bot_updates_total", "Updates by type", ("type",)))
+STATE_CALLS = REGISTRY.register(Counter("bot_state_calls_total", "load_state/save_state calls", ("op",)))
+STATE_SECONDS = REGISTRY.register(Histogram("bot_state_seconds", "load_state/save_state and flush duration", ("op",)))
+STATE_BYTES = REGISTRY.register(Gauge("bot_state_file_bytes", "State file size"))
+API_SECONDS = REGISTRY.register(Histogram("bot_api_seconds", "Bot API call latency", ("method",)))
+API_ERRORS = REGISTRY.register(Counter("bot_api_errors_total", "Bot API errors", ("method", "code")))
+DRAFTS = REGISTRY.register(Gauge("bot_drafts_pending", "Draft answers waiting for «Передать ответ»"))
+OUTBOX = REGISTRY.register(Gauge("bot_outbox_jobs", "Undelivered outbox jobs"))
+REMINDERS = REGISTRY.register(Counter("bot_reminders_total", "Reminders sent by escalation step", ("step",)))
+REMINDERS_SCHEDULED = REGISTRY.register(Gauge("bot_reminders_scheduled", "Pending questions with a reminder due"))
+DUPLICATES = REGISTRY.register(Counter("bot_duplicate_updates_total", "Repeated updates dropped before handlers",
+                                       ("kind",)))
+INBOUND_REJECTED = REGISTRY.register(Counter("bot_inbound_rejected_total",
+                                             "Inbound messages and drafts not accepted", ("reason",)))
+
+
+# ---------- ОБРАБОТЧИКИ ----------
+def update_type(update) -> str:
+    q = getattr(update, "callback_query", None)
+    if q is not None:
+        # метка — имя действия (callbacks.py), одна и та же для нового и старого формата кнопки
+        decoded = decode(q.data or "")
+        return "callback:" + (decoded[0].name if decoded else "other")
+    msg = getattr(update, "message", None)
+    if msg is None:
+        return "other"
+    for kind in ("voice", "audio", "video_note"):
+        if getattr(msg, kind, None):
+            return kind
+    text = msg.text or ""
+    if text.startswith("/"):
+        return "command:" + text[1:].split()[0].split("@")[0][:32] if len(text) > 1 else "command"
+    return "text" if text else "other"
+
+
+def timed(handler):
+    name = getattr(handler, "__name__", "handler")
+
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        UPDATES.inc(update_type(update))
+        t0 = time.perf_counter()
+        try:
+            return await handler(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - t0, name)
+    return wrapper
+
+
+def instrument_handlers(app) -> None:
+    # оборачивает все уже зарегистрированные обработчики приложения
+    for handlers in app.handlers.values():
+        for h in handlers:
+            h.callback = timed(h.callback)
+
+
+# ---------- BOT API ----------
+class InstrumentedRequest(HTTPXRequest):
+    async def do_request(self, url: str, method: str, request_data=None, **kwargs) -> Tuple[int, bytes]:
+        endpoint = url.rsplit("/", 1)[-1]
+        t0 = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, request_data, **kwargs)
+        except NetworkError as e:
+            API_ERRORS.inc(endpoint, type(e).__name__)
+            raise
+        finally:
+            API_SECONDS.observe(time.perf_counter() - t0, endpoint)
+        if code >= 400:
+            API_ERRORS.inc(endpoint, str(code))
+        return code, payload
+
+
+# ---------- HTTP ----------
+async def serve(host: str, port: int):
+    from aiohttp import web
+
+    async def on_metrics(request: web.Request) -> web.Response:
+        return web.Response(body=REGISTRY.expose().encode("utf-8"),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    web_app = web.Application()
+    web_app.router.add_get("/metrics", on_metrics)
+    runner = web.AppRunner(web_app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logging.info("Метрики: http://%s:%s/metrics", host, port)
+    return runner
@@ -0,0 +1,28 @@
+# migrate_state.py — разовый перенос state.json в SQLite-хранилище
+# Запуск: python migrate_state.py [state.json] [state.db], затем STORAGE_BACKEND=sqlite python bot.py
+
+import sys
+import json
+from pathlib import Path
+
+from storage import SqliteBackend
+from bot import upgrade_state, STATE_FILE, STATE_DB
+
+
+def migrate(json_path: Path, db_path: Path) -> int:
+    root = upgrade_state(json.loads(json_path.read_text(encoding="utf-8")))
+    backend = SqliteBackend(db_path)
+    try:
+        if backend.read() is not None:
+            raise SystemExit(f"{db_path} уже содержит данные — миграция не нужна.")
+        backend.import_state(root)
+    finally:
+        backend.close()
+    return len(root["pairs"])
+
+
+if __name__ == "__main__":
+    src = Path(sys.argv[1]) if len(sys.argv) > 1 else STATE_FILE
+    dst = Path(sys.argv[2]) if len(sys.argv) > 2 else STATE_DB
+    n = migrate(src, dst)
+    print(f"Перенесено пар: {n} ({src} → {dst})")
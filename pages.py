@@ -0,0 +1,94 @@
+# pages.py — готовые страницы списка вопросов для «Посмотреть список вопросов» и ◀️/▶️
+# - Текст и клавиатура страницы собираются один раз на (банк, страница) и дальше отдаются из кэша.
+#   Перечитанный банк получает новую версию (question_bank.py) — его страницы выбрасываются.
+# - Отметки «закрыт» берутся из битовых карт completions.py: из карты вырезается окно страницы
+#   (сдвиг и маска), поэтому отрисовка не проходит по всему банку. Текст с отметками кэшируется
+#   по этому окну: у разных пользователей с одинаковыми закрытиями на странице он общий.
+# - Кнопки ◀️/▶️ несут номер страницы и имя банка (callbacks.py): список, открытый до смены банка,
+#   листается по своему банку.
+
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from callbacks import encode
+from question_bank import QuestionBank
+
+MARK_BOTH = "✅"   # оба получили ответ
+MARK_MINE = "☑️"   # ответ получил тот, кто смотрит список
+LEGEND = f"{MARK_BOTH} — закрыт полностью, {MARK_MINE} — ты уже получил ответ"
+
+
+class QuestionPages:
+    def __init__(self, per_page: int, max_variants: int = 4096):
+        self.per_page = per_page
+        self.max_variants = max_variants
+        self._versions: Dict[str, int] = {}
+        self._pages: Dict[Tuple[str, int], Tuple[Tuple[str, ...], str, str, InlineKeyboardMarkup]] = {}
+        self._variants: "OrderedDict[Tuple[str, int, int, int], str]" = OrderedDict()
+
+    def _check(self, bank: QuestionBank) -> None:
+        if self._versions.get(bank.name) == bank.version:
+            return
+        self._versions[bank.name] = bank.version
+        self._pages = {k: v for k, v in self._pages.items() if k[0] != bank.name}
+        for key in [k for k in self._variants if k[0] == bank.name]:
+            del self._variants[key]
+
+    def clamp(self, bank: QuestionBank, page: int) -> int:
+        last = max(0, (len(bank) - 1) // self.per_page)
+        return min(max(page, 0), last)
+
+    @staticmethod
+    def _page_data(bank: QuestionBank, page: int) -> str:
+        try:
+            return encode("qpage", page, bank.name)
+        except ValueError:
+            # имя банка не влезает в 64 байта — кнопка листает текущий банк пары
+            return encode("qpage", page)
+
+    def _build(self, bank: QuestionBank, page: int) -> Tuple[Tuple[str, ...], str, InlineKeyboardMarkup]:
+        start = page * self.per_page
+        end = min(start + self.per_page, len(bank))
+        lines = tuple(f"{i}. {text}" for i, text in enumerate(bank.page(start, end), start + 1))
+        title = "📋 Список вопросов:" if bank.name == "default" else f"📋 Список вопросов («{bank.name}»):"
+        buttons = []
+        if page > 0:
+            buttons.append(InlineKeyboardButton("◀️", callback_data=self._page_data(bank, page - 1)))
+        if end < len(bank):
+            buttons.append(InlineKeyboardButton("▶️", callback_data=self._page_data(bank, page + 1)))
+        kb = InlineKeyboardMarkup([
+            buttons,
+            [InlineKeyboardButton("⬅️ В меню", callback_data=encode("back_to_menu"))]
+        ])
+        return lines, title, kb
+
+    def render(self, bank: QuestionBank, page: int, mine: int = 0, both: int = 0) -> Tuple[str, InlineKeyboardMarkup]:
+        # mine/both — битовые карты CompletionIndex (бит q — вопрос №q)
+        self._check(bank)
+        page = self.clamp(bank, page)
+        entry = self._pages.get((bank.name, page))
+        if entry is None:
+            lines, title, kb = self._build(bank, page)
+            entry = self._pages[(bank.name, page)] = (lines, title, title + "\n\n" + "\n".join(lines), kb)
+        lines, title, plain, kb = entry
+        window = (1 << len(lines)) - 1
+        shift = page * self.per_page + 1
+        mine_w, both_w = mine >> shift & window, both >> shift & window
+        if not mine_w and not both_w:
+            return plain, kb
+        key = (bank.name, page, mine_w, both_w)
+        text = self._variants.get(key)
+        if text is None:
+            marked = [
+                f"{MARK_BOTH} {line}" if both_w >> i & 1 else f"{MARK_MINE} {line}" if mine_w >> i & 1 else line
+                for i, line in enumerate(lines)
+            ]
+            text = title + "\n\n" + "\n".join(marked) + "\n\n" + LEGEND
+            self._variants[key] = text
+            if len(self._variants) > self.max_variants:
+                self._variants.popitem(last=False)
+        else:
+            self._variants.move_to_end(key)
+        return text, kb
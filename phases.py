@@ -0,0 +1,83 @@
+# phases.py — явная машина состояний пары: idle → awaiting_qnum → pending → delivering → idle
+# - idle           — вопроса нет, A может спросить.
+# - awaiting_qnum  — A нажал «Запросить конкретный вопрос», следующий его текст — номер вопроса.
+#                    Раньше это был флаг в context.user_data: он терялся при перезапуске и жил
+#                    только в одном процессе; теперь фаза хранится в состоянии пары (операция «phase»).
+# - pending        — вопрос задан, B собирает черновики ответа.
+# - delivering     — B нажал «Передать ответ», ответы идут A через outbox; фаза закрывается,
+#                    когда задание доставлено (и после перезапуска тоже — задание переживает его).
+#                    Новый вопрос можно задать, не дожидаясь доставки; поэтому пара помнит id задания
+#                    своего раунда (pair["delivery"], пишется вместе с фазой), и доставка задания
+#                    прошлого раунда не закрывает delivering следующего.
+# - Переходы — таблица (фаза, событие) → фаза: всё, чего в ней нет, — ошибка, а не тихая порча состояния.
+#   Условия входа в фазу (спрашивает A, B в паре, вопроса нет) проверяются один раз — при переходе;
+#   дальше их гарантирует сама фаза.
+
+from typing import Dict, Any, Callable
+
+IDLE = "idle"
+AWAITING_QNUM = "awaiting_qnum"
+PENDING = "pending"
+DELIVERING = "delivering"
+PHASES = (IDLE, AWAITING_QNUM, PENDING, DELIVERING)
+
+TRANSITIONS: Dict[tuple, str] = {
+    (IDLE, "ask_specific"): AWAITING_QNUM,
+    (AWAITING_QNUM, "ask_specific"): AWAITING_QNUM,
+    (DELIVERING, "ask_specific"): AWAITING_QNUM,
+    (IDLE, "ask"): PENDING,
+    (AWAITING_QNUM, "ask"): PENDING,
+    (DELIVERING, "ask"): PENDING,
+    (AWAITING_QNUM, "cancel"): IDLE,
+    (PENDING, "answer"): DELIVERING,
+    (DELIVERING, "delivered"): IDLE,
+}
+
+
+class PhaseError(RuntimeError):
+    pass
+
+
+def phase_of(pair: Dict[str, Any]) -> str:
+    return pair.get("phase") or (PENDING if pair.get("pending") else IDLE)
+
+
+def allows(pair: Dict[str, Any], event: str) -> bool:
+    return (phase_of(pair), event) in TRANSITIONS
+
+
+def advance(pair: Dict[str, Any], event: str, save: Callable[..., None]) -> str:
+    # save(op, pair) — запись через хранилище; повторный вход в ту же фазу не пишется
+    phase = phase_of(pair)
+    new = TRANSITIONS.get((phase, event))
+    if new is None:
+        raise PhaseError(f"pair {pair['id']}: {event} is not allowed in phase {phase}")
+    if new != pair.get("phase"):
+        pair["phase"] = new
+        save("phase", pair)
+    return new
+
+
+def deliver(pair: Dict[str, Any], job_id: str, save: Callable[..., None]) -> str:
+    # «Передать ответ»: пара ждёт доставки задания job_id
+    pair["delivery"] = job_id
+    return advance(pair, "answer", save)
+
+
+def delivered(pair: Dict[str, Any], job_id: str, save: Callable[..., None]) -> bool:
+    # задание job_id снято с очереди; фаза закрывается, только если это задание текущего раунда
+    # (None — пара ушла в delivering до того, как id стал записываться)
+    if phase_of(pair) != DELIVERING or pair.get("delivery") not in (None, job_id):
+        return False
+    pair["delivery"] = None
+    advance(pair, "delivered", save)
+    return True
+
+
+def repair(pair: Dict[str, Any]) -> None:
+    # состояние до появления фаз (или с фазой, разошедшейся с pending) приводится к согласованному
+    phase = pair.get("phase")
+    if pair.get("pending"):
+        pair["phase"] = PENDING
+    elif phase not in PHASES or phase == PENDING:
+        pair["phase"] = IDLE
@@ -0,0 +1,174 @@
+# question_bank.py — банки вопросов произвольного размера: индекс смещений и чтение строк по запросу
+# - При открытии файл один раз читается кусками и строится только индекс смещений непустых строк
+#   (array); сами строки читаются по запросу (os.pread через открытый дескриптор), поэтому банк
+#   на 100k+ строк не материализуется в памяти.
+# - Файл не отображается в память: его правят на месте, а чтение mmap за новым концом файла
+#   роняет процесс (SIGBUS). pread за концом просто вернёт меньше байт; перед чтением размер
+#   и mtime дескриптора сверяются с индексом, и при расхождении индекс перестраивается сразу.
+# - Изменение файла (mtime/размер) замечается при обращении не чаще раза в reload_interval
+#   секунд, индекс перестраивается без перезапуска бота.
+# - Реестр банков: «default» — основной файл вопросов, остальные — *.txt из каталога банков.
+# - Индекс смещений можно сохранить (export) и подать следующему запуску: если файл тот же
+#   (mtime/размер), проход по нему не нужен (образ быстрого старта, startup.py).
+
+import os
+import re
+import time
+import logging
+from array import array
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+_LINE_RE = re.compile(rb"[^\n]*\S[^\n]*")
+_CHUNK = 1 << 20
+
+
+def _scan(fd: int, size: int, starts: array, ends: array) -> None:
+    # пустые и пробельные строки пропускаем, как раньше; строка на границе куска переносится в следующий
+    pos, tail = 0, b""
+    while pos < size:
+        chunk = os.pread(fd, min(_CHUNK, size - pos), pos)
+        if not chunk:
+            break
+        base = pos - len(tail)
+        buf, pos = tail + chunk, pos + len(chunk)
+        cut = buf.rfind(b"\n") + 1 if pos < size else len(buf)
+        for m in _LINE_RE.finditer(buf, 0, cut):
+            starts.append(base + m.start())
+            ends.append(base + m.end())
+        tail = buf[cut:]
+    if tail:
+        for m in _LINE_RE.finditer(tail):
+            starts.append(pos - len(tail) + m.start())
+            ends.append(pos - len(tail) + m.end())
+
+
+class QuestionBank:
+    def __init__(self, name: str, path: Path, placeholder_size: int = 0, reload_interval: float = 5.0,
+                 index: Optional[Tuple] = None):
+        self.name = name
+        self.path = path
+        self.placeholder_size = placeholder_size   # если файла нет — «Вопрос №N» такого количества
+        self.reload_interval = reload_interval
+        self.version = 0
+        self._fd: Optional[int] = None
+        self._starts = array("Q")
+        self._ends = array("Q")
+        self._stat: Optional[Tuple[int, int]] = None
+        self._checked = time.monotonic()
+        self._load(index)
+
+    # ---------- индекс ----------
+    def _file_stat(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _load(self, index: Optional[Tuple] = None) -> None:
+        starts, ends = array("Q"), array("Q")
+        fd, stat = None, None
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+        except FileNotFoundError:
+            pass
+        if fd is not None:
+            st = os.fstat(fd)
+            stat = st.st_mtime_ns, st.st_size
+            if not stat[1]:
+                os.close(fd)
+                fd = None
+            elif index is not None and tuple(index[0]) == stat:
+                starts.frombytes(index[1])
+                ends.frombytes(index[2])
+            else:
+                _scan(fd, stat[1], starts, ends)
+        old = self._fd
+        self._fd, self._starts, self._ends, self._stat = fd, starts, ends, stat
+        self.version += 1
+        if old is not None:
+            os.close(old)
+
+    def maybe_reload(self) -> bool:
+        now = time.monotonic()
+        if now - self._checked < self.reload_interval:
+            return False
+        self._checked = now
+        if self._file_stat() == self._stat:
+            return False
+        self._load()
+        logging.info("Банк вопросов «%s» перечитан: %s вопросов", self.name, len(self))
+        return True
+
+    # ---------- доступ ----------
+    def _current(self) -> bool:
+        # файл переписали на месте (тот же дескриптор, другие размер или mtime) — индекс устарел
+        st = os.fstat(self._fd)
+        if (st.st_mtime_ns, st.st_size) == self._stat:
+            return True
+        self._load()
+        logging.info("Банк вопросов «%s» изменён на месте, перечитан: %s вопросов", self.name, len(self))
+        return self._fd is not None
+
+    def __len__(self) -> int:
+        return len(self._starts) if self._fd is not None else self.placeholder_size
+
+    def get(self, qnum: int) -> str:
+        # qnum — номер с единицы
+        if self._fd is None or not self._current() or not 1 <= qnum <= len(self._starts):
+            return f"Вопрос №{qnum}"
+        start = self._starts[qnum - 1]
+        return os.pread(self._fd, self._ends[qnum - 1] - start, start).decode("utf-8", "replace").strip()
+
+    def page(self, start: int, end: int) -> List[str]:
+        return [self.get(i) for i in range(start + 1, end + 1)]
+
+    def export_index(self) -> Optional[Tuple]:
+        # (mtime_ns и размер файла, смещения начал, смещения концов) — для образа быстрого старта
+        if self._fd is None:
+            return None
+        return self._stat, self._starts.tobytes(), self._ends.tobytes()
+
+
+class BankRegistry:
+    def __init__(self, default_path: Path, banks_dir: Optional[Path], placeholder_size: int,
+                 reload_interval: float = 5.0):
+        self.default_path = default_path
+        self.banks_dir = banks_dir
+        self.placeholder_size = placeholder_size
+        self.reload_interval = reload_interval
+        self.indexes: Dict[str, Tuple] = {}       # путь → export_index() из образа, для ещё не открытых банков
+        self._banks: Dict[str, QuestionBank] = {}
+
+    def names(self) -> List[str]:
+        names = ["default"]
+        if self.banks_dir and self.banks_dir.is_dir():
+            names += sorted(p.stem for p in self.banks_dir.glob("*.txt") if p.stem != "default")
+        return names
+
+    def exists(self, name: str) -> bool:
+        # только имена из каталога: произвольный путь в имени не пройдёт
+        return name in self.names()
+
+    def get(self, name: str = "default") -> QuestionBank:
+        bank = self._banks.get(name)
+        if bank is None:
+            if name == "default" or not self.exists(name):
+                path, placeholder, name = self.default_path, self.placeholder_size, "default"
+                bank = self._banks.get(name)
+            else:
+                path, placeholder = self.banks_dir / f"{name}.txt", 0
+            if bank is None:
+                bank = self._banks[name] = QuestionBank(name, path, placeholder, self.reload_interval,
+                                                        self.indexes.pop(str(path), None))
+        bank.maybe_reload()
+        return bank
+
+    def export(self) -> Dict[str, Tuple]:
+        indexes = dict(self.indexes)
+        for bank in self._banks.values():
+            index = bank.export_index()
+            if index is not None:
+                indexes[str(bank.path)] = index
+        return indexes
@@ -0,0 +1,156 @@
+# reminders.py — автоматические напоминания о вопросах, на которые ещё не ответили
+# - Один планировщик на бота: куча (heapq) сроков и одна задача, которая спит до ближайшего срока.
+#   100k ожидающих вопросов — это 100k записей в куче и одно пробуждение на срок, без опроса пар.
+# - Перенос и отмена ленивые: актуальный срок ключа хранится в словаре, устаревшие записи кучи
+#   пропускаются при извлечении, а при разрастании куча пересобирается.
+# - Срок следующего напоминания — лесенка (часы после отправки вопроса), сдвинутая за тихие часы
+#   в часовом поясе пары (next_due).
+# - Срабатывания проходят через ведро токенов: пачка просроченных после простоя напоминаний
+#   растягивается во времени и не упирается в лимиты Telegram.
+# - Сам планировщик ничего не хранит: сроки вычисляются из состояния пары (pending.sent_at, reminded),
+#   поэтому после перезапуска куча собирается заново за O(n).
+
+import time
+import heapq
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Tuple, Optional, Iterable, Callable, Awaitable
+from zoneinfo import ZoneInfo
+
+from delivery import TokenBucket
+
+MAX_SLEEP = 300.0   # не спать дольше: переживает перевод часов и сон машины
+
+
+def parse_hours(args: Iterable[str]) -> List[float]:
+    # «4 24 72» или «4,24,72» → [4.0, 24.0, 72.0]; лесенка должна строго возрастать
+    hours = [float(x) for arg in args for x in arg.split(",") if x]
+    if any(h <= 0 for h in hours) or any(b <= a for a, b in zip(hours, hours[1:])):
+        raise ValueError("hours must be positive and increasing")
+    return hours
+
+
+def parse_quiet(text: str) -> Optional[List[int]]:
+    # «23-9» → [23, 9]; «off» → None
+    if text in ("off", "-", ""):
+        return None
+    start, end = (int(x) for x in text.split("-"))
+    if not (0 <= start < 24 and 0 <= end < 24) or start == end:
+        raise ValueError("quiet hours must be H1-H2 within 0..23")
+    return [start, end]
+
+
+def parse_tz(name: str) -> str:
+    try:
+        ZoneInfo(name)
+    except (KeyError, ValueError):
+        raise ValueError(f"unknown time zone: {name}")
+    return name
+
+
+def after_quiet(ts: float, tz: str, quiet: Optional[List[int]]) -> float:
+    # срок внутри тихих часов переносится на их конец по местному времени
+    if not quiet:
+        return ts
+    start, end = quiet
+    local = datetime.fromtimestamp(ts, ZoneInfo(tz))
+    hour = local.hour
+    inside = start <= hour < end if start < end else (hour >= start or hour < end)
+    if not inside:
+        return ts
+    target = local.replace(hour=end, minute=0, second=0, microsecond=0)
+    if target <= local:
+        target += timedelta(days=1)
+    return target.timestamp()
+
+
+def next_due(pending: Dict[str, Any], hours: List[float], tz: str, quiet: Optional[List[int]],
+             now: float) -> Optional[float]:
+    step = pending.get("reminded", 0)
+    if step >= len(hours):
+        return None
+    sent_at = pending.get("sent_at") or now   # бот проставляет sent_at при планировании (stamp_sent_at)
+    return after_quiet(sent_at + hours[step] * 3600, tz, quiet)
+
+
+class ReminderScheduler:
+    def __init__(self, fire: Callable[[str], Awaitable[None]], rate: float = 5.0, burst: float = 20.0,
+                 clock: Callable[[], float] = time.time):
+        self.fire = fire              # fire(key) — отправить напоминание и при необходимости запланировать следующее
+        self.bucket = TokenBucket(rate, burst)
+        self.clock = clock
+        self.due: Dict[str, float] = {}                 # key → актуальный срок
+        self.heap: List[Tuple[float, str]] = []         # (срок, key), в том числе устаревшие
+        self.fired = 0
+        self.wakeups = 0
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self.due)
+
+    # ---------- сроки ----------
+    def load(self, items: Iterable[Tuple[str, float]]) -> None:
+        self.due = dict(items)
+        self.heap = [(when, key) for key, when in self.due.items()]
+        heapq.heapify(self.heap)
+
+    def schedule(self, key: str, when: Optional[float]) -> None:
+        if when is None:
+            self.cancel(key)
+            return
+        if self.due.get(key) == when:
+            return
+        self.due[key] = when
+        heapq.heappush(self.heap, (when, key))
+        if len(self.heap) > 2 * len(self.due) + 1024:
+            self.load(self.due.items())
+        if self._wake is not None and self.heap[0] == (when, key):
+            self._wake.set()   # новый ближайший срок — разбудить раньше
+
+    def cancel(self, key: str) -> None:
+        self.due.pop(key, None)
+
+    def _prune(self) -> None:
+        heap, due = self.heap, self.due
+        while heap and due.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+
+    # ---------- цикл ----------
+    async def _run(self) -> None:
+        while True:
+            self._prune()
+            now = self.clock()
+            while self.heap and self.heap[0][0] <= now:
+                when, key = heapq.heappop(self.heap)
+                if self.due.get(key) != when:
+                    continue
+                del self.due[key]
+                await self.bucket.acquire()
+                try:
+                    await self.fire(key)
+                    self.fired += 1
+                except Exception:
+                    logging.exception("reminder %s failed", key)
+                self._prune()
+                now = self.clock()
+            timeout = min(MAX_SLEEP, self.heap[0][0] - now) if self.heap else MAX_SLEEP
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeups += 1
+
+    def start(self) -> None:
+        if self._task is None:
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            self._wake = None
@@ -0,0 +1,911 @@
+# storage.py — резидентное состояние бота с отложенной (write-behind) записью на диск
+# - Состояние читается один раз при старте, дальше все чтения идут из памяти.
+# - Каждое изменение записывается операцией record(op, ...) и сбрасывается пачкой:
+#   по таймеру, по порогу и при остановке. caught_up() — противодавление: источник изменений
+#   ждёт, пока фоновая запись заберёт накопленное.
+# - Бэкенды: JsonBackend (атомарная перезапись state.json через временный файл + os.replace),
+#   SqliteBackend (WAL, одна строка на операцию вместо перезаписи всего документа)
+#   и JournalBackend (журнал событий с fsync на пачку и периодическим снимком в state.json).
+# - Бэкенд перечисляет свои файлы (files) и положение записи (image_meta/resume), чтобы состояние
+#   можно было поднять из образа быстрого старта (startup.py) без чтения хранилища.
+
+import gc
+import os
+import json
+import time
+import asyncio
+import re
+import logging
+from pathlib import Path
+from typing import Dict, Any, Callable, Iterable, Iterator, Optional, List, Tuple
+
+from dedupe import new_window, ring_push, build, ordered
+
+
+def atomic_write_bytes(path: Path, data: bytes) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def atomic_write_text(path: Path, text: str) -> None:
+    atomic_write_bytes(path, text.encode("utf-8"))
+
+
+def atomic_write_chunks(path: Path, chunks: Iterable[str]) -> None:
+    # то же по частям: большой документ не собирается в одну строку
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        for chunk in chunks:
+            f.write(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def empty_pair(pair_id: str) -> Dict[str, Any]:
+    return {"id": pair_id, "code": None, "roles": {"A": None, "B": None}, "pending": None,
+            "draft_answers": [], "completed_by_user": {}, "participants": [],
+            "bank": "default", "other_banks": {}, "reminders": None, "phase": None,
+            "delivery": None}
+
+
+# ---------- BACKENDS ----------
+# Операции (op, *args), которые присылает бот:
+#   pair           (pair)                  — роли, код приглашения, текущий банк вопросов и настройки напоминаний
+#   roles_swapped  (pair)                  — то же после обмена ролями (в журнале — отдельное событие)
+#   pending        (pair)                  — текущий вопрос пары (или его отсутствие)
+#   reminded       (pair)                  — по текущему вопросу отправлено ещё одно напоминание
+#   phase          (pair)                  — пара перешла в другую фазу (и id задания доставки, см. phases.py)
+#   draft          (pair, item)            — новый черновик ответа
+#   drafts_cleared (pair)
+#   completed      (pair, user_id, qnum)   — user_id получил ответ на qnum (в текущем банке пары)
+#   completed_reset(pair)                  — очистка закрытий текущего банка
+#   member         (pair, user_id)         — участник вошёл в пару
+#   pair_deleted   (pair)
+#   meta           (key, value)
+#   outbox_put     (job)                   — задание доставки создано или продвинулось
+#   outbox_done    (job)
+#   seen           (window, key)           — ключ попал в окно повторов root["dedupe"] (см. dedupe.py)
+class JsonBackend:
+    def __init__(self, path: Path):
+        self.path = path
+
+    def read(self) -> Optional[Dict[str, Any]]:
+        if self.path.exists():
+            try:
+                return json.loads(self.path.read_text(encoding="utf-8"))
+            except Exception:
+                logging.exception("%s read error", self.path.name)
+        return None
+
+    def encode(self, op: str, args: tuple) -> Any:
+        # JSON пишет снимок целиком, отдельные операции ему не нужны
+        return None
+
+    def prepare(self, state: Dict[str, Any], changes: List[Any]) -> Any:
+        return json.dumps(state, ensure_ascii=False, separators=(",", ":"))
+
+    def write(self, payload: Any) -> None:
+        atomic_write_text(self.path, payload)
+
+    def files(self) -> List[Path]:
+        return [self.path]
+
+    def image_meta(self) -> Dict[str, Any]:
+        return {}
+
+    def resume(self, meta: Dict[str, Any]) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS pairs (
+    id TEXT PRIMARY KEY, code TEXT UNIQUE, role_a INTEGER, role_b INTEGER, bank TEXT NOT NULL DEFAULT 'default',
+    reminders TEXT, phase TEXT, delivery TEXT
+);
+CREATE TABLE IF NOT EXISTS participants (
+    user_id INTEGER PRIMARY KEY, pair_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS participants_pair ON participants(pair_id);
+CREATE TABLE IF NOT EXISTS pending (
+    pair_id TEXT PRIMARY KEY, from_user INTEGER NOT NULL, to_user INTEGER NOT NULL, qnum INTEGER NOT NULL,
+    sent_at REAL, reminded INTEGER NOT NULL DEFAULT 0, pick TEXT
+);
+CREATE TABLE IF NOT EXISTS drafts (
+    pair_id TEXT NOT NULL, seq INTEGER NOT NULL, item TEXT NOT NULL, PRIMARY KEY (pair_id, seq)
+);
+CREATE TABLE IF NOT EXISTS completions (
+    user_id INTEGER NOT NULL, qnum INTEGER NOT NULL, pair_id TEXT NOT NULL, bank TEXT NOT NULL DEFAULT 'default',
+    PRIMARY KEY (user_id, qnum, pair_id, bank)
+);
+CREATE TABLE IF NOT EXISTS outbox (id TEXT PRIMARY KEY, job TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS dedupe (n INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL);
+"""
+
+
+class SqliteBackend:
+    def __init__(self, path: Path):
+        import sqlite3   # только для этого бэкенда: остальным не нужен при старте
+        self.path = path
+        self.conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SQLITE_SCHEMA)
+        self._add_banks()
+        self._add_reminders()
+        self._add_phase()
+        self._add_pick()
+        self.conn.execute("CREATE INDEX IF NOT EXISTS completions_pair ON completions(pair_id, bank)")
+
+    def _columns(self, table: str) -> List[str]:
+        return [row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")]
+
+    def _add_banks(self) -> None:
+        # базы, созданные до появления банков вопросов: всё прежнее относится к банку «default»
+        c = self.conn
+        if "bank" not in self._columns("pairs"):
+            c.execute("ALTER TABLE pairs ADD COLUMN bank TEXT NOT NULL DEFAULT 'default'")
+        if "bank" not in self._columns("completions"):
+            # bank входит в первичный ключ, поэтому таблицу приходится пересоздать
+            c.executescript("""
+                BEGIN;
+                DROP INDEX IF EXISTS completions_pair;
+                ALTER TABLE completions RENAME TO completions_old;
+                CREATE TABLE completions (
+                    user_id INTEGER NOT NULL, qnum INTEGER NOT NULL, pair_id TEXT NOT NULL,
+                    bank TEXT NOT NULL DEFAULT 'default', PRIMARY KEY (user_id, qnum, pair_id, bank)
+                );
+                INSERT INTO completions(user_id, qnum, pair_id) SELECT user_id, qnum, pair_id FROM completions_old;
+                DROP TABLE completions_old;
+                COMMIT;
+            """)
+
+    def _add_reminders(self) -> None:
+        c = self.conn
+        if "reminders" not in self._columns("pairs"):
+            c.execute("ALTER TABLE pairs ADD COLUMN reminders TEXT")
+        if "sent_at" not in self._columns("pending"):
+            c.execute("ALTER TABLE pending ADD COLUMN sent_at REAL")
+            c.execute("ALTER TABLE pending ADD COLUMN reminded INTEGER NOT NULL DEFAULT 0")
+
+    def _add_phase(self) -> None:
+        # NULL — фаза не записывалась: бот выведет её из pending (phases.repair)
+        if "phase" not in self._columns("pairs"):
+            self.conn.execute("ALTER TABLE pairs ADD COLUMN phase TEXT")
+        # id задания доставки текущего раунда; NULL — фаза записана до появления столбца
+        if "delivery" not in self._columns("pairs"):
+            self.conn.execute("ALTER TABLE pairs ADD COLUMN delivery TEXT")
+
+    def _add_pick(self) -> None:
+        # как был выбран активный вопрос (random | specific); NULL — вопрос задан до появления столбца
+        if "pick" not in self._columns("pending"):
+            self.conn.execute("ALTER TABLE pending ADD COLUMN pick TEXT")
+
+    def read(self) -> Optional[Dict[str, Any]]:
+        c = self.conn
+        if not any(c.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone() for table in ("meta", "dedupe")):
+            return None
+        root: Dict[str, Any] = {"pairs": {}, "user_pair": {}, "invites": {}, "outbox": {}}
+        for key, value in c.execute("SELECT key, value FROM meta"):
+            root[key] = json.loads(value)
+        for pair_id, code, role_a, role_b, bank, reminders, phase, delivery in c.execute(
+                "SELECT id, code, role_a, role_b, bank, reminders, phase, delivery FROM pairs"):
+            pair = root["pairs"][pair_id] = empty_pair(pair_id)
+            pair.update(code=code, roles={"A": role_a, "B": role_b}, bank=bank,
+                        reminders=json.loads(reminders) if reminders else None, phase=phase,
+                        delivery=delivery)
+            if code:
+                root["invites"][code] = pair_id
+        pairs = root["pairs"]
+        for user_id, pair_id in c.execute("SELECT user_id, pair_id FROM participants ORDER BY rowid"):
+            pairs[pair_id]["participants"].append(user_id)
+            root["user_pair"][str(user_id)] = pair_id
+        for pair_id, from_user, to_user, qnum, sent_at, reminded, pick in c.execute(
+                "SELECT pair_id, from_user, to_user, qnum, sent_at, reminded, pick FROM pending"):
+            pairs[pair_id]["pending"] = {"to_user": to_user, "from_user": from_user, "qnum": qnum,
+                                         "sent_at": sent_at, "reminded": reminded}
+            if pick:
+                pairs[pair_id]["pending"]["pick"] = pick
+        for pair_id, item in c.execute("SELECT pair_id, item FROM drafts ORDER BY pair_id, seq"):
+            pairs[pair_id]["draft_answers"].append(json.loads(item))
+        for pair_id, user_id, qnum, bank in c.execute("SELECT pair_id, user_id, qnum, bank FROM completions ORDER BY qnum"):
+            pair = pairs[pair_id]
+            by_user = pair["completed_by_user"] if bank == pair["bank"] else pair["other_banks"].setdefault(bank, {})
+            by_user.setdefault(str(user_id), []).append(qnum)
+        for job_id, job in c.execute("SELECT id, job FROM outbox"):
+            root["outbox"][job_id] = json.loads(job)
+        keys = [key for (key,) in c.execute("SELECT key FROM dedupe ORDER BY n")]
+        if keys:
+            # размер окна задаёт бот (upgrade_state), здесь — только порядок ключей
+            root["dedupe"] = build(keys, len(keys))
+        return root
+
+    def encode(self, op: str, args: tuple) -> List[Tuple[str, tuple]]:
+        # значения снимаются в момент изменения, поэтому пачка воспроизводит точную последовательность
+        if op == "meta":
+            key, value = args
+            return [("INSERT INTO meta(key, value) VALUES(?, ?) "
+                     "ON CONFLICT(key) DO UPDATE SET value=excluded.value", (key, json.dumps(value)))]
+        if op == "outbox_put":
+            return [("INSERT OR REPLACE INTO outbox(id, job) VALUES(?, ?)",
+                     (args[0]["id"], json.dumps(args[0], ensure_ascii=False)))]
+        if op == "outbox_done":
+            return [("DELETE FROM outbox WHERE id=?", (args[0]["id"],))]
+        if op == "seen":
+            # строки старше окна удаляются сразу: таблица не растёт
+            return [("INSERT INTO dedupe(key) VALUES(?)", (args[1],)),
+                    ("DELETE FROM dedupe WHERE n <= (SELECT max(n) FROM dedupe) - ?", (args[0]["size"],))]
+        pair = args[0]
+        pid = pair["id"]
+        if op in ("pair", "roles_swapped"):
+            reminders = pair.get("reminders")
+            return [("INSERT INTO pairs(id, code, role_a, role_b, bank, reminders) VALUES(?, ?, ?, ?, ?, ?) "
+                     "ON CONFLICT(id) DO UPDATE SET code=excluded.code, role_a=excluded.role_a, "
+                     "role_b=excluded.role_b, bank=excluded.bank, reminders=excluded.reminders",
+                     (pid, pair.get("code"), pair["roles"]["A"], pair["roles"]["B"], pair.get("bank", "default"),
+                      json.dumps(reminders) if reminders else None))]
+        if op == "pending":
+            p = pair.get("pending")
+            if not p:
+                return [("DELETE FROM pending WHERE pair_id=?", (pid,))]
+            return [("INSERT OR REPLACE INTO pending(pair_id, from_user, to_user, qnum, sent_at, reminded, pick) "
+                     "VALUES(?, ?, ?, ?, ?, ?, ?)",
+                     (pid, p["from_user"], p["to_user"], p["qnum"], p.get("sent_at"), p.get("reminded", 0),
+                      p.get("pick")))]
+        if op == "reminded":
+            return [("UPDATE pending SET reminded=? WHERE pair_id=?", (pair["pending"]["reminded"], pid))]
+        if op == "phase":
+            return [("UPDATE pairs SET phase=?, delivery=? WHERE id=?",
+                     (pair.get("phase"), pair.get("delivery"), pid))]
+        if op == "draft":
+            return [("INSERT INTO drafts(pair_id, seq, item) VALUES(?, ?, ?)",
+                     (pid, len(pair["draft_answers"]) - 1, json.dumps(args[1], ensure_ascii=False)))]
+        if op == "drafts_cleared":
+            return [("DELETE FROM drafts WHERE pair_id=?", (pid,))]
+        if op == "completed":
+            bank = args[3] if len(args) > 3 else pair.get("bank", "default")
+            return [("INSERT OR IGNORE INTO completions(user_id, qnum, pair_id, bank) VALUES(?, ?, ?, ?)",
+                     (args[1], args[2], pid, bank))]
+        if op == "completed_reset":
+            return [("DELETE FROM completions WHERE pair_id=? AND bank=?", (pid, pair.get("bank", "default")))]
+        if op == "member":
+            return [("INSERT OR REPLACE INTO participants(user_id, pair_id) VALUES(?, ?)", (args[1], pid))]
+        if op == "pair_deleted":
+            return [(f"DELETE FROM {table} WHERE pair_id=?", (pid,))
+                    for table in ("participants", "pending", "drafts", "completions")] + \
+                   [("DELETE FROM pairs WHERE id=?", (pid,))]
+        raise ValueError(f"unknown storage op: {op}")
+
+    def prepare(self, state: Dict[str, Any], changes: List[Any]) -> Any:
+        return [stmt for batch in changes for stmt in batch]
+
+    def write(self, payload: Any) -> None:
+        c = self.conn
+        c.execute("BEGIN")
+        try:
+            for sql, params in payload:
+                c.execute(sql, params)
+            c.execute("COMMIT")
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
+
+    def import_state(self, root: Dict[str, Any]) -> None:
+        # разовая миграция: полный снимок состояния → строки таблиц
+        stmts: List[Tuple[str, tuple]] = []
+        for key, value in root.items():
+            if key not in ("pairs", "user_pair", "invites", "outbox", "dedupe"):
+                stmts += self.encode("meta", (key, value))
+        for job in root.get("outbox", {}).values():
+            stmts += self.encode("outbox_put", (job,))
+        if root.get("dedupe"):
+            stmts += [("INSERT INTO dedupe(key) VALUES(?)", (key,)) for key in ordered(root["dedupe"])]
+        for pair in root["pairs"].values():
+            stmts += self.encode("pair", (pair,))
+            stmts += self.encode("phase", (pair,))
+            stmts += self.encode("pending", (pair,))
+            for uid in pair["participants"]:
+                stmts += self.encode("member", (pair, uid))
+            for seq, item in enumerate(pair["draft_answers"]):
+                stmts.append(("INSERT INTO drafts(pair_id, seq, item) VALUES(?, ?, ?)",
+                              (pair["id"], seq, json.dumps(item, ensure_ascii=False))))
+            for uid, qnums in pair["completed_by_user"].items():
+                for qnum in qnums:
+                    stmts += self.encode("completed", (pair, int(uid), qnum))
+            for bank, by_user in pair.get("other_banks", {}).items():
+                for uid, qnums in by_user.items():
+                    for qnum in qnums:
+                        stmts += self.encode("completed", (pair, int(uid), qnum, bank))
+        self.write(stmts)
+
+    def files(self) -> List[Path]:
+        # незачекпойнченные изменения лежат в -wal, файл базы при этом не меняется
+        return [self.path, Path(f"{self.path}-wal")]
+
+    def image_meta(self) -> Dict[str, Any]:
+        return {}
+
+    def resume(self, meta: Dict[str, Any]) -> None:
+        pass
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+# ---------- JOURNAL ----------
+# Журнал событий: каждая операция — одна короткая JSON-строка, дописываемая в конец файла,
+# пачка строк сбрасывается одним fsync. Когда журнал вырастает до compact_bytes, очередной сброс
+# закрывает сегмент (переименование в state.journal.<N>, журнал начинается заново) и в том же
+# потоке записи собирает новый снимок (в формате state.json) из прежнего снимка и закрытых
+# сегментов — цикл событий не сериализует состояние. Старые сегменты остаются как история пары,
+# если keep не ограничивает их число.
+# При старте: снимок + закрытые сегменты, ещё не вошедшие в него (упали до нового снимка),
+# + события журнала поверх них.
+JOURNAL_EVENTS = {
+    "pair": "pair_updated", "roles_swapped": "roles_swapped", "pending": "question_sent", "reminded": "reminder_sent",
+    "phase": "phase_changed", "draft": "draft_added", "drafts_cleared": "drafts_cleared", "completed": "answer_delivered",
+    "completed_reset": "history_reset", "member": "member_joined", "pair_deleted": "pair_deleted",
+    "meta": "meta", "outbox_put": "outbox_put", "outbox_done": "outbox_done", "seen": "update_seen",
+}
+
+
+def apply_event(root: Dict[str, Any], ev: Dict[str, Any]) -> None:
+    kind = ev["e"]
+    if kind == "meta":
+        root[ev["k"]] = ev["v"]
+        return
+    if kind == "outbox_put":
+        root["outbox"][ev["job"]["id"]] = ev["job"]
+        return
+    if kind == "outbox_done":
+        root["outbox"].pop(ev["id"], None)
+        return
+    if kind == "update_seen":
+        ring_push(root.setdefault("dedupe", new_window()), ev["k"])
+        return
+    pid = ev["p"]
+    if kind == "pair_deleted":
+        pair = root["pairs"].pop(pid, None)
+        if pair:
+            if pair.get("code"):
+                root["invites"].pop(pair["code"], None)
+            for uid in pair["participants"]:
+                root["user_pair"].pop(str(uid), None)
+        return
+    pair = root["pairs"].get(pid)
+    if pair is None:
+        pair = root["pairs"][pid] = empty_pair(pid)
+    if kind in ("pair_updated", "roles_swapped"):
+        if pair.get("code") and pair["code"] != ev["code"]:
+            root["invites"].pop(pair["code"], None)
+        pair["code"] = ev["code"]
+        if ev["code"]:
+            root["invites"][ev["code"]] = pid
+        pair["roles"] = {"A": ev["a"], "B": ev["b"]}
+        pair["reminders"] = ev.get("rem")
+        bank = ev.get("bank", "default")
+        if bank != pair["bank"]:
+            # то же, что переключение банка в боте: закрытия текущего банка уходят в other_banks
+            pair["other_banks"][pair["bank"]] = pair["completed_by_user"]
+            pair["completed_by_user"] = pair["other_banks"].pop(bank, {})
+            pair["bank"] = bank
+    elif kind == "member_joined":
+        if ev["u"] not in pair["participants"]:
+            pair["participants"].append(ev["u"])
+        root["user_pair"][str(ev["u"])] = pid
+    elif kind == "question_sent":
+        pair["pending"] = ev["q"]
+    elif kind == "reminder_sent":
+        if pair["pending"]:
+            pair["pending"]["reminded"] = ev["n"]
+    elif kind == "phase_changed":
+        pair["phase"] = ev["s"]
+        pair["delivery"] = ev.get("j")
+    elif kind == "draft_added":
+        pair["draft_answers"].append(ev["item"])
+    elif kind == "drafts_cleared":
+        pair["draft_answers"] = []
+    elif kind == "answer_delivered":
+        bank = ev.get("bank", pair["bank"])
+        by_user = pair["completed_by_user"] if bank == pair["bank"] else pair["other_banks"].setdefault(bank, {})
+        qnums = by_user.setdefault(str(ev["u"]), [])
+        if ev["q"] not in qnums:
+            qnums.append(ev["q"])
+    elif kind == "history_reset":
+        pair["completed_by_user"] = {}
+    else:
+        raise ValueError(f"unknown journal event: {kind}")
+
+
+# Снимок собирается в потоке записи, но json.loads/json.dumps целого состояния — один вызов C,
+# который держит GIL всё время работы, и цикл событий стоял бы так же, как без потока. Поэтому
+# снимок разбирается и пишется по записям двух верхних уровней (пары, user_pair, …): много
+# коротких вызовов, между которыми поток отдаёт GIL. Формат — обычный JSON-объект.
+_WS = re.compile(r"[ \t\n\r]*")
+_DECODER = json.JSONDecoder()
+
+
+def _decode_object(text: str, pos: int, depth: int) -> Tuple[Dict[str, Any], int]:
+    # {ключ: значение, …} начиная с text[pos] == "{"; на depth > 0 значения-объекты разбираются так же
+    result: Dict[str, Any] = {}
+    pos = _WS.match(text, pos + 1).end()
+    if text[pos] == "}":
+        return result, pos + 1
+    while True:
+        key, pos = _DECODER.raw_decode(text, pos)
+        pos = _WS.match(text, pos).end()
+        pos = _WS.match(text, pos + 1).end()          # ":"
+        if depth and text[pos] == "{":
+            result[key], pos = _decode_object(text, pos, depth - 1)
+        else:
+            result[key], pos = _DECODER.raw_decode(text, pos)
+        pos = _WS.match(text, pos).end()
+        if text[pos] == "}":
+            return result, pos + 1
+        pos = _WS.match(text, pos + 1).end()          # ","
+
+
+def load_snapshot(text: str) -> Dict[str, Any]:
+    root, pos = _decode_object(text, _WS.match(text).end(), 1)
+    if _WS.match(text, pos).end() != len(text):
+        raise ValueError("extra data after snapshot")
+    return root
+
+
+def dump_snapshot(root: Dict[str, Any]) -> Iterator[str]:
+    def dumps(value: Any) -> str:
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+    sep = "{"
+    for key, value in root.items():
+        if isinstance(value, dict):
+            yield f"{sep}{dumps(key)}:{{"
+            inner = ""
+            for k, v in value.items():
+                yield f"{inner}{dumps(k)}:{dumps(v)}"
+                inner = ",\n"
+            yield "}"
+        else:
+            yield f"{sep}{dumps(key)}:{dumps(value)}"
+        sep = ",\n"
+    yield "}" if sep != "{" else "{}"
+
+
+class JournalBackend:
+    def __init__(self, snapshot_path: Path, journal_path: Path, compact_bytes: int = 4 << 20, keep: int = -1):
+        self.snapshot_path = snapshot_path
+        self.path = journal_path
+        self.compact_bytes = compact_bytes
+        self.keep = keep                    # сколько старых сегментов хранить; -1 — все
+        self.seq = 0                        # номер текущего сегмента журнала
+        self.journal_bytes = 0              # сколько дописано после последнего снимка
+        self._file = None
+
+    # ---------- чтение ----------
+    def _snapshot(self, chunked: bool = False) -> Optional[Dict[str, Any]]:
+        if not self.snapshot_path.exists():
+            return None
+        try:
+            text = self.snapshot_path.read_text(encoding="utf-8")
+            return load_snapshot(text) if chunked else json.loads(text)
+        except Exception:
+            logging.exception("%s read error", self.snapshot_path.name)
+            return None
+
+    def _segment(self, seq: int) -> Path:
+        return self.path.with_name(f"{self.path.name}.{seq}")
+
+    def _replay_sealed(self, root: Dict[str, Any], since: int, until: Optional[int] = None) -> int:
+        # закрытые сегменты since.. (до until) поверх root; закрытый сегмент дописан целиком
+        applied = 0
+        for path in sorted(self.segments(), key=lambda p: int(p.suffix[1:])):
+            seq = int(path.suffix[1:])
+            if seq < since or (until is not None and seq >= until):
+                continue
+            with open(path, encoding="utf-8") as f:
+                next(f, None)   # заголовок сегмента
+                for line in f:
+                    try:
+                        apply_event(root, json.loads(line))
+                    except ValueError:
+                        break
+                    applied += 1
+        return applied
+
+    def read(self) -> Optional[Dict[str, Any]]:
+        root = self._snapshot()
+        if root is not None:
+            self.seq = root.pop("journal_seq", 0)
+        applied = 0
+        if any(int(p.suffix[1:]) >= self.seq for p in self.segments()):
+            # сегмент закрыт, а новый снимок записать не успели
+            if root is None:
+                root = {"pairs": {}, "user_pair": {}, "invites": {}, "outbox": {}}
+            applied = self._replay_sealed(root, self.seq)
+        if not self.path.exists():
+            return root
+        data = self.path.read_bytes()
+        lines = data.split(b"\n")
+        if lines and not lines[-1]:
+            lines.pop()
+        header = json.loads(lines[0]) if lines else {"journal": self.seq}
+        if header.get("journal", self.seq) < self.seq:
+            # снимок уже включает этот сегмент (упали между снимком и сменой сегмента)
+            self._rotate(header["journal"])
+            return root
+        self.seq = header.get("journal", self.seq)
+        if root is None:
+            root = {"pairs": {}, "user_pair": {}, "invites": {}, "outbox": {}}
+        offset = len(lines[0]) + 1 if lines else 0
+        for n, line in enumerate(lines[1:], 2):
+            try:
+                ev = json.loads(line)
+            except ValueError:
+                # недописанная последняя строка после падения: отрезаем её, иначе следующая
+                # запись приклеится к обрывку
+                logging.warning("%s:%s: обрезанная запись отброшена", self.path.name, n)
+                with open(self.path, "r+b") as f:
+                    f.truncate(offset)
+                break
+            apply_event(root, ev)
+            applied += 1
+            offset += len(line) + 1
+        self.journal_bytes = offset
+        logging.info("Журнал: снимок + %s событий", applied)
+        return root
+
+    # ---------- запись ----------
+    def encode(self, op: str, args: tuple) -> str:
+        # строка собирается сразу: значения снимаются в момент изменения
+        ev: Dict[str, Any] = {"e": JOURNAL_EVENTS[op], "t": round(time.time(), 3)}
+        if op == "meta":
+            ev["k"], ev["v"] = args
+        elif op == "outbox_put":
+            ev["job"] = args[0]
+        elif op == "outbox_done":
+            ev["id"] = args[0]["id"]
+        elif op == "seen":
+            ev["k"] = args[1]
+        else:
+            pair = args[0]
+            ev["p"] = pair["id"]
+            if op in ("pair", "roles_swapped"):
+                ev.update(code=pair.get("code"), a=pair["roles"]["A"], b=pair["roles"]["B"],
+                          bank=pair.get("bank", "default"))
+                if pair.get("reminders"):
+                    ev["rem"] = pair["reminders"]
+            elif op == "pending":
+                ev["q"] = pair.get("pending")
+            elif op == "reminded":
+                ev["n"] = pair["pending"]["reminded"]
+            elif op == "phase":
+                ev["s"] = pair.get("phase")
+                if pair.get("delivery"):
+                    ev["j"] = pair["delivery"]
+            elif op == "draft":
+                ev["item"] = args[1]
+            elif op == "completed":
+                ev.update(u=args[1], q=args[2], bank=args[3] if len(args) > 3 else pair.get("bank", "default"))
+            elif op == "member":
+                ev["u"] = args[1]
+        return json.dumps(ev, ensure_ascii=False, separators=(",", ":"))
+
+    def prepare(self, state: Dict[str, Any], changes: List[Any]) -> Any:
+        lines: List[str] = []
+        compact = False
+        for change in changes:
+            if isinstance(change, dict):
+                # повтор после ошибки: только то, что write() не успел дописать (и, возможно, сжатие)
+                lines += change["lines"]
+                compact = compact or change.get("compact", False)
+            else:
+                lines.append(change)
+        size = sum(len(line) for line in lines) + len(lines)
+        self.journal_bytes += size
+        payload: Dict[str, Any] = {"lines": lines}
+        if compact or self.journal_bytes >= self.compact_bytes:
+            # в цикле событий — только отметка; сегмент закроет и снимок соберёт поток записи
+            payload["compact"] = True
+            self.journal_bytes = 0
+        return payload
+
+    def _open(self):
+        if self._file is None:
+            if self.path.exists():
+                self._cut_tail()
+            fresh = not self.path.exists() or self.path.stat().st_size == 0
+            # без буфера: write() должен знать, сколько байт действительно легло в файл
+            self._file = open(self.path, "ab", buffering=0)
+            if fresh:
+                self._append(json.dumps({"journal": self.seq}).encode() + b"\n")
+        return self._file
+
+    def _append(self, data: bytes) -> None:
+        view, done = memoryview(data), 0
+        while done < len(data):
+            done += self._file.write(view[done:])
+
+    def write(self, payload: Any) -> None:
+        lines = payload["lines"]
+        if lines:
+            f = self._open()
+            data = ("\n".join(lines) + "\n").encode()
+            start = os.fstat(f.fileno()).st_size
+            try:
+                self._append(data)
+                os.fsync(f.fileno())
+            except Exception:
+                self._unwritten(payload, data, os.fstat(f.fileno()).st_size - start)
+                raise
+            payload["lines"] = []
+        if payload.get("compact"):
+            self._seal()
+            try:
+                self._compact()
+            except Exception:
+                # события уже на диске в закрытом сегменте: повторять пачку нельзя,
+                # снимок соберётся при следующем сжатии, а до тех пор read() дочитает сегмент
+                logging.exception("%s: снимок не записан", self.snapshot_path.name)
+
+    def _unwritten(self, payload: Dict[str, Any], data: bytes, done: int) -> None:
+        # строки, дописанные целиком, уже в журнале: повтор задвоил бы при чтении неидемпотентные
+        # события (draft_added). В очередь возвращается только недописанное; обрывок строки
+        # отрежет _open() перед следующей записью
+        payload["lines"] = payload["lines"][data.count(b"\n", 0, max(done, 0)):]
+        self._file.close()
+        self._file = None
+
+    def _cut_tail(self) -> None:
+        # обрывок строки в конце (запись прервалась): следующая строка иначе приклеилась бы к нему
+        with open(self.path, "r+b") as f:
+            end = pos = f.seek(0, os.SEEK_END)
+            while pos:
+                step = min(4096, pos)
+                f.seek(pos - step)
+                cut = f.read(step).rfind(b"\n")
+                pos -= step
+                if cut >= 0:
+                    pos += cut + 1
+                    break
+            if pos != end:
+                logging.warning("%s: обрывок записи отрезан (%s байт)", self.path.name, end - pos)
+                f.truncate(pos)
+
+    def _seal(self) -> None:
+        # O(1): текущий сегмент переименовывается, следующая запись начнёт новый
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.path.exists():
+            os.replace(self.path, self._segment(self.seq))
+        self.seq += 1
+
+    def _compact(self) -> None:
+        # прежний снимок + закрытые после него сегменты → новый снимок; идёт в потоке записи
+        # сборщик мусора обходил бы растущую копию состояния много раз (и держал бы GIL), как при load()
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            root = self._snapshot(chunked=True) or {"pairs": {}, "user_pair": {}, "invites": {}, "outbox": {}}
+            since = root.pop("journal_seq", 0)
+            self._replay_sealed(root, since, self.seq)
+            root["journal_seq"] = self.seq
+            atomic_write_chunks(self.snapshot_path, dump_snapshot(root))
+            for value in root.values():
+                # копия освобождается по записи: одним del это был бы снова один долгий вызов
+                while isinstance(value, dict) and value:
+                    value.popitem()
+        finally:
+            if enabled:
+                gc.enable()
+        self._prune()
+
+    def _prune(self) -> None:
+        if self.keep < 0:
+            return
+        old = sorted(self.segments(), key=lambda p: int(p.suffix[1:]))
+        for p in old[:len(old) - self.keep]:
+            p.unlink()
+
+    def _rotate(self, seq: int) -> None:
+        # закрытый сегмент уходит в историю (или удаляется), следующий начнётся с заголовка
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if not self.path.exists():
+            return
+        if self.keep == 0:
+            self.path.unlink()
+            return
+        os.replace(self.path, self._segment(seq))
+        self._prune()
+
+    def segments(self) -> List[Path]:
+        return [p for p in self.path.parent.glob(self.path.name + ".*") if p.suffix[1:].isdigit()]
+
+    def files(self) -> List[Path]:
+        return [self.snapshot_path, self.path]
+
+    def image_meta(self) -> Dict[str, Any]:
+        return {"seq": self.seq, "journal_bytes": self.journal_bytes}
+
+    def resume(self, meta: Dict[str, Any]) -> None:
+        # то, что read() узнал бы из снимка и журнала
+        self.seq = meta["seq"]
+        self.journal_bytes = meta["journal_bytes"]
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def journal_events(journal_path: Path):
+    # все события по порядку: архивные сегменты, затем текущий журнал (для истории пары)
+    backend = JournalBackend(journal_path, journal_path)
+    paths = sorted(backend.segments(), key=lambda p: int(p.suffix[1:])) + [journal_path]
+    for path in paths:
+        if not path.exists():
+            continue
+        with open(path, encoding="utf-8") as f:
+            next(f, None)   # заголовок сегмента
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    break
+
+
+# ---------- STORE ----------
+class StateStore:
+    def __init__(self, backend, default_factory: Callable[[], Dict[str, Any]],
+                 upgrade: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+                 flush_interval: float = 2.0, max_dirty: int = 50):
+        self.backend = backend
+        self.default_factory = default_factory
+        self.upgrade = upgrade
+        self.flush_interval = flush_interval
+        self.max_dirty = max_dirty
+        self.state: Optional[Dict[str, Any]] = None
+        self.dirty = 0
+        self.flushes = 0
+        self.on_write: Optional[Callable[[float, bool], None]] = None   # (длительность записи, успех) — для метрик
+        self.preload: Optional[Callable[[], Optional[Dict[str, Any]]]] = None  # образ быстрого старта вместо read()
+        self._changes: List[Any] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._taken: Optional[asyncio.Event] = None     # будит ждущих в caught_up
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    # ---------- чтение ----------
+    def load(self) -> Dict[str, Any]:
+        if self.state is None:
+            # чтение создаёт сотни тысяч контейнеров, и сборщик мусора без пользы обходил бы их
+            # по многу раз; после чтения состояние уходит в постоянное поколение (gc.freeze) и
+            # больше не сканируется при сборках
+            enabled = gc.isenabled()
+            gc.disable()
+            try:
+                state = self.preload() if self.preload is not None else None
+                if state is None:
+                    state = self.backend.read()
+                if state is None:
+                    state = self.default_factory()
+                if self.upgrade is not None:
+                    state = self.upgrade(state)
+                self.state = state
+            finally:
+                if enabled:
+                    gc.enable()
+            gc.freeze()
+        return self.state
+
+    # ---------- запись ----------
+    def record(self, op: str, *args) -> None:
+        change = self.backend.encode(op, args)
+        if change is not None:
+            self._changes.append(change)
+        self.dirty += 1
+        if self.dirty >= self.max_dirty:
+            if self._wakeup is not None:
+                self._wakeup.set()
+            else:
+                self.flush()
+
+    def _take(self) -> Any:
+        # снимок берётся в цикле событий, поэтому он консистентен
+        payload = self.backend.prepare(self.state, self._changes)
+        self._changes = []
+        self.dirty = 0
+        if self._taken is not None:
+            self._taken.set()
+            self._taken = None
+        return payload
+
+    def _requeue(self, payload: Any) -> None:
+        # неудачная пачка вернётся в начало очереди и уйдёт со следующим сбросом
+        self._changes.insert(0, payload)
+        self.dirty += 1
+
+    def _written(self, started: float, ok: bool) -> None:
+        if self.on_write is not None:
+            self.on_write(time.perf_counter() - started, ok)
+
+    def flush(self) -> None:
+        if not self.dirty or self.state is None:
+            return
+        payload = self._take()
+        started = time.perf_counter()
+        try:
+            self.backend.write(payload)
+            self.flushes += 1
+            self._written(started, True)
+        except Exception:
+            self._requeue(payload)
+            self._written(started, False)
+            logging.exception("state write error")
+
+    async def flush_async(self) -> None:
+        if not self.dirty or self.state is None:
+            return
+        payload = self._take()
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(self.backend.write, payload)
+            self.flushes += 1
+            self._written(started, True)
+        except Exception:
+            self._requeue(payload)
+            self._written(started, False)
+            logging.exception("state write error")
+
+    # ---------- фоновый сброс ----------
+    async def _flusher(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush_async()
+
+    async def caught_up(self, limit: int, timeout: float) -> bool:
+        # противодавление: источник изменений ждёт, пока фоновая запись заберёт накопленное;
+        # False — запись не забрала его за timeout (диск не успевает)
+        if self.dirty < limit:
+            return True
+        if self._wakeup is None:
+            return False
+        if self._taken is None:
+            self._taken = asyncio.Event()
+        taken = self._taken
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(taken.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def start(self) -> None:
+        self.load()
+        if self._task is None:
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._flusher())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            # не отменяем задачу посреди записи в потоке — просим её завершиться
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+            self._wakeup = None
+        self.flush()
@@ -0,0 +1,219 @@
+# webhook.py — режим вебхука на aiohttp: приём апдейтов, /healthz, корректная остановка
+# и маршрутизатор, раздающий апдейты нескольким процессам-воркерам так, что пара всегда попадает
+# на один и тот же воркер.
+#
+# Один процесс:   BOT_MODE=webhook WEBHOOK_URL=https://host/webhook python bot.py
+# Несколько:      WORKER_SHARD=0 STATE_FILE_PATH=state.0.json BOT_MODE=webhook PORT=8081 python bot.py
+#                 WORKER_SHARD=1 STATE_FILE_PATH=state.1.json BOT_MODE=webhook PORT=8082 python bot.py
+#                 WORKER_URLS=http://127.0.0.1:8081,http://127.0.0.1:8082 WEBHOOK_URL=... python webhook.py
+# Шардирование: новый пользователь попадает на воркер hash(user_id) % N и там создаёт пару,
+# код приглашения начинается с номера воркера («1-…»), поэтому присоединившийся B
+# запоминается за тем же воркером. Карта user → воркер хранится у маршрутизатора (ROUTER_STATE_PATH).
+# Вход по коду воркер обрабатывает сразу и отвечает, состоит ли пользователь теперь в паре; карта
+# меняется только после такого подтверждения. Опечатка в коде или старая ссылка никого не переносят,
+# а пользователь из полной пары (GET /member/ID на его воркере) остаётся на своём воркере.
+
+import os
+import re
+import signal
+import asyncio
+import logging
+from pathlib import Path
+from typing import Dict, Any, Optional, Callable, Awaitable, List
+
+from aiohttp import web, ClientSession, ClientTimeout
+
+from storage import StateStore, JsonBackend
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+JOIN_RE = re.compile(r"^/(?:start|join)(?:@\w+)?\s+(\d+)-\S+")
+
+
+def webhook_path() -> str:
+    return os.getenv("WEBHOOK_PATH", "/webhook")
+
+
+def join_text(data: Dict[str, Any]) -> Optional[re.Match]:
+    return JOIN_RE.match((data.get("message") or {}).get("text") or "")
+
+
+def make_web_app(process: Callable[[Dict[str, Any]], Awaitable[Optional[Dict[str, Any]]]],
+                 health: Callable[[], Dict[str, Any]],
+                 secret: Optional[str], path: str,
+                 member: Optional[Callable[[int], Dict[str, Any]]] = None) -> web.Application:
+    async def on_update(request: web.Request) -> web.Response:
+        if secret and request.headers.get(SECRET_HEADER) != secret:
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+        except Exception:
+            return web.Response(status=400)
+        result = await process(data)
+        # вход по коду: в ответе — членство отправителя после обработки (см. Router.forward)
+        return web.json_response(result) if result is not None else web.Response()
+
+    async def on_health(request: web.Request) -> web.Response:
+        return web.json_response(health())
+
+    async def on_member(request: web.Request) -> web.Response:
+        if secret and request.headers.get(SECRET_HEADER) != secret:
+            return web.Response(status=403)
+        return web.json_response(member(int(request.match_info["user_id"])))
+
+    web_app = web.Application()
+    web_app.router.add_post(path, on_update)
+    web_app.router.add_get("/healthz", on_health)
+    if member is not None:
+        web_app.router.add_get("/member/{user_id}", on_member)
+    return web_app
+
+
+async def _serve_until_signal(web_app: web.Application, host: str, port: int) -> web.AppRunner:
+    runner = web.AppRunner(web_app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info("HTTP слушает %s:%s", host, port)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+    await stop.wait()
+    return runner
+
+
+# ---------- ВОРКЕР ----------
+async def run_worker(app, host: str, port: int, webhook_url: Optional[str], secret: Optional[str],
+                     health: Callable[[], Dict[str, Any]], member: Callable[[int], Dict[str, Any]]) -> None:
+    from telegram import Update
+
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    if webhook_url:
+        await app.bot.set_webhook(webhook_url, secret_token=secret, allowed_updates=Update.ALL_TYPES)
+
+    async def process(data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        update = Update.de_json(data, app.bot)
+        if join_text(data) and update.effective_user:
+            # маршрутизатор ждёт итога входа, прежде чем закрепить пользователя за этим воркером
+            await app.process_update(update)
+            return member(update.effective_user.id)
+        await app.update_queue.put(update)
+        return None
+
+    runner = await _serve_until_signal(make_web_app(process, health, secret, webhook_path(), member),
+                                       host, port)
+    # порядок остановки: перестать принимать → доработать очередь → сбросить состояние
+    await runner.cleanup()
+    await app.stop()
+    if app.post_shutdown:
+        await app.post_shutdown(app)
+    await app.shutdown()
+
+
+# ---------- МАРШРУТИЗАТОР ----------
+def update_user_id(data: Dict[str, Any]) -> Optional[int]:
+    for key, value in data.items():
+        if isinstance(value, dict):
+            sender = value.get("from") or value.get("user")
+            if isinstance(sender, dict) and "id" in sender:
+                return sender["id"]
+            chat = value.get("chat")
+            if isinstance(chat, dict) and "id" in chat:
+                return chat["id"]
+    return None
+
+
+class Router:
+    def __init__(self, workers: List[str], store: StateStore):
+        self.workers = workers
+        self.store = store   # {"user_worker": {str(user_id): index}}
+
+    def route(self, data: Dict[str, Any]) -> int:
+        # текущий воркер пользователя; вход по коду сюда не смотрит — см. forward
+        user_id = update_user_id(data)
+        if user_id is None:
+            return 0
+        known = self.store.load().setdefault("user_worker", {}).get(str(user_id))
+        return known if known is not None else user_id % len(self.workers)
+
+    def join_worker(self, data: Dict[str, Any]) -> Optional[int]:
+        m = join_text(data)
+        return int(m.group(1)) if m and int(m.group(1)) < len(self.workers) else None
+
+    async def forward(self, session: ClientSession, data: Dict[str, Any], headers: Dict[str, str],
+                      path: str) -> None:
+        user_id = update_user_id(data)
+        target = self.route(data)
+        join = self.join_worker(data)
+        if join == target or join is not None and (await self._member(session, target, user_id, headers))["full"]:
+            join = None     # уже на воркере пары или в полной паре: остаётся на своём воркере, тот и ответит
+        elif join is not None:
+            # вход по коду: апдейт уходит воркеру пары, но пользователь переезжает, только если вошёл
+            target = join
+        async with session.post(self.workers[target] + path, json=data, headers=headers) as resp:
+            if resp.status != 200:
+                # не 200 → Telegram повторит доставку апдейта позже
+                raise web.HTTPServiceUnavailable()
+            result = await resp.json(content_type=None) if join is not None else None
+        if result and result.get("pair") is not None:
+            self.store.load().setdefault("user_worker", {})[str(user_id)] = join
+            self.store.record("user_worker", user_id)
+
+    async def _member(self, session: ClientSession, worker: int, user_id: int,
+                      headers: Dict[str, str]) -> Dict[str, Any]:
+        async with session.get(f"{self.workers[worker]}/member/{user_id}", headers=headers) as resp:
+            if resp.status != 200:
+                raise web.HTTPServiceUnavailable()
+            return await resp.json()
+
+
+async def run_router(workers: List[str], host: str, port: int, webhook_url: Optional[str],
+                     secret: Optional[str], state_path: Path, token: Optional[str]) -> None:
+    store = StateStore(JsonBackend(state_path), dict)
+    store.start()
+    router = Router(workers, store)
+    session = ClientSession(timeout=ClientTimeout(total=30))
+    headers = {SECRET_HEADER: secret} if secret else {}
+    path = webhook_path()
+
+    async def process(data: Dict[str, Any]) -> None:
+        await router.forward(session, data, headers, path)
+
+    def health() -> Dict[str, Any]:
+        return {"status": "ok", "role": "router", "workers": len(workers),
+                "users": len(store.load().get("user_worker", {}))}
+
+    if webhook_url and token:
+        from telegram import Bot, Update
+        async with Bot(token) as bot:
+            await bot.set_webhook(webhook_url, secret_token=secret, allowed_updates=Update.ALL_TYPES)
+
+    runner = await _serve_until_signal(make_web_app(process, health, secret, path), host, port)
+    await runner.cleanup()
+    await session.close()
+    await store.stop()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
+    workers = [u.strip().rstrip("/") for u in os.getenv("WORKER_URLS", "").split(",") if u.strip()]
+    if not workers:
+        raise SystemExit("Укажите WORKER_URLS=http://host:port,... для маршрутизатора.")
+    asyncio.run(run_router(
+        workers,
+        host=os.getenv("WEBHOOK_LISTEN", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8080")),
+        webhook_url=os.getenv("WEBHOOK_URL"),
+        secret=os.getenv("WEBHOOK_SECRET"),
+        state_path=Path(os.getenv("ROUTER_STATE_PATH", "router.json")),
+        token=os.getenv("TELEGRAM_TOKEN"),
+    ))
+
+
+if __name__ == "__main__":
+    main()